@@ -0,0 +1,61 @@
+
+'''
+Measures the cold import time of pplns_python modules with `python -X importtime`.
+
+  python bench/import_time.py [module ...]
+'''
+
+import subprocess
+import sys
+
+default_modules : list[str] = [
+  'pplns_python',
+  'pplns_python.api',
+  'pplns_python.stream',
+]
+
+def import_time(module : str) -> tuple[float, list[tuple[float, str]]]:
+
+  '''
+  Returns the cumulative import time of module in ms and the five modules with the highest self time.
+  '''
+
+  result = subprocess.run(
+    [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+    capture_output=True,
+    text=True,
+    check=True,
+  )
+
+  total : float = 0
+  entries : list[tuple[float, str]] = []
+
+  for line in result.stderr.splitlines():
+
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+
+    self_us, cumulative_us, name = \
+      [part.strip() for part in line[len('import time:'):].split('|')]
+
+    entries.append((int(self_us) / 1000, name))
+
+    if name == module:
+      total = int(cumulative_us) / 1000
+
+  return total, sorted(entries, reverse=True)[:5]
+
+def main(modules : list[str]) -> None:
+
+  for module in modules:
+
+    total, slowest = import_time(module)
+
+    print(f'{module}: {total:.1f} ms')
+
+    for ms, name in slowest:
+      print(f'  {ms:8.1f} ms  {name}')
+
+if __name__ == '__main__':
+
+  main(sys.argv[1:] or default_modules)
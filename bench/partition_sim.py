@@ -0,0 +1,146 @@
+
+'''
+Simulates replicas polling a shared bundle queue, once with every replica polling the same query and once with
+consistent hash partitioning by taskId, and reports the requests sent (consume polls and discovery calls),
+how many of them came back empty and how long bundles waited to be consumed.
+
+  python bench/partition_sim.py [replicas] [tasks] [rounds] [refresh rounds]
+
+A round is one polling interval of every replica.
+'''
+
+import collections
+import heapq
+import itertools
+import random
+import sys
+import typing
+
+from pplns_python.partitioning import \
+  Partitioner, \
+  PartitionedQueries
+
+class SimulatedApi:
+
+  '''
+  Bundle queue per task. A few tasks are busy, most of them are idle most of the time.
+  '''
+
+  def __init__(self, tasks : int, seed : int = 0) -> None:
+
+    self.random = random.Random(seed)
+    self.tasks : list[str] = [f'task-{i}' for i in range(tasks)]
+    self.rates : dict[str, float] = {
+      task: 0.8 if i < tasks // 10 else 0.05 for i, task in enumerate(self.tasks)
+    }
+    # round in which each queued bundle arrived, by task
+    self.queued : dict[str, collections.deque[int]] = { task: collections.deque() for task in self.tasks }
+    self.round : int = 0
+    self.waited : int = 0
+
+  def tick(self) -> None:
+
+    self.round += 1
+
+    for task, rate in self.rates.items():
+
+      if self.random.random() < rate:
+        self.queued[task].append(self.round)
+
+  def __oldest(self, tasks : list[str]) -> typing.Iterator[tuple[int, str]]:
+
+    return heapq.merge(*([(arrived, task) for arrived in self.queued[task]] for task in tasks))
+
+  def consume(self, query : dict[str, typing.Any], limit : int = 5) -> int:
+
+    ''' Consumes the oldest bundles matching query. '''
+
+    tasks : list[str] = [query['taskId']] if 'taskId' in query else self.tasks
+
+    taken : list[tuple[int, str]] = list(itertools.islice(self.__oldest(tasks), limit))
+
+    for arrived, task in taken:
+
+      self.queued[task].popleft()
+
+      self.waited += self.round - arrived
+
+    return len(taken)
+
+  def pending(self, query : dict[str, typing.Any], limit : int = 100) -> list[str]:
+
+    ''' Tasks of the oldest bundles, like pending_task_ids. '''
+
+    return [task for _, task in itertools.islice(self.__oldest(self.tasks), limit)]
+
+def simulate(
+  replicas : int,
+  tasks : int,
+  rounds : int,
+  refresh : int,
+  partitioned : bool
+) -> dict[str, float]:
+
+  api = SimulatedApi(tasks)
+
+  result : dict[str, float] = collections.defaultdict(float)
+
+  def discover(query : dict[str, typing.Any]) -> list[str]:
+
+    found : list[str] = api.pending(query)
+
+    result['requests'] += 1
+    result['discoveries'] += 1
+    result['empty'] += not found
+
+    return found
+
+  partitions = [
+    PartitionedQueries(Partitioner(i, replicas), discover, refresh=refresh, clock=lambda: api.round)
+    for i in range(replicas)
+  ]
+
+  for _ in range(rounds):
+
+    api.tick()
+
+    order : list[int] = list(range(replicas))
+    api.random.shuffle(order)
+
+    for replica in order:
+
+      queries = partitions[replica].queries({}) if partitioned else [{}]
+
+      for query in queries:
+
+        count : int = api.consume(query)
+
+        result['requests'] += 1
+        result['empty'] += count == 0
+        result['consumed'] += count
+
+        if partitioned:
+          partitions[replica].report(query['taskId'], count)
+
+  result['wait'] = api.waited / max(1, result['consumed'])
+
+  return result
+
+def main(replicas : int, tasks : int, rounds : int, refresh : int) -> None:
+
+  for partitioned in (False, True):
+
+    result = simulate(replicas, tasks, rounds, refresh, partitioned)
+
+    print(
+      f"{'partitioned' if partitioned else 'shared query':>12}: "
+      f"{result['requests']:7.0f} requests ({result['discoveries']:5.0f} discoveries), "
+      f"{result['empty']:7.0f} empty ({result['empty'] / result['requests']:6.1%}), "
+      f"{result['consumed']:6.0f} bundles consumed, {result['wait']:5.2f} rounds mean wait"
+    )
+
+if __name__ == '__main__':
+
+  args = [int(a) for a in sys.argv[1:]]
+
+  main(*(args + [16, 200, 1000, 10][len(args):]))
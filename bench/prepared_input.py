@@ -0,0 +1,90 @@
+
+'''
+Compares memory footprint and field lookup cost of the slotted PreparedInput record
+with the dict layout PreparedInput used to have. Both reference the same bundle dict,
+so the difference is the per-input overhead of the record itself.
+
+  python bench/prepared_input.py [count]
+'''
+
+import sys
+import timeit
+import tracemalloc
+import typing
+
+from pplns_python.processor import \
+  BundleRef, \
+  PreparedInput
+
+def make_bundle(i : int) -> dict[str, typing.Any]:
+
+  return {
+    '_id': f'bundle-{i}',
+    'taskId': f'task-{i % 10}',
+    'consumerId': f'consumer-{i % 3}',
+    'consumptionId': f'consumption-{i}',
+    'workerId': 'worker',
+  }
+
+def as_dict(bundle : dict[str, typing.Any]) -> dict[str, typing.Any]:
+
+  return {
+    '_id': bundle['_id'],
+    'taskId': bundle['taskId'],
+    'consumerId': bundle['consumerId'],
+    'inputs': {},
+    'bundle': bundle,
+  }
+
+def as_record(bundle : typing.Any) -> PreparedInput:
+
+  return PreparedInput(BundleRef.from_bundle(bundle), {}, bundle)
+
+def measure_memory(bundles : list, factory : typing.Callable) -> int:
+
+  tracemalloc.start()
+
+  before, _ = tracemalloc.get_traced_memory()
+
+  prepared = [factory(bundle) for bundle in bundles]
+
+  after, _ = tracemalloc.get_traced_memory()
+
+  tracemalloc.stop()
+
+  del prepared
+
+  return after - before
+
+def main(count : int) -> None:
+
+  bundles = [make_bundle(i) for i in range(count)]
+
+  dict_bytes = measure_memory(bundles, as_dict)
+  record_bytes = measure_memory(bundles, as_record)
+
+  print(f'prepared inputs:         {count}')
+  print(f'dict layout:             {dict_bytes / count:8.1f} bytes/input')
+  print(f'slotted record:          {record_bytes / count:8.1f} bytes/input')
+
+  d = as_dict(bundles[0])
+  r = as_record(bundles[0])
+
+  lookups = 1_000_000
+
+  dict_lookup = timeit.timeit(
+    lambda: d['bundle']['consumptionId'] if 'consumptionId' in d['bundle'] else None,
+    number=lookups,
+  )
+
+  record_lookup = timeit.timeit(lambda: r.ref.consumption_id, number=lookups)
+
+  mapping_lookup = timeit.timeit(lambda: r['taskId'], number=lookups)
+
+  print(f'consumptionId (dict):    {dict_lookup / lookups * 1e9:8.1f} ns')
+  print(f'consumption_id (record): {record_lookup / lookups * 1e9:8.1f} ns')
+  print(f"record['taskId'] (view): {mapping_lookup / lookups * 1e9:8.1f} ns")
+
+if __name__ == '__main__':
+
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,139 @@
+
+'''
+Compares the request latency of PipelineApi over loopback TCP (requests, and requests with a keep-alive session)
+with HTTP over a Unix domain socket, against a minimal local server answering every request with the same body.
+
+  python bench/transport_latency.py [requests] [payload bytes]
+
+UnixSocketTransport is built on http.client. The 'tcp (http.client)' run uses the same transport over loopback TCP,
+so it differs from the 'unix socket' run only in the socket type, while the difference to the requests runs
+is mostly the per-request overhead of requests.
+'''
+
+import http.client
+import http.server
+import json
+import os
+import socketserver
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import typing
+
+from urllib.parse import quote
+
+from pplns_python.api import PipelineApi
+
+from pplns_python.transport import \
+  RequestsTransport, \
+  UnixSocketTransport
+
+def make_handler(body : bytes, tcp : bool) -> type:
+
+  class Handler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body are written separately, with Nagle's algorithm keep-alive responses would stall on delayed ACKs
+    disable_nagle_algorithm = tcp
+
+    def do_GET(self) -> None:
+
+      self.send_response(200)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, *args : typing.Any) -> None:
+      pass
+
+  return Handler
+
+class TcpTransport(UnixSocketTransport):
+
+  '''
+  UnixSocketTransport over TCP, the netloc of the url is host:port.
+  '''
+
+  def connection(self, socket_path : str, timeout : float | None) -> http.client.HTTPConnection:
+
+    # http.client disables Nagle's algorithm on its sockets
+    return http.client.HTTPConnection(socket_path, timeout=timeout)
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+  daemon_threads = True
+
+def measure(api : PipelineApi, count : int) -> list[float]:
+
+  # the first requests open connections
+  for _ in range(10):
+    api.get_task('task')
+
+  latencies : list[float] = []
+
+  for _ in range(count):
+
+    start : float = time.perf_counter()
+
+    api.get_task('task')
+
+    latencies.append(time.perf_counter() - start)
+
+  return latencies
+
+def report(name : str, latencies : list[float]) -> None:
+
+  latencies = sorted(latencies)
+
+  p99 : float = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]
+
+  print(
+    f'{name:<24} mean {1e6 * statistics.mean(latencies):8.1f} us   '
+    f'p50 {1e6 * latencies[len(latencies) // 2]:8.1f} us   p99 {1e6 * p99:8.1f} us'
+  )
+
+def main(count : int, payload : int) -> None:
+
+  body : bytes = json.dumps({ '_id': 'task', 'params': { 'blob': 'x' * payload } }).encode()
+
+  tcp = http.server.ThreadingHTTPServer(('127.0.0.1', 0), make_handler(body, True))
+  tcp.daemon_threads = True
+
+  socket_path : str = os.path.join(tempfile.mkdtemp(), 'pplns.sock')
+
+  unix = UnixHTTPServer(socket_path, make_handler(body, False))
+
+  for server in (tcp, unix):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+  tcp_url : str = f'http://127.0.0.1:{tcp.server_port}/api'
+  unix_url : str = f'http+unix://{quote(socket_path, safe="")}/api'
+
+  print(f'requests:                {count}')
+  print(f'response bytes:          {len(body)}')
+
+  try:
+
+    report('tcp (requests)', measure(PipelineApi(tcp_url, ''), count))
+    report('tcp (session)', measure(PipelineApi(tcp_url, '', transport=RequestsTransport()), count))
+    report('tcp (http.client)', measure(PipelineApi(tcp_url, '', transport=TcpTransport()), count))
+    report('unix socket', measure(PipelineApi(unix_url, '', transport=UnixSocketTransport()), count))
+
+  finally:
+
+    for server in (tcp, unix):
+      server.shutdown()
+      server.server_close()
+
+    os.unlink(socket_path)
+
+if __name__ == '__main__':
+
+  main(
+    int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+    int(sys.argv[2]) if len(sys.argv) > 2 else 1024,
+  )
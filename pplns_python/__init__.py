@@ -0,0 +1,19 @@
+
+import importlib
+import typing
+
+# public names are resolved on first access so that importing the package stays cheap
+__lazy_exports : dict[str, str] = {
+  'PipelineApi': 'pplns_python.api',
+  'InputStream': 'pplns_python.stream',
+  'PreparedInput': 'pplns_python.processor',
+  'BatchProcessor': 'pplns_python.processor',
+  'TaskProcessor': 'pplns_python.processor',
+}
+
+def __getattr__(name : str) -> typing.Any:
+
+  if name in __lazy_exports:
+    return getattr(importlib.import_module(__lazy_exports[name]), name)
+
+  raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -2,17 +2,42 @@
 import os.path
 
 import json
+import re
+import time
 import typing 
 
-import requests
-
 from urllib.parse import\
   urlunsplit, \
+  urlsplit, \
   urlencode, \
   urlparse, \
+  parse_qs, \
   ParseResult as UrlParseResult
 
-import typing
+# requests and the stream module are only imported once they are actually used to keep worker start-up fast
+if typing.TYPE_CHECKING:
+
+  import requests
+
+  from pplns_python.stream import InputStream
+
+  from pplns_python.worker_cache import WorkerCache
+
+  from pplns_python.notifications import NotificationListener
+
+from pplns_python.lazy_import import LazyModule
+
+from pplns_python.rate_limit import \
+  RateLimiter, \
+  parse_retry_after
+
+from pplns_python.stats import Stats
+
+from pplns_python.profiling import profiler
+
+from pplns_python.json_stream import \
+  JsonArrayReader, \
+  iter_json_encode
 
 from pplns_types import \
   WorkerWrite, \
@@ -22,9 +47,13 @@ from pplns_types import \
   BundleQuery, \
   DataItemWrite, \
   DataItemQuery, \
-  DataItem
+  DataItem, \
+  Task
 
-from pplns_python.stream import InputStream
+from pplns_python.transport import \
+  Timeout, \
+  Transport, \
+  default_transport
 
 def stringify_value(value : typing.Any) -> str:
 
@@ -46,49 +75,225 @@ def clean_query(query : typing.Any):
     if not value == None
   }
 
+def route_of(method : str, url : str) -> str:
+
+  '''
+  Name of the request budget (rate limit, timeout) of a request, shared by PipelineApi and the traffic capture.
+  '''
+
+  split = urlsplit(url)
+  path : str = split.path
+
+  if method == 'get' and path.endswith('/bundles'):
+    return 'consume' if parse_qs(split.query).get('consume') == ['true'] else 'bundles'
+
+  if method == 'post' and path.endswith('/outputs'):
+    return 'outputs'
+
+  if method == 'put' and re.search(r'/tasks/[^/]+/bundles/[^/]+$', path):
+    return 'unconsume'
+
+  if method == 'get' and re.search(r'/tasks/[^/]+$', path):
+    return 'tasks'
+
+  if re.search(r'/workers(/[^/]+)?$', path):
+    return 'workers'
+
+  return 'other'
+
+class BundleList(list[BundleRead]):
+
+  '''
+  Bundles returned by get_bundles along with the size of the response body they were parsed from (None if unknown).
+  '''
+
+  nbytes : int | None = None
+
 class PipelineApi:
 
   __endpoint : UrlParseResult
 
   workers : dict[str, Worker]
   
-  client = requests
+  client : typing.Any = LazyModule('requests')
+
+  worker_cache : typing.Optional['WorkerCache'] = None
+
+  rate_limiter : RateLimiter | None = None
 
   def __init__(
     self,
     base_url : str,
-    api_key : str
+    api_key : str,
+    worker_cache_dir : str | None = None,
+    rate_limits : dict[str, tuple[float, float]] | None = None,
+    max_retries : int = 3,
+    retry_backoff : float = 0.5,
+    stream_threshold : int | None = None,
+    stream_chunk_size : int = 1 << 16,
+    timeout : Timeout = (5.0, 60.0),
+    timeouts : dict[str, Timeout] | None = None,
+    transport : Transport | None = None,
   ) -> None:
 
+    '''
+    worker_cache_dir: if set, registered workers are cached on disk and register_worker
+    skips the API round-trip for definitions that have not changed.
+
+    rate_limits: (requests per second, burst) by route (see route_of).
+    max_retries: how often throttled (429) requests are retried.
+    retry_backoff: initial retry delay if the server does not send Retry-After (doubles with each attempt).
+
+    stream_threshold: emitted items with more data elements than this are sent as streamed request bodies.
+    stream_chunk_size: approximate size of the chunks of streamed request bodies in bytes.
+
+    timeout: (connect, read) timeout in seconds (or one value for both) for all requests, None to wait forever.
+    timeouts: timeouts by route, these take precedence over timeout.
+
+    transport: sends the requests (see transport.py). Defaults to requests, or to UnixSocketTransport
+    for http+unix:// base urls.
+    '''
+
     self.__endpoint = urlparse(base_url)
 
     self.workers = {}
 
     self.api_key : str = api_key
 
-  def get(self, **request_params) -> typing.Any:
+    self.stats : Stats = Stats()
+
+    self.max_retries : int = max_retries
+    self.retry_backoff : float = retry_backoff
+
+    self.stream_threshold : int | None = stream_threshold
+    self.stream_chunk_size : int = stream_chunk_size
+
+    self.timeout : Timeout = timeout
+    self.timeouts : dict[str, Timeout] = timeouts or {}
+
+    transport = transport or default_transport(base_url)
+
+    if transport is not None:
+      self.client = transport
+
+    if rate_limits:
+      self.rate_limiter = RateLimiter(rate_limits)
+
+    if worker_cache_dir:
+
+      from pplns_python.worker_cache import WorkerCache
+
+      self.worker_cache = WorkerCache(worker_cache_dir)
+
+  def get(self, route : str | None = None, **request_params) -> typing.Any:
+
+    return self.request('get', route, **request_params)
+
+  def post(self, route : str | None = None, **request_params) -> typing.Any:
+
+    return self.request('post', route, **request_params)
+
+  def put(self, route : str | None = None, **request_params) -> typing.Any:
+
+    return self.request('put', route, **request_params)
+
+  def delete(self, route : str | None = None, **request_params) -> typing.Any:
+
+    return self.request('delete', route, **request_params)
+
+  def patch(self, route : str | None = None, **request_params) -> typing.Any:
+
+    return self.request('patch', route, **request_params)
+
+  def request(
+    self,
+    method : str,
+    route : str | None = None,
+    **request_params
+  ) -> typing.Any:
+
+    '''
+    Sends a request through the client.
+
+    route names the request budget (see route_of) if rate limits are configured
+    and selects the timeout (see timeouts).
+    Responses with status 429 (or 503 with Retry-After) are retried up to max_retries times after the delay
+    requested by the server.
+    '''
+
+    return self.__parse_response(self.send(method, route, **request_params), **request_params)
+
+  def send(
+    self,
+    method : str,
+    route : str | None = None,
+    **request_params
+  ) -> 'requests.Response':
+
+    '''
+    Same as request, but returns the response without parsing it.
+    '''
+
+    attempt : int = 0
+
+    # streamed bodies are consumed by the first attempt and cannot be sent again
+    max_retries : int = self.max_retries \
+      if isinstance(request_params.get('data'), (str, bytes, type(None))) else 0
+
+    while True:
+
+      if self.rate_limiter:
+
+        waited : float = self.rate_limiter.acquire(route)
+
+        if waited > 0:
+          self.stats.timing(f'rate_limit_wait.{route}', waited)
+
+      try:
+
+        response = getattr(self.client, method)(
+          **{ 'timeout': self.timeouts.get(route, self.timeout) if route else self.timeout, **request_params }
+        )
+
+      except Exception as e:
+
+        if isinstance(e, self.__timeout_errors()):
+          self.stats.incr(f'timeouts.{route}')
+
+        raise
+
+      if attempt < max_retries and self.__is_throttled(response):
+
+        delay : float = parse_retry_after(response.headers.get('Retry-After')) \
+          or self.retry_backoff * 2 ** attempt
+
+        self.stats.incr(f'throttled.{route}')
 
-    return self.__parse_response(self.client.get(**request_params), **request_params)
+        # with a budget for the route, all requests on that route pause, not just this one
+        if not (self.rate_limiter and self.rate_limiter.block_for(route, delay)):
+          time.sleep(delay)
 
-  def post(self, **request_params) -> typing.Any:
+        attempt += 1
 
-    return self.__parse_response(self.client.post(**request_params), **request_params)
+        continue
 
-  def put(self, **request_params) -> typing.Any:
+      return response
 
-    return self.__parse_response(self.client.put(**request_params), **request_params)
+  def __timeout_errors(self) -> tuple[type, ...]:
 
-  def delete(self, **request_params) -> typing.Any:
+    # requests' Timeout does not derive from the builtin TimeoutError, other clients may not have one
+    timeout_error : typing.Any = getattr(getattr(self.client, 'exceptions', None), 'Timeout', None)
 
-    return self.__parse_response(self.client.delete(**request_params), **request_params)
+    return (TimeoutError, timeout_error) if isinstance(timeout_error, type) else (TimeoutError,)
 
-  def patch(self, **request_params) -> typing.Any:
+  def __is_throttled(self, response : 'requests.Response') -> bool:
 
-    return self.__parse_response(self.client.patch(**request_params), **request_params)
+    return response.status_code == 429 or \
+      (response.status_code == 503 and 'Retry-After' in response.headers)
 
   def __parse_response(
     self,
-    response : requests.Response,
+    response : 'requests.Response',
     **request_params,
   ) -> dict:
 
@@ -110,7 +315,7 @@ class PipelineApi:
         
         raise Exception(
           'API error:\n' +
-          f'Request: {response.request.method} {json.dumps(request_params, indent=4)} \n\n'
+          f'Request: {response.request.method} {json.dumps(request_params, indent=4, default=lambda o: "<streamed body>")} \n\n'
           'Response: ' + json.dumps(body, indent=4)
         )
 
@@ -137,32 +342,77 @@ class PipelineApi:
   def build_request(
     self,
     url : str | tuple[str, typing.Any],
-    body : typing.Any = None # TODO: type
+    body : typing.Any = None, # TODO: type
+    stream : bool = False,
   ):
 
-    return {
-      'url': self.build_uri(url) if isinstance(url, str) else self.build_uri(url[0], url[1]),
-      'headers': { 
-        'Content-Type': 'application/json',
-        'X-API-Key': self.api_key
-      }, 
-      'data': json.dumps(body) if body else None
-    }
+    '''
+    Builds the parameters for a request.
+    With stream=True, the body is encoded lazily into chunks (see iter_json_encode) and sent with chunked transfer encoding.
+    '''
+
+    with profiler.stage('encode'):
+
+      return {
+        'url': self.build_uri(url) if isinstance(url, str) else self.build_uri(url[0], url[1]),
+        'headers': { 
+          'Content-Type': 'application/json',
+          'X-API-Key': self.api_key
+        }, 
+        'data': (iter_json_encode(body, chunk_size=self.stream_chunk_size) if stream else json.dumps(body)) \
+          if body else None
+      }
+
+  def should_stream(self, item : DataItemWrite) -> bool:
+
+    '''
+    Items are streamed if their data is not a list (e.g. a generator) or has more than stream_threshold elements.
+    '''
+
+    data : typing.Any = item['data'] if 'data' in item else None
+
+    if data is None:
+      return False
+
+    if not isinstance(data, (list, tuple)):
+      return True
+
+    return self.stream_threshold is not None and len(data) > self.stream_threshold
 
   def register_worker(
     self,
     worker : WorkerWrite
   ) -> Worker:
 
+    '''
+    Registers (PUTs) a worker definition.
+    If a worker cache is configured and the same definition has been registered before, the cached Worker is used instead.
+    '''
+
+    endpoint : str = self.__endpoint.geturl()
+
+    cached : Worker | None = \
+      self.worker_cache.get(endpoint, worker) if self.worker_cache else None
+
+    if cached:
+
+      self.workers[cached['_id']] = cached
+
+      return cached
+
     params = self.build_request(
       '/workers/' + worker['_id'],
       worker
     )
 
-    worker_read : Worker = self.put(**params)
+    worker_read : Worker = self.put('workers', **params)
 
     self.workers[worker_read['_id']] = worker_read
 
+    if self.worker_cache:
+
+      self.worker_cache.put(endpoint, worker, worker_read)
+
     return worker_read
 
   def get_registered_worker(self, workerId : typing.Optional[str]) -> Worker:
@@ -202,9 +452,89 @@ class PipelineApi:
       ('/bundles', query),
     )
 
-    get_response = self.get(**params)
-    
-    return get_response['results']
+    response = self.send('get', route_of('get', params['url']), **params)
+
+    bundles = BundleList(self.__parse_response(response, **params)['results'])
+
+    # the body has been read by parsing it
+    content : typing.Any = getattr(response, 'content', None)
+
+    if isinstance(content, bytes):
+      bundles.nbytes = len(content)
+
+    return bundles
+
+  def iter_bundles(
+    self,
+    query : BundleQuery,
+    page_size : int = 100,
+    chunk_size : int = 1 << 16,
+  ) -> typing.Iterator[BundleRead]:
+
+    '''
+    Iterates over all bundles matching query, fetching page_size bundles per request (limit/offset).
+    Responses are parsed incrementally, so memory does not grow with the number of matching bundles.
+
+    With consume=True, every page is requested from offset 0 since consumed bundles drop out of the results.
+    If the caller stops early, the bundles of the current page that have been consumed but not yielded are unconsumed.
+    Listing without consume=True is budgeted on the 'bundles' route (see route_of).
+    '''
+
+    consume : bool = bool('consume' in query and query['consume'])  # type: ignore
+
+    offset : int = 0
+
+    while True:
+
+      params = self.build_request(
+        ('/bundles', { **query, 'limit': page_size, 'offset': offset }),
+      )
+
+      response = self.send('get', route_of('get', params['url']), stream=True, **params)
+
+      if not 200 <= response.status_code < 300:
+
+        # reads the body and raises the API error
+        self.__parse_response(response, **params)
+
+      bundles : typing.Iterator[BundleRead] = iter(JsonArrayReader(response.iter_content(chunk_size), 'results'))
+
+      count : int = 0
+
+      try:
+
+        for bundle in bundles:
+
+          count += 1
+
+          yield bundle
+
+      except GeneratorExit:
+
+        if consume:
+          self.unconsume_many(
+            [(bundle['taskId'], bundle['_id'], typing.cast(str, bundle['consumptionId'])) for bundle in bundles]
+          )
+
+        raise
+
+      finally:
+
+        response.close()
+
+      if count < page_size:
+        return
+
+      if not consume:
+        offset += count
+
+  def get_task(self, task_id : str) -> Task:
+
+    '''
+    Fetches a task, including its params.
+    '''
+
+    return self.get('tasks', **self.build_request(f'/tasks/{task_id}'))
 
   def unconsume(
     self,
@@ -220,40 +550,90 @@ class PipelineApi:
     body : BundleWrite = { 'consumptionId': consumption_id }
 
     return self.put(
+      'unconsume',
       **self.build_request(
         f'/tasks/{task_id}/bundles/{bundle_id}',
         body
       )
     )
 
+  def unconsume_many(
+    self,
+    bundles : list[tuple[str, str, str]],
+  ) -> None:
+
+    '''
+    Undo consuming several bundles, given as (task_id, bundle_id, consumption_id).
+    The API has no bulk endpoint yet, so this sends one request per bundle. All bundles are attempted,
+    the first error is raised afterwards.
+    '''
+
+    error : Exception | None = None
+
+    for task_id, bundle_id, consumption_id in bundles:
+
+      try:
+        self.unconsume(task_id, bundle_id, consumption_id)
+      except Exception as e:
+        error = error or e
+
+    if error:
+      raise error
+
   def emit_item(
     self,
     query : DataItemQuery,
-    item : DataItemWrite
+    item : DataItemWrite,
+    stream : bool | None = None,
   ) -> DataItem:
     
     '''
     Emit a DataItem as an output.
+
+    item['data'] may be a generator. Such items (and items with more than stream_threshold elements)
+    are sent as a streamed request body unless stream is set explicitly.
     '''
 
     return self.post(
+      'outputs',
       **self.build_request(
         ('/outputs', query),
         item,
+        stream=self.should_stream(item) if stream is None else stream,
       )
     )
 
-  
+  def create_notification_listener(
+    self,
+    path : str = '/bundles/events',
+    query : typing.Any = {},
+    **listener_args : typing.Any
+  ) -> 'NotificationListener':
+
+    '''
+    Creates a listener for the server-sent events announcing new bundles, for InputStream(notifications=...).
+    '''
+
+    from pplns_python.notifications import NotificationListener
+
+    return NotificationListener(
+      self.build_uri(path, query),
+      { 'X-API-Key': self.api_key },
+      **{ 'stats': self.stats, **listener_args }
+    )
+
   def create_input_stream(
     self,
     query : BundleQuery,
     **input_stream_args
-  ) -> InputStream:
+  ) -> 'InputStream':
 
     '''
     Initializes InputStream to watch for new bundles that match the provided query.
     '''
 
+    from pplns_python.stream import InputStream
+
     return InputStream(
       self,
       query,
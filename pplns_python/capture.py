@@ -0,0 +1,170 @@
+
+'''
+Captures the API traffic of a worker for replay (see replay.py).
+
+  api.client = CapturingClient(api.client, 'capture.jsonl')
+
+The capture is a JSONL file with one line per request: its (unix) time, method, route, url, status, duration
+and the JSON request and response bodies. Headers (and with them the API key) are not recorded.
+Several processes may append to the same file.
+
+Streamed request bodies (see PipelineApi.should_stream) are recorded as well: their chunks are collected while
+the client sends them, so a streamed body is held in memory as a whole until the request is written to the capture.
+'''
+
+import json
+import random
+import threading
+import time
+import typing
+
+# the capture records the same route names as PipelineApi budgets requests by
+from pplns_python.api import route_of
+
+CAPTURE_VERSION : int = 1
+
+class CapturedRequest(typing.TypedDict):
+
+  time : float
+  # seconds since the first request of the capture, set by read_capture
+  t : float
+  method : str
+  route : str
+  url : str
+  status : int
+  duration : float
+  body : typing.Any
+  response : typing.Any
+
+class CapturingClient:
+
+  '''
+  Wraps an API client (requests by default) and appends every request to a capture file.
+
+  sample_rate: fraction of requests that are recorded. Replaying a sampled capture only reproduces that fraction of the load.
+  bodies: record request and response bodies. Replay needs the bodies of consume and workers requests.
+  '''
+
+  def __init__(
+    self,
+    client : typing.Any,
+    path : str,
+    sample_rate : float = 1.0,
+    bodies : bool = True,
+  ) -> None:
+
+    self.client : typing.Any = client
+    self.path : str = path
+    self.sample_rate : float = sample_rate
+    self.bodies : bool = bodies
+
+    self.__lock = threading.Lock()
+    self.__random = random.Random()
+    self.__file = open(path, 'a', buffering=1)
+
+    self.__write({ 'version': CAPTURE_VERSION })
+
+  def __getattr__(self, method : str) -> typing.Any:
+
+    if not method in ('get', 'post', 'put', 'patch', 'delete'):
+      return getattr(self.client, method)
+
+    return lambda **params : self.request(method, **params)
+
+  def request(self, method : str, **params : typing.Any) -> typing.Any:
+
+    start : float = time.time()
+
+    record : bool = self.__random.random() < self.sample_rate
+
+    chunks : list[bytes] | None = None
+
+    if record and self.bodies and not isinstance(params.get('data'), (str, bytes, type(None))):
+
+      chunks = []
+
+      params = { **params, 'data': self.__tee(params['data'], chunks) }
+
+    response = getattr(self.client, method)(**params)
+
+    if record:
+
+      self.__write(
+        {
+          'time': start,
+          'method': method,
+          'route': route_of(method, params['url']),
+          'url': params['url'],
+          'status': response.status_code,
+          'duration': time.time() - start,
+          'body': self.__request_body(params, chunks) if self.bodies else None,
+          'response': self.__response_body(response, params) if self.bodies else None,
+        }
+      )
+
+    return response
+
+  @staticmethod
+  def __tee(data : typing.Iterable[bytes], chunks : list[bytes]) -> typing.Iterator[bytes]:
+
+    for chunk in data:
+
+      chunks.append(chunk)
+
+      yield chunk
+
+  def __request_body(self, params : dict[str, typing.Any], chunks : list[bytes] | None) -> typing.Any:
+
+    data : typing.Any = params.get('data')
+
+    if chunks is not None:
+      return json.loads(b''.join(chunks)) if chunks else None
+
+    return json.loads(data) if isinstance(data, (str, bytes)) else None
+
+  def __response_body(self, response : typing.Any, params : dict[str, typing.Any]) -> typing.Any:
+
+    if params.get('stream') or not response.headers.get('Content-Type', '').startswith('application/json'):
+      return None
+
+    return response.json()
+
+  def __write(self, record : dict[str, typing.Any]) -> None:
+
+    line : str = json.dumps(record)
+
+    with self.__lock:
+      self.__file.write(line + '\n')
+
+  def close(self) -> None:
+
+    with self.__lock:
+      self.__file.close()
+
+def read_capture(path : str) -> list[CapturedRequest]:
+
+  ''' Reads the requests of a capture file in order of time. '''
+
+  records : list[CapturedRequest] = []
+
+  with open(path) as f:
+
+    for line in f:
+
+      record : typing.Any = json.loads(line)
+
+      if 'version' in record:
+
+        if record['version'] > CAPTURE_VERSION:
+          raise Exception(f'Capture {path} has unsupported version {record["version"]}.')
+
+        continue
+
+      records.append(record)
+
+  records.sort(key=lambda record: record['time'])
+
+  for record in records:
+    record['t'] = record['time'] - records[0]['time']
+
+  return records
@@ -0,0 +1,175 @@
+
+import collections.abc
+import functools
+import importlib.util
+import itertools
+import typing
+
+from pplns_python.lazy_import import LazyModule
+
+from pplns_python.processor import \
+  PreparedInput, \
+  ProcessorOutput
+
+numpy = LazyModule('numpy')
+
+@functools.cache
+def has_numpy() -> bool:
+
+  return importlib.util.find_spec('numpy') is not None
+
+def is_numeric(values : list[typing.Any]) -> bool:
+
+  '''
+  Whether values are all plain numbers (or all booleans), i.e. convert to a flat NumPy array without copying objects.
+  '''
+
+  if all(type(v) is bool for v in values):
+    return True
+
+  return all(type(v) is int or type(v) is float for v in values)
+
+class Column:
+
+  '''
+  The data of one input channel for all bundles of a batch: values holds the elements of all bundles back to back,
+  the elements of bundle i are values[offsets[i]:offsets[i + 1]].
+  '''
+
+  __slots__ = ('values', 'offsets')
+
+  def __init__(
+    self,
+    values : typing.Any,
+    offsets : typing.Sequence[int],
+  ) -> None:
+
+    self.values : typing.Any = values
+    self.offsets : typing.Sequence[int] = offsets
+
+  def __len__(self) -> int:
+
+    ''' Number of bundles. '''
+
+    return len(self.offsets) - 1
+
+  def __getitem__(self, i : int) -> typing.Any:
+
+    return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+class ColumnarBatch(collections.abc.Mapping[str, Column]):
+
+  '''
+  Columnar view of a batch of PreparedInputs, delivered to BatchProcessors with columnar=True.
+  Maps each input channel name to a Column with the data of all bundles stacked into one array:
+  a NumPy array for numeric channels if NumPy is installed, a list otherwise (strings, nested or ragged lists,
+  mixed types). Bundles that lack a channel contribute no elements.
+  '''
+
+  def __init__(
+    self,
+    inputs : list[PreparedInput],
+    use_numpy : bool | None = None,
+    dtype : typing.Any = None,
+  ) -> None:
+
+    self.inputs : list[PreparedInput] = inputs
+
+    use_numpy = has_numpy() if use_numpy is None else use_numpy
+
+    # channel names in order of appearance
+    names : dict[str, None] = dict.fromkeys(name for inp in inputs for name in inp.inputs)
+
+    self.columns : dict[str, Column] = {}
+
+    for name in names:
+
+      data : list[typing.Sequence[typing.Any]] = [
+        inp.inputs[name]['data'] if name in inp.inputs else [] for inp in inputs
+      ]
+
+      offsets : list[int] = list(itertools.accumulate((len(d) for d in data), initial=0))
+
+      values : typing.Any = list(itertools.chain.from_iterable(data))
+
+      self.columns[name] = Column(
+        numpy.asarray(values, dtype=dtype) if use_numpy and is_numeric(values) else values,
+        numpy.asarray(offsets) if use_numpy else offsets,
+      )
+
+  def __getitem__(self, name : str) -> Column:
+
+    return self.columns[name]
+
+  def __iter__(self) -> typing.Iterator[str]:
+
+    return iter(self.columns)
+
+  def __len__(self) -> int:
+
+    return len(self.columns)
+
+  def split_outputs(
+    self,
+    outputs : typing.Mapping[str, typing.Any],
+    like : str | None = None,
+    done : bool = True,
+  ) -> list[ProcessorOutput]:
+
+    '''
+    Splits batched outputs along the offsets of the input channel like (the first channel by default),
+    for processors that produce one output element per input element. See split_outputs.
+    '''
+
+    if like is None:
+      like = next(iter(self.columns))
+
+    return split_outputs(outputs, self.columns[like].offsets, done)
+
+def split_outputs(
+  outputs : typing.Mapping[str, typing.Any],
+  offsets : typing.Sequence[int] | None = None,
+  done : bool = True,
+) -> list[ProcessorOutput]:
+
+  '''
+  Splits batched outputs into one ProcessorOutput per bundle.
+  outputs maps output channel names to either a Column or an array/list that is split along offsets.
+  NumPy arrays are converted to lists so that the outputs can be encoded as JSON.
+  '''
+
+  columns : dict[str, Column] = {}
+
+  for name, values in outputs.items():
+
+    if isinstance(values, Column):
+
+      columns[name] = values
+
+    elif offsets is None:
+
+      raise Exception(f'No offsets for output channel {name}.')
+
+    else:
+
+      columns[name] = Column(values, offsets)
+
+  sizes : set[int] = set(len(column) for column in columns.values())
+
+  if len(sizes) > 1:
+    raise Exception(f'Output channels have different numbers of bundles: {sorted(sizes)}.')
+
+  return [
+    {
+      name: {
+        'data': to_list(column[i]),
+        'done': done,
+      }
+      for name, column in columns.items()
+    }
+    for i in range(sizes.pop() if sizes else 0)
+  ]
+
+def to_list(values : typing.Any) -> list[typing.Any]:
+
+  return values.tolist() if hasattr(values, 'tolist') else list(values)
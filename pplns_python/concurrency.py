@@ -0,0 +1,160 @@
+
+import math
+import threading
+
+class ConcurrencyLimit:
+
+  '''
+  Base class for adaptive concurrency limits.
+
+  The InputStream reports the latency of every processed batch (processor + emit) through update
+  and uses the returned value as its new concurrency budget.
+  '''
+
+  min_limit : int
+  max_limit : int
+
+  def __init__(
+    self,
+    initial : int,
+    min_limit : int,
+    max_limit : int,
+  ) -> None:
+
+    if not min_limit <= initial <= max_limit:
+      raise Exception(f'Initial limit {initial} is not within [{min_limit}, {max_limit}].')
+
+    self.min_limit = min_limit
+    self.max_limit = max_limit
+
+    self._limit : float = initial
+    self._lock = threading.Lock()
+
+  @property
+  def limit(self) -> int:
+
+    return int(self._limit)
+
+  def update(
+    self,
+    latency : float,
+    in_flight : int,
+    failed : bool = False
+  ) -> int:
+
+    ''' Feeds one latency sample (seconds) and returns the new limit. '''
+
+    with self._lock:
+
+      self._limit = min(
+        self.max_limit,
+        max(self.min_limit, self._next_limit(latency, in_flight, failed))
+      )
+
+      return self.limit
+
+  def _next_limit(
+    self,
+    latency : float,
+    in_flight : int,
+    failed : bool
+  ) -> float:
+
+    raise Exception('Not implemented.')
+
+class AIMDLimit(ConcurrencyLimit):
+
+  '''
+  Additive increase, multiplicative decrease.
+
+  The limit grows by increase per round of limit samples below latency_target and is multiplied by backoff
+  when a batch fails or exceeds latency_target.
+  '''
+
+  def __init__(
+    self,
+    initial : int = 1,
+    min_limit : int = 1,
+    max_limit : int = 64,
+    latency_target : float | None = None,
+    increase : float = 1.0,
+    backoff : float = 0.9,
+  ) -> None:
+
+    ConcurrencyLimit.__init__(self, initial, min_limit, max_limit)
+
+    self.latency_target : float | None = latency_target
+    self.increase : float = increase
+    self.backoff : float = backoff
+
+  def _next_limit(
+    self,
+    latency : float,
+    in_flight : int,
+    failed : bool
+  ) -> float:
+
+    if failed or (self.latency_target is not None and latency > self.latency_target):
+      return self._limit * self.backoff
+
+    # only grow while the current limit is actually used, otherwise the limit drifts to max_limit when idle
+    if in_flight * 2 >= self._limit:
+      return self._limit + self.increase / max(1, self._limit)
+
+    return self._limit
+
+class GradientLimit(ConcurrencyLimit):
+
+  '''
+  Gradient based limit (similar to Gradient2 of Netflix' concurrency-limits).
+
+  Compares each latency sample with a slowly moving baseline. While latency stays close to the baseline,
+  the limit grows by a queue allowance of sqrt(limit), once latency rises the limit shrinks proportionally.
+  '''
+
+  def __init__(
+    self,
+    initial : int = 1,
+    min_limit : int = 1,
+    max_limit : int = 64,
+    smoothing : float = 0.2,
+    tolerance : float = 1.5,
+    baseline_window : int = 100,
+  ) -> None:
+
+    ConcurrencyLimit.__init__(self, initial, min_limit, max_limit)
+
+    self.smoothing : float = smoothing
+    self.tolerance : float = tolerance
+
+    # the baseline is an exponential moving average over roughly baseline_window samples
+    self.__baseline_factor : float = 2 / (baseline_window + 1)
+    self.__baseline : float | None = None
+
+  def _next_limit(
+    self,
+    latency : float,
+    in_flight : int,
+    failed : bool
+  ) -> float:
+
+    if self.__baseline is None:
+      self.__baseline = latency
+
+    self.__baseline += (latency - self.__baseline) * self.__baseline_factor
+
+    if failed:
+      return self._limit * 0.5
+
+    # app limited, the samples say nothing about a higher limit
+    if in_flight * 2 < self._limit:
+      return self._limit
+
+    gradient : float = max(
+      0.5,
+      min(1.0, self.tolerance * self.__baseline / latency if latency > 0 else 1.0)
+    )
+
+    new_limit : float = self._limit * gradient + math.sqrt(self._limit)
+
+    return self._limit * (1 - self.smoothing) + new_limit * self.smoothing
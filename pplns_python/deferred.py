@@ -0,0 +1,200 @@
+
+import collections
+import threading
+import typing
+
+if typing.TYPE_CHECKING:
+
+  import asyncio
+  import concurrent.futures
+
+  from pplns_python.stream import Stream
+
+# what to do when a deferred handler's queue is full:
+# 'drop_newest' discards the event being emitted, 'drop_oldest' discards the oldest queued event,
+# 'block' makes the emitting thread wait for space
+OverflowPolicy = typing.Literal['drop_newest', 'drop_oldest', 'block']
+
+__loop_lock = threading.Lock()
+__loop : typing.Optional['asyncio.AbstractEventLoop'] = None
+
+def background_loop() -> 'asyncio.AbstractEventLoop':
+
+  '''
+  Returns a shared event loop running in a daemon thread (started on first use).
+  '''
+
+  global __loop
+
+  with __loop_lock:
+
+    if __loop is None:
+
+      import asyncio
+
+      loop = asyncio.new_event_loop()
+
+      threading.Thread(target=loop.run_forever, name='pplns-event-loop', daemon=True).start()
+
+      __loop = loop
+
+    return __loop
+
+class DeferredHandler:
+
+  '''
+  Runs an event handler off the emitting thread.
+
+  Plain callables run on an executor, coroutine functions on an asyncio event loop.
+  Calls are buffered in a bounded queue and processed one at a time in emit order.
+
+  Errors of the handler are passed to on_error. Without on_error they are emitted as 'error' on the stream,
+  except for errors of 'error' handlers which would loop: those are only counted in errors.
+  '''
+
+  def __init__(
+    self,
+    stream : 'Stream',
+    event : str,
+    handler : typing.Callable,
+    executor : typing.Optional['concurrent.futures.Executor'] = None,
+    loop : typing.Optional['asyncio.AbstractEventLoop'] = None,
+    is_coroutine : bool = False,
+    max_queue : int = 100,
+    overflow : OverflowPolicy = 'drop_newest',
+    on_error : typing.Callable[[Exception], typing.Any] | None = None,
+  ) -> None:
+
+    if not is_coroutine and executor is None:
+      raise Exception('DeferredHandler requires an executor for non-coroutine handlers.')
+
+    if max_queue < 1:
+      raise Exception('max_queue must be at least 1.')
+
+    self.stream = stream
+    self.event : str = event
+    self.handler : typing.Callable = handler
+    self.executor = executor
+    self.loop = loop
+    self.is_coroutine : bool = is_coroutine
+    self.max_queue : int = max_queue
+    self.overflow : OverflowPolicy = overflow
+    self.on_error : typing.Callable[[Exception], typing.Any] | None = on_error
+
+    # number of events discarded due to the overflow policy
+    self.dropped : int = 0
+    # number of calls that raised
+    self.errors : int = 0
+
+    self.__queue : collections.deque[tuple] = collections.deque()
+    self.__condition = threading.Condition()
+    self.__running : bool = False
+
+  def __call__(self, *args : typing.Any) -> None:
+
+    with self.__condition:
+
+      if len(self.__queue) >= self.max_queue:
+
+        if self.overflow == 'drop_newest':
+
+          self.dropped += 1
+
+          return
+
+        elif self.overflow == 'drop_oldest':
+
+          self.__queue.popleft()
+          self.dropped += 1
+
+        else:
+
+          while len(self.__queue) >= self.max_queue:
+            self.__condition.wait()
+
+      self.__queue.append(args)
+
+      if not self.__running:
+
+        self.__running = True
+        self.__schedule()
+
+  def __schedule(self) -> None:
+
+    if self.is_coroutine:
+
+      import asyncio
+
+      asyncio.run_coroutine_threadsafe(
+        self.__drain_async(),
+        self.loop or background_loop()
+      )
+
+    else:
+
+      typing.cast('concurrent.futures.Executor', self.executor).submit(self.__drain)
+
+  def __next(self) -> tuple | None:
+
+    with self.__condition:
+
+      if not self.__queue:
+
+        self.__running = False
+        self.__condition.notify_all()
+
+        return None
+
+      args = self.__queue.popleft()
+
+      self.__condition.notify_all()
+
+      return args
+
+  def __drain(self) -> None:
+
+    while (args := self.__next()) is not None:
+
+      try:
+        self.handler(*args)
+      except Exception as e:
+        self.__fail(e)
+
+  async def __drain_async(self) -> None:
+
+    while (args := self.__next()) is not None:
+
+      try:
+        await self.handler(*args)
+      except Exception as e:
+        self.__fail(e)
+
+  def __fail(self, error : Exception) -> None:
+
+    self.errors += 1
+
+    if self.on_error:
+      self.on_error(error)
+
+    # errors of deferred 'error' handlers cannot be reported through the stream without looping
+    elif not self.event == 'error':
+      self.stream.emit('error', error)
+
+  def pending(self) -> int:
+
+    ''' Number of queued calls. '''
+
+    return len(self.__queue)
+
+  def join(self, timeout : float | None = None) -> bool:
+
+    '''
+    Waits until all queued calls have been handled. Returns False on timeout.
+    '''
+
+    with self.__condition:
+
+      return self.__condition.wait_for(
+        lambda: not self.__running and not self.__queue,
+        timeout
+      )
@@ -0,0 +1,187 @@
+
+import collections
+import json
+import threading
+import time
+import typing
+
+from pplns_python.processor import \
+  PreparedInput, \
+  ProcessorOutput
+
+class CachedOutput(typing.NamedTuple):
+
+  expires_at : float
+  output : ProcessorOutput
+  # processor time the output took to compute
+  seconds : float
+
+class SqliteBackend:
+
+  '''
+  Persistent backend for IdempotencyCache, survives worker restarts.
+  '''
+
+  def __init__(self, path : str) -> None:
+
+    import sqlite3
+
+    self.__connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self.__lock = threading.Lock()
+
+    self.__connection.execute(
+      'CREATE TABLE IF NOT EXISTS outputs ' +
+      '(key TEXT PRIMARY KEY, expires_at REAL, output TEXT, seconds REAL)'
+    )
+
+  def get(self, key : str) -> CachedOutput | None:
+
+    with self.__lock:
+
+      row = self.__connection.execute(
+        'SELECT expires_at, output, seconds FROM outputs WHERE key = ?',
+        (key,)
+      ).fetchone()
+
+    if row is None:
+      return None
+
+    return CachedOutput(row[0], json.loads(row[1]), row[2])
+
+  def put(self, key : str, entry : CachedOutput) -> None:
+
+    with self.__lock:
+
+      self.__connection.execute(
+        'INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)',
+        (key, entry.expires_at, json.dumps(entry.output), entry.seconds)
+      )
+
+  def evict_expired(self, now : float) -> None:
+
+    with self.__lock:
+      self.__connection.execute('DELETE FROM outputs WHERE expires_at < ?', (now,))
+
+  def close(self) -> None:
+
+    with self.__lock:
+      self.__connection.close()
+
+def is_cacheable(output : ProcessorOutput) -> bool:
+
+  '''
+  Outputs with streamed data (e.g. generators) can only be emitted once and are not cached.
+  '''
+
+  return all(
+    isinstance(o['data'], (list, tuple)) for o in output.values() if 'data' in o
+  )
+
+class IdempotencyCache:
+
+  '''
+  Bounded cache of processor outputs keyed on the bundle id and its input item ids.
+
+  When a bundle comes back after unconsume, a timeout or a crashed replica, the stored output is emitted again
+  (on_duplicate='reemit') or the bundle is dropped without emitting (on_duplicate='skip', for pipelines where
+  the first emit is known to have gone through) instead of running the processor again.
+
+  Entries expire after ttl seconds, the least recently used entries are evicted beyond max_entries.
+  Outputs are held in memory, so max_entries should account for their size.
+  '''
+
+  def __init__(
+    self,
+    max_entries : int = 10000,
+    ttl : float = 3600.0,
+    on_duplicate : typing.Literal['reemit', 'skip'] = 'reemit',
+    backend : SqliteBackend | None = None,
+  ) -> None:
+
+    self.max_entries : int = max_entries
+    self.ttl : float = ttl
+    self.on_duplicate : typing.Literal['reemit', 'skip'] = on_duplicate
+    self.backend : SqliteBackend | None = backend
+
+    self.__entries : collections.OrderedDict[str, CachedOutput] = collections.OrderedDict()
+    self.__lock = threading.Lock()
+    self.__last_eviction : float = time.time()
+
+  def key(self, inp : PreparedInput) -> str:
+
+    item_ids : list[str] = sorted(str(item['_id']) for item in inp.inputs.values() if '_id' in item)
+
+    return inp.ref.bundle_id + ':' + ','.join(item_ids)
+
+  def get(self, key : str) -> CachedOutput | None:
+
+    now : float = time.time()
+
+    with self.__lock:
+
+      entry : CachedOutput | None = self.__entries.get(key)
+
+      if entry is not None:
+
+        if entry.expires_at < now:
+
+          del self.__entries[key]
+
+          return None
+
+        self.__entries.move_to_end(key)
+
+        return entry
+
+    if self.backend:
+
+      entry = self.backend.get(key)
+
+      if entry is not None and entry.expires_at >= now:
+
+        self.__insert(key, entry)
+
+        return entry
+
+    return None
+
+  def put(
+    self,
+    key : str,
+    output : ProcessorOutput,
+    seconds : float
+  ) -> None:
+
+    entry = CachedOutput(time.time() + self.ttl, output, seconds)
+
+    self.__insert(key, entry)
+
+    if self.backend:
+      self.backend.put(key, entry)
+
+  def __insert(self, key : str, entry : CachedOutput) -> None:
+
+    with self.__lock:
+
+      self.__entries[key] = entry
+      self.__entries.move_to_end(key)
+
+      while len(self.__entries) > self.max_entries:
+        self.__entries.popitem(last=False)
+
+      now : float = time.time()
+
+      # expired entries are dropped lazily, at most once per minute
+      if now - self.__last_eviction > 60:
+
+        self.__last_eviction = now
+
+        for expired in [k for k, e in self.__entries.items() if e.expires_at < now]:
+          del self.__entries[expired]
+
+        if self.backend:
+          self.backend.evict_expired(now)
+
+  def __len__(self) -> int:
+
+    return len(self.__entries)
@@ -0,0 +1,124 @@
+
+import collections
+import json
+import threading
+import typing
+
+from pplns_types import DataItem
+
+from pplns_python.lazy_item import LazyDataItem
+
+from pplns_python.stats import Stats
+
+def item_size(item : typing.Mapping[str, typing.Any]) -> int:
+
+  '''
+  Approximate size of an item's payload in bytes (its JSON encoding, computed once per LazyDataItem).
+  '''
+
+  if isinstance(item, LazyDataItem):
+    return item.encoded_size
+
+  return len(json.dumps(item['data'] if 'data' in item else None))
+
+class ItemCache:
+
+  '''
+  Worker-local LRU cache of DataItems by _id, shared by all bundles of an InputStream.
+
+  In fan-in and join pipelines the same upstream item is part of many bundles. With an ItemCache,
+  prepare_bundle hands out one read-only LazyDataItem per item _id instead of a copy per bundle.
+  Items are evicted least recently used first once their payloads exceed max_bytes in total.
+  '''
+
+  def __init__(self, max_bytes : int = 1 << 28) -> None:
+
+    self.max_bytes : int = max_bytes
+    self.stats : Stats = Stats()
+
+    self.__items : collections.OrderedDict[str, tuple[LazyDataItem, int]] = collections.OrderedDict()
+    self.__nbytes : int = 0
+    self.__lock = threading.Lock()
+
+  @property
+  def nbytes(self) -> int:
+
+    return self.__nbytes
+
+  def get(self, item_id : str) -> LazyDataItem | None:
+
+    with self.__lock:
+
+      entry = self.__items.get(item_id)
+
+      if entry is None:
+        return None
+
+      self.__items.move_to_end(item_id)
+
+      return entry[0]
+
+  def share(
+    self,
+    item : DataItem,
+    spill_threshold : int | None = None,
+    spill_dir : str | None = None,
+    size_bound : int | None = None,
+  ) -> LazyDataItem:
+
+    '''
+    Returns the cached instance of item or wraps item in a LazyDataItem and caches it.
+    Items larger than max_bytes are wrapped but not cached.
+    '''
+
+    item_id : str = item['_id']
+
+    cached : LazyDataItem | None = self.get(item_id)
+
+    if cached is not None:
+
+      self.stats.incr('hits')
+
+      return cached
+
+    self.stats.incr('misses')
+
+    shared = LazyDataItem(item, spill_threshold, spill_dir, size_bound)
+
+    size : int = item_size(shared)
+
+    if size > self.max_bytes:
+      return shared
+
+    with self.__lock:
+
+      # another thread might have added the item in the meantime
+      if item_id in self.__items:
+        return self.__items[item_id][0]
+
+      self.__items[item_id] = (shared, size)
+      self.__nbytes += size
+
+      while self.__nbytes > self.max_bytes:
+
+        _, (_, evicted_size) = self.__items.popitem(last=False)
+
+        self.__nbytes -= evicted_size
+
+        self.stats.incr('evictions')
+
+      self.stats.gauge('bytes', self.__nbytes)
+      self.stats.gauge('items', len(self.__items))
+
+    return shared
+
+  def clear(self) -> None:
+
+    with self.__lock:
+
+      self.__items.clear()
+      self.__nbytes = 0
+
+  def __len__(self) -> int:
+
+    return len(self.__items)
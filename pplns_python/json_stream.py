@@ -0,0 +1,240 @@
+
+import codecs
+import json
+import typing
+
+class JsonArrayReader:
+
+  '''
+  Incrementally reads the elements of the array stored under key in a top-level JSON object,
+  e.g. the 'results' of an API response, without holding the whole document in memory.
+  Values of other keys are parsed and discarded.
+  '''
+
+  # compact the buffer once this many characters have been consumed
+  compact_threshold : int = 1 << 16
+
+  def __init__(
+    self,
+    chunks : typing.Iterable[bytes],
+    key : str = 'results',
+  ) -> None:
+
+    self.key : str = key
+
+    self.__chunks : typing.Iterator[bytes] = iter(chunks)
+    self.__decoder = codecs.getincrementaldecoder('utf-8')()
+    self.__json = json.JSONDecoder()
+    self.__buffer : str = ''
+    self.__pos : int = 0
+    self.__exhausted : bool = False
+
+  def __fill(self, min_chars : int = 1) -> None:
+
+    '''
+    Appends at least min_chars characters (or the rest of the input) to the buffer, raises if the input is exhausted.
+    The chunks are joined with the buffer at once, so that the buffer is copied once per call, not once per chunk.
+    '''
+
+    if self.__exhausted:
+      raise Exception('Unexpected end of JSON input.')
+
+    parts : list[str] = []
+    added : int = 0
+
+    while added < min_chars:
+
+      chunk : bytes | None = next(self.__chunks, None)
+
+      if chunk is None:
+
+        self.__exhausted = True
+
+        parts.append(self.__decoder.decode(b'', final=True))
+
+        break
+
+      text : str = self.__decoder.decode(chunk)
+
+      parts.append(text)
+
+      added += len(text)
+
+    if self.__pos > self.compact_threshold:
+
+      self.__buffer = ''.join([self.__buffer[self.__pos:], *parts])
+      self.__pos = 0
+
+    else:
+
+      self.__buffer = ''.join([self.__buffer, *parts])
+
+  def __peek(self) -> str:
+
+    ''' Skips whitespace and returns the next character without consuming it. '''
+
+    while True:
+
+      while self.__pos < len(self.__buffer) and self.__buffer[self.__pos] in ' \t\r\n':
+        self.__pos += 1
+
+      if self.__pos < len(self.__buffer):
+        return self.__buffer[self.__pos]
+
+      self.__fill()
+
+  def __expect(self, char : str) -> None:
+
+    found : str = self.__peek()
+
+    if not found == char:
+      raise Exception(f'Expected {char!r} in JSON input, found {found!r}.')
+
+    self.__pos += 1
+
+  def __value(self) -> typing.Any:
+
+    '''
+    Decodes the next value. A value that ends exactly at the end of the buffer is only accepted once
+    the input is exhausted since it might continue in the next chunk (e.g. a number).
+
+    After a failed attempt, the buffered part of the value is at least doubled before decoding again,
+    so that a value spanning many chunks is decoded O(log n) times instead of once per chunk.
+    '''
+
+    self.__peek()
+
+    while True:
+
+      try:
+
+        value, end = self.__json.raw_decode(self.__buffer, self.__pos)
+
+        if end < len(self.__buffer) or self.__exhausted:
+
+          self.__pos = end
+
+          return value
+
+      except json.JSONDecodeError:
+
+        if self.__exhausted:
+          raise
+
+      self.__fill(max(1, len(self.__buffer) - self.__pos))
+
+  def __iter__(self) -> typing.Iterator[typing.Any]:
+
+    self.__expect('{')
+
+    if self.__peek() == '}':
+      return
+
+    while True:
+
+      key : typing.Any = self.__value()
+
+      self.__expect(':')
+
+      if key == self.key:
+
+        yield from self.__array()
+
+      else:
+
+        self.__value()
+
+      separator : str = self.__peek()
+
+      self.__pos += 1
+
+      if separator == '}':
+        return
+
+      if not separator == ',':
+        raise Exception(f'Expected , or }} in JSON input, found {separator!r}.')
+
+  def __array(self) -> typing.Iterator[typing.Any]:
+
+    self.__expect('[')
+
+    if self.__peek() == ']':
+
+      self.__pos += 1
+
+      return
+
+    while True:
+
+      yield self.__value()
+
+      separator : str = self.__peek()
+
+      self.__pos += 1
+
+      if separator == ']':
+        return
+
+      if not separator == ',':
+        raise Exception(f'Expected , or ] in JSON input, found {separator!r}.')
+
+def iter_json_encode(
+  obj : dict[str, typing.Any],
+  stream_key : str = 'data',
+  chunk_size : int = 1 << 16,
+) -> typing.Iterator[bytes]:
+
+  '''
+  Encodes obj as JSON in chunks of roughly chunk_size bytes.
+  obj[stream_key] may be any iterable (e.g. a generator) and is encoded element by element as a JSON array,
+  so it never has to be held in memory as a whole, neither as list nor as encoded string.
+  '''
+
+  buffer : list[str] = []
+  size : int = 0
+
+  def parts() -> typing.Iterator[str]:
+
+    yield '{'
+
+    first : bool = True
+
+    for key, value in obj.items():
+
+      if not first:
+        yield ','
+
+      first = False
+
+      yield json.dumps(key) + ':'
+
+      if key == stream_key and value is not None:
+
+        yield '['
+
+        for i, element in enumerate(value):
+
+          yield (',' if i else '') + json.dumps(element)
+
+        yield ']'
+
+      else:
+
+        yield json.dumps(value)
+
+    yield '}'
+
+  for part in parts():
+
+    buffer.append(part)
+    size += len(part)
+
+    if size >= chunk_size:
+
+      yield ''.join(buffer).encode()
+
+      buffer = []
+      size = 0
+
+  if buffer:
+    yield ''.join(buffer).encode()
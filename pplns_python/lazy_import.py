@@ -0,0 +1,30 @@
+
+import importlib
+import types
+import typing
+
+class LazyModule:
+
+  '''
+  Stand-in for a module that is imported on first attribute access.
+  '''
+
+  def __init__(self, name : str) -> None:
+
+    self.__name = name
+    self.__module : types.ModuleType | None = None
+
+  def __load(self) -> types.ModuleType:
+
+    if self.__module is None:
+      self.__module = importlib.import_module(self.__name)
+
+    return self.__module
+
+  def __getattr__(self, attr : str) -> typing.Any:
+
+    return getattr(self.__load(), attr)
+
+  def __repr__(self) -> str:
+
+    return f'LazyModule({self.__name!r}, loaded={self.__module is not None})'
@@ -0,0 +1,155 @@
+
+import collections.abc
+import json
+import typing
+
+from pplns_types import DataItem
+
+# json.dumps output is at most this many times larger than the JSON an item was parsed from
+# (', ' and ': ' separators, \uXXXX escapes of non-ASCII characters, floats like 1e15 written out)
+MAX_EXPANSION : int = 5
+
+class LazyDataItem(collections.abc.Mapping):
+
+  '''
+  Read-only stand-in for a DataItem that decodes its payload on first access of 'data'.
+
+  Payloads whose JSON encoding exceeds spill_threshold bytes are written to a temporary file
+  and memory-mapped, so that only the item metadata stays on the heap until the processor
+  actually reads 'data'.
+
+  size_bound is the size of the raw JSON the item was parsed from (or of a response containing it),
+  payloads that cannot exceed spill_threshold by that bound are not encoded for the spill check.
+  '''
+
+  __slots__ = ('__meta', '__data', '__size', '__spill_file', '__spill_map', '__released')
+
+  def __init__(
+    self,
+    item : DataItem,
+    spill_threshold : int | None = None,
+    spill_dir : str | None = None,
+    size_bound : int | None = None,
+  ) -> None:
+
+    self.__meta : dict[str, typing.Any] = { k: v for k, v in item.items() if not k == 'data' }
+    self.__data : typing.Any = item['data'] if 'data' in item else None
+    self.__size : int | None = None
+    self.__spill_file : typing.Any = None
+    self.__spill_map : typing.Any = None
+    self.__released : bool = False
+
+    if spill_threshold is None or self.__data is None:
+      return
+
+    if size_bound is not None and MAX_EXPANSION * size_bound <= spill_threshold:
+      return
+
+    encoded : bytes = json.dumps(self.__data).encode()
+
+    self.__size = len(encoded)
+
+    if len(encoded) > spill_threshold:
+      self.__spill(encoded, spill_dir)
+
+  def __spill(self, encoded : bytes, spill_dir : str | None) -> None:
+
+    # imported here to keep tempfile/mmap out of the import path when spilling is disabled
+    import mmap
+    import tempfile
+
+    spill_file = tempfile.TemporaryFile(dir=spill_dir)
+
+    spill_file.write(encoded)
+    spill_file.flush()
+
+    self.__spill_file = spill_file
+    self.__spill_map = mmap.mmap(spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+    self.__data = None
+
+  @property
+  def spilled(self) -> bool:
+
+    ''' True if the payload currently lives in a memory-mapped file. '''
+
+    return self.__spill_map is not None
+
+  @property
+  def nbytes(self) -> int:
+
+    ''' Size of the spilled payload in bytes or 0 if the payload is held in memory. '''
+
+    return len(self.__spill_map) if self.__spill_map is not None else 0
+
+  @property
+  def encoded_size(self) -> int:
+
+    '''
+    Size of the payload's JSON encoding in bytes. Known from the spill check if the payload was encoded for it,
+    otherwise the payload is encoded once on first access.
+    '''
+
+    if self.__size is None:
+      self.__size = len(json.dumps(self.__load()))
+
+    return self.__size
+
+  def __load(self) -> typing.Any:
+
+    if self.__released:
+      raise Exception(f'Payload of item {self.__meta.get("_id")} has already been released.')
+
+    if self.__data is None and self.__spill_map is not None:
+
+      self.__data = json.loads(self.__spill_map[:])
+
+    return self.__data
+
+  def release(self) -> None:
+
+    '''
+    Drops the payload and removes the spill file, if any.
+    Called by the InputStream once the bundle holding this item has been emitted.
+    '''
+
+    self.__data = None
+    self.__released = True
+
+    if self.__spill_map is not None:
+      self.__spill_map.close()
+      self.__spill_map = None
+
+    if self.__spill_file is not None:
+      self.__spill_file.close()
+      self.__spill_file = None
+
+  def __getitem__(self, key : str) -> typing.Any:
+
+    if key == 'data':
+      return self.__load()
+
+    return self.__meta[key]
+
+  def __iter__(self) -> typing.Iterator[str]:
+
+    yield from self.__meta
+
+    if self.__data is not None or self.__spill_map is not None:
+      yield 'data'
+
+  def __len__(self) -> int:
+
+    return len(self.__meta) + (1 if self.__data is not None or self.__spill_map is not None else 0)
+
+  def __repr__(self) -> str:
+
+    return f'LazyDataItem({self.__meta!r}, spilled={self.spilled})'
+
+def release_item(item : typing.Any) -> None:
+
+  '''
+  Releases the payload of item if it is a LazyDataItem, does nothing otherwise.
+  '''
+
+  if isinstance(item, LazyDataItem):
+    item.release()
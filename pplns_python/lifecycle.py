@@ -0,0 +1,255 @@
+
+import collections
+import contextlib
+import threading
+import time
+import typing
+
+from pplns_python.processor import TaskProcessor
+
+from pplns_python.stats import Stats
+
+if typing.TYPE_CHECKING:
+
+  import concurrent.futures
+
+class TaskState:
+
+  __slots__ = ('ready', 'state', 'error', 'created', 'users', 'evicted', 'torn_down')
+
+  def __init__(self) -> None:
+
+    self.ready = threading.Event()
+    self.state : typing.Any = None
+    self.error : Exception | None = None
+    self.created : float = time.monotonic()
+    # number of bundles currently processed with the state
+    self.users : int = 0
+    self.evicted : bool = False
+    self.torn_down : bool = False
+
+class TaskStates:
+
+  '''
+  Warm states of a TaskProcessor by taskId, least recently used first.
+
+  Each state is set up once, even if bundles of a new task are processed concurrently.
+  Evicted states are torn down once no bundle is being processed with them anymore.
+
+  Errors of teardown_task are counted in stats and passed to on_error. Errors of warm-up setups are only counted,
+  the first bundle of the task sets up the state again and fails with the error.
+  '''
+
+  def __init__(
+    self,
+    processor : TaskProcessor,
+    load_params : typing.Callable[[str], typing.Any],
+    stats : Stats | None = None,
+    on_error : typing.Callable[[Exception], typing.Any] | None = None,
+  ) -> None:
+
+    self.processor : TaskProcessor = processor
+    self.load_params : typing.Callable[[str], typing.Any] = load_params
+    self.stats : Stats = stats or Stats()
+    self.on_error : typing.Callable[[Exception], typing.Any] | None = on_error
+
+    self.__states : collections.OrderedDict[str, TaskState] = collections.OrderedDict()
+    self.__lock = threading.Lock()
+    self.__closed : bool = False
+
+  def __acquire(self, task_id : str) -> tuple[TaskState, bool, list[tuple[str, TaskState]]]:
+
+    ''' Returns the state of task_id, whether the caller has to set it up and states to tear down. '''
+
+    ttl : float | None = self.processor.state_ttl
+
+    evicted : list[tuple[str, TaskState]] = []
+
+    with self.__lock:
+
+      entry : TaskState | None = self.__states.get(task_id)
+
+      if entry is not None and ttl is not None and entry.ready.is_set() and time.monotonic() - entry.created > ttl:
+
+        del self.__states[task_id]
+
+        evicted.append((task_id, entry))
+
+        entry = None
+
+      if entry is not None:
+
+        self.__states.move_to_end(task_id)
+
+        entry.users += 1
+
+        return entry, False, evicted
+
+      entry = TaskState()
+      entry.users += 1
+
+      # states used after close are torn down as soon as they are released
+      entry.evicted = self.__closed
+
+      self.__states[task_id] = entry
+
+      while len(self.__states) > self.processor.max_tasks:
+
+        evicted.append(self.__states.popitem(last=False))
+
+        self.stats.incr('task_states.evictions')
+
+      for _, evicted_entry in evicted:
+        evicted_entry.evicted = True
+
+      return entry, True, evicted
+
+  def __claim_teardown(self, entry : TaskState) -> bool:
+
+    '''
+    Whether the caller has to tear down entry: it is evicted, set up and unused, and nobody claimed it before.
+    Must be called with the lock held.
+    '''
+
+    if not entry.evicted or entry.users > 0 or not entry.ready.is_set() or entry.torn_down:
+      return False
+
+    entry.torn_down = True
+
+    return entry.error is None
+
+  def __release(self, task_id : str, entry : TaskState) -> None:
+
+    with self.__lock:
+
+      entry.users -= 1
+
+      teardown : bool = self.__claim_teardown(entry)
+
+    if teardown:
+      self.__teardown(task_id, entry)
+
+  def __teardown(self, task_id : str, entry : TaskState) -> None:
+
+    try:
+
+      self.processor.teardown_task(task_id, entry.state)
+
+    except Exception as e:
+
+      self.stats.incr('task_states.teardown_errors')
+
+      if self.on_error:
+        self.on_error(e)
+
+  def __setup(self, task_id : str, entry : TaskState) -> None:
+
+    start : float = time.monotonic()
+
+    try:
+
+      entry.state = self.processor.setup_task(task_id, self.load_params(task_id))
+
+      self.stats.timing('task_setup', time.monotonic() - start)
+
+    except Exception as e:
+
+      entry.error = e
+
+      # the next bundle of the task tries again
+      with self.__lock:
+
+        if self.__states.get(task_id) is entry:
+          del self.__states[task_id]
+
+    finally:
+
+      entry.ready.set()
+
+  @contextlib.contextmanager
+  def use(self, task_id : str) -> typing.Iterator[typing.Any]:
+
+    ''' Context with the state of task_id, setting it up first if necessary. '''
+
+    entry, setup, evicted = self.__acquire(task_id)
+
+    try:
+
+      with self.__lock:
+        teardown : list[tuple[str, TaskState]] = [
+          (evicted_id, evicted_entry) for evicted_id, evicted_entry in evicted if self.__claim_teardown(evicted_entry)
+        ]
+
+      for evicted_id, evicted_entry in teardown:
+        self.__teardown(evicted_id, evicted_entry)
+
+      if setup:
+        self.__setup(task_id, entry)
+
+      entry.ready.wait()
+
+      if entry.error is not None:
+        raise entry.error
+
+      yield entry.state
+
+    finally:
+
+      self.__release(task_id, entry)
+
+  def warm(
+    self,
+    task_id : str,
+    executor : typing.Optional['concurrent.futures.Executor'] = None,
+  ) -> None:
+
+    '''
+    Sets up the state of task_id in the background if it does not exist yet.
+    Without an executor the state is set up right away in the calling thread.
+    '''
+
+    with self.__lock:
+
+      if self.__closed or task_id in self.__states:
+        return
+
+    def run() -> None:
+
+      try:
+
+        with self.use(task_id):
+          pass
+
+      except Exception:
+        self.stats.incr('task_states.warm_errors')
+
+    if executor:
+      executor.submit(run)
+    else:
+      run()
+
+  def close(self) -> None:
+
+    ''' Tears down all states. '''
+
+    with self.__lock:
+
+      self.__closed = True
+
+      entries : list[tuple[str, TaskState]] = list(self.__states.items())
+
+      self.__states.clear()
+
+      for _, entry in entries:
+        entry.evicted = True
+
+      teardown : list[tuple[str, TaskState]] = [
+        (task_id, entry) for task_id, entry in entries if self.__claim_teardown(entry)
+      ]
+
+    for task_id, entry in teardown:
+      self.__teardown(task_id, entry)
+
+  def __len__(self) -> int:
+
+    return len(self.__states)
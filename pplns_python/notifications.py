@@ -0,0 +1,206 @@
+
+import threading
+import time
+import typing
+
+from urllib.parse import urlsplit
+
+from pplns_python.stats import Stats
+
+from pplns_python.transport import \
+  UNIX_SCHEME, \
+  unix_connection, \
+  unix_socket_path
+
+if typing.TYPE_CHECKING:
+
+  import http.client
+
+# called with the event name and data of each server-sent event
+NotificationHandler = typing.Callable[[str, str], None]
+
+class NotificationListener:
+
+  '''
+  Subscribes to a stream of server-sent events (text/event-stream) announcing new bundles.
+
+  Runs in a background thread and calls the handler for each event. The handler is also called with
+  the event 'disconnected' whenever the connection drops, the listener then reconnects with exponential backoff.
+  Comment lines (keep-alives) are skipped, a connection without any line for read_timeout seconds counts as dropped.
+  Connection errors are counted in stats (notifications.errors), the last one is kept in last_error.
+  '''
+
+  def __init__(
+    self,
+    url : str,
+    headers : dict[str, str] | None = None,
+    reconnect_delay : float = 0.5,
+    max_reconnect_delay : float = 30.0,
+    read_timeout : float = 60.0,
+    stats : Stats | None = None,
+  ) -> None:
+
+    self.url : str = url
+    self.headers : dict[str, str] = headers or {}
+    self.reconnect_delay : float = reconnect_delay
+    self.max_reconnect_delay : float = max_reconnect_delay
+    self.read_timeout : float = read_timeout
+
+    self.stats : Stats = stats or Stats()
+
+    self.reconnects : int = 0
+    self.last_error : Exception | None = None
+
+    self.__connected : bool = False
+    self.__stop = threading.Event()
+    self.__thread : threading.Thread | None = None
+    self.__connection : typing.Optional['http.client.HTTPConnection'] = None
+
+  @property
+  def connected(self) -> bool:
+
+    return self.__connected
+
+  def start(self, handler : NotificationHandler) -> None:
+
+    if self.__thread or self.__stop.is_set():
+      return
+
+    self.__thread = threading.Thread(
+      target=self.__run,
+      args=(handler,),
+      name='pplns-notifications',
+      daemon=True
+    )
+
+    self.__thread.start()
+
+  def close(self) -> None:
+
+    self.__stop.set()
+
+    connection = self.__connection
+
+    # unblocks the pending read
+    if connection and connection.sock:
+
+      import socket
+
+      try:
+        connection.sock.shutdown(socket.SHUT_RDWR)
+      except OSError:
+        pass
+
+  def __run(self, handler : NotificationHandler) -> None:
+
+    delay : float = self.reconnect_delay
+
+    while not self.__stop.is_set():
+
+      started : float = time.monotonic()
+
+      try:
+
+        self.__listen(handler)
+
+      except Exception as e:
+
+        if not self.__stop.is_set():
+
+          self.last_error = e
+
+          self.stats.incr('notifications.errors')
+
+      if self.__connected:
+
+        self.__connected = False
+
+        handler('disconnected', '')
+
+      if self.__stop.is_set():
+        break
+
+      # a connection that lasted a while starts over with the shortest delay
+      if time.monotonic() - started > self.max_reconnect_delay:
+        delay = self.reconnect_delay
+
+      self.__stop.wait(delay)
+
+      delay = min(2 * delay, self.max_reconnect_delay)
+
+      self.reconnects += 1
+
+  def __listen(self, handler : NotificationHandler) -> None:
+
+    import http.client
+
+    url = urlsplit(self.url)
+
+    connection : http.client.HTTPConnection
+
+    if url.scheme == UNIX_SCHEME:
+      connection = unix_connection(unix_socket_path(url.netloc), timeout=self.read_timeout)
+    elif url.scheme == 'https':
+      connection = http.client.HTTPSConnection(url.netloc, timeout=self.read_timeout)
+    else:
+      connection = http.client.HTTPConnection(url.netloc, timeout=self.read_timeout)
+
+    self.__connection = connection
+
+    try:
+
+      connection.request(
+        'GET',
+        url.path + ('?' + url.query if url.query else ''),
+        headers={ **self.headers, 'Accept': 'text/event-stream', 'Cache-Control': 'no-cache' }
+      )
+
+      response = connection.getresponse()
+
+      if not response.status == 200:
+        raise Exception(f'Notification stream responded with {response.status}.')
+
+      self.__connected = True
+
+      handler('connected', '')
+
+      event : str = 'message'
+      data : list[str] = []
+
+      while not self.__stop.is_set():
+
+        raw : bytes = response.readline()
+
+        if not raw:
+          return
+
+        line : str = raw.decode().rstrip('\r\n')
+
+        if not line:
+
+          if data:
+            handler(event, '\n'.join(data))
+
+          event, data = 'message', []
+
+        elif line.startswith(':'):
+
+          continue
+
+        else:
+
+          field, _, value = line.partition(':')
+
+          value = value[1:] if value.startswith(' ') else value
+
+          if field == 'event':
+            event = value
+
+          elif field == 'data':
+            data.append(value)
+
+    finally:
+
+      self.__connection = None
+
+      connection.close()
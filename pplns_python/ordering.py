@@ -0,0 +1,203 @@
+
+import collections
+import threading
+import time
+import typing
+
+from pplns_python.processor import \
+  PreparedInput, \
+  ProcessorOutput
+
+from pplns_python.stats import Stats
+
+# 'unordered': outputs are emitted as soon as they are ready
+# 'task': outputs are emitted in the order the bundles of a task were consumed
+# 'consumer': outputs are emitted in the order the bundles of a consumer node (within a task) were consumed
+OrderingMode = typing.Literal['unordered', 'task', 'consumer']
+
+def ordering_key(inp : PreparedInput, mode : OrderingMode) -> tuple[str, ...] | None:
+
+  ''' Inputs with the same key are emitted in order, None for unordered inputs. '''
+
+  if mode == 'task':
+    return (inp.ref.task_id,)
+
+  if mode == 'consumer':
+    return (inp.ref.task_id, inp.ref.consumer_id)
+
+  return None
+
+PENDING, DONE, SKIPPED = 0, 1, 2
+
+class ReorderEntry:
+
+  __slots__ = ('inp', 'key', 'state', 'output', 'completed', 'held')
+
+  def __init__(self, inp : PreparedInput, key : tuple[str, ...]) -> None:
+
+    self.inp : PreparedInput = inp
+    self.key : tuple[str, ...] = key
+    self.state : int = PENDING
+    self.output : ProcessorOutput | None = None
+    self.completed : float = 0.0
+    # completed before an earlier input of the same key
+    self.held : bool = False
+
+# (input, output) pairs that are ready to be emitted, in order
+Ready = typing.Iterator[tuple[PreparedInput, ProcessorOutput | None]]
+
+class ReorderBuffer:
+
+  '''
+  Holds back the outputs of bundles that completed before earlier bundles with the same ordering key.
+
+  Inputs are registered in the order they were consumed. Completed outputs are handed out through the
+  iterators returned by complete and discard, which have to be exhausted by the caller: only one thread
+  hands out the outputs of a key at a time, so outputs are emitted in order even with concurrent processing.
+  Inputs that leave without an output (failed, expired, unconsumed) are discarded and no longer hold back
+  the inputs after them. A failed bundle that is redelivered later is registered again as a new input.
+
+  Only completed outputs whose predecessors are still pending are held. The stream stops consuming while
+  max_held outputs are held, the bundles that are already queued keep being dispatched so that the
+  held outputs are released eventually.
+  '''
+
+  def __init__(self, max_held : int = 1000, stats : Stats | None = None) -> None:
+
+    self.max_held : int = max_held
+    self.stats : Stats = stats or Stats()
+
+    # entries by id() of their input
+    self.__entries : dict[int, ReorderEntry] = {}
+    # entries by key, in the order they were registered
+    self.__keys : dict[tuple[str, ...], collections.deque[ReorderEntry]] = {}
+    # keys whose outputs are being handed out
+    self.__emitting : set[tuple[str, ...]] = set()
+    self.__held : int = 0
+    self.__lock = threading.Lock()
+
+  def register(self, inp : PreparedInput, key : tuple[str, ...]) -> None:
+
+    entry = ReorderEntry(inp, key)
+
+    with self.__lock:
+
+      self.__entries[id(inp)] = entry
+
+      self.__keys.setdefault(key, collections.deque()).append(entry)
+
+  def complete(self, inp : PreparedInput, output : ProcessorOutput | None) -> Ready:
+
+    '''
+    Records the output of inp and returns the outputs that can be emitted now.
+    '''
+
+    with self.__lock:
+
+      entry : ReorderEntry | None = self.__entries.get(id(inp))
+
+      if entry is None:
+        return iter(((inp, output),))
+
+      entry.state = DONE
+      entry.output = output
+      entry.completed = time.monotonic()
+      entry.held = not self.__keys[entry.key][0] is entry
+
+      self.__held += 1
+
+      self.stats.gauge('reorder.held', self.__held)
+
+      return self.__start(entry.key)
+
+  def discard(self, inp : PreparedInput) -> Ready:
+
+    '''
+    Removes an input that will not be completed and returns the outputs that it held back.
+    Has no effect on completed inputs.
+    '''
+
+    with self.__lock:
+
+      entry : ReorderEntry | None = self.__entries.get(id(inp))
+
+      if entry is None or not entry.state == PENDING:
+        return iter(())
+
+      entry.state = SKIPPED
+
+      del self.__entries[id(inp)]
+
+      return self.__start(entry.key)
+
+  def __start(self, key : tuple[str, ...]) -> Ready:
+
+    # the thread that is handing out the outputs of key picks up this output as well
+    if key in self.__emitting:
+      return iter(())
+
+    self.__emitting.add(key)
+
+    return self.__drain(key)
+
+  def __drain(self, key : tuple[str, ...]) -> Ready:
+
+    drained : bool = False
+
+    try:
+
+      while True:
+
+        with self.__lock:
+
+          queue : collections.deque[ReorderEntry] = self.__keys[key]
+
+          while queue and queue[0].state == SKIPPED:
+            queue.popleft()
+
+          if not queue or queue[0].state == PENDING:
+
+            self.__emitting.discard(key)
+
+            if not queue:
+              del self.__keys[key]
+
+            drained = True
+
+            return
+
+          entry : ReorderEntry = queue.popleft()
+
+          del self.__entries[id(entry.inp)]
+
+          self.__held -= 1
+
+          self.stats.gauge('reorder.held', self.__held)
+
+        if entry.held:
+          self.stats.timing('reorder.hold', time.monotonic() - entry.completed)
+
+        yield entry.inp, entry.output
+
+    finally:
+
+      # a caller that stops early must not block the key for good, the next completion or discard resumes it
+      if not drained:
+
+        with self.__lock:
+          self.__emitting.discard(key)
+
+  @property
+  def held(self) -> int:
+
+    ''' Number of completed outputs that have not been handed out yet. '''
+
+    return self.__held
+
+  def full(self) -> bool:
+
+    return self.__held >= self.max_held
+
+  def __len__(self) -> int:
+
+    return len(self.__entries)
@@ -0,0 +1,170 @@
+
+import bisect
+import hashlib
+import threading
+import time
+import typing
+
+if typing.TYPE_CHECKING:
+
+  from pplns_python.api import PipelineApi
+
+from pplns_types import BundleQuery
+
+def hash_key(key : str) -> int:
+
+  return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+class Partitioner:
+
+  '''
+  Assigns keys (taskIds) to replicas using consistent hashing.
+
+  Each replica owns vnodes points on a hash ring. When the replica count changes, only the keys
+  between the added or removed points move to another replica.
+  '''
+
+  def __init__(
+    self,
+    replica_index : int,
+    replica_count : int,
+    vnodes : int = 64,
+  ) -> None:
+
+    self.vnodes : int = vnodes
+
+    self.__lock = threading.Lock()
+
+    self.rebalance(replica_index, replica_count)
+
+  def rebalance(
+    self,
+    replica_index : int,
+    replica_count : int
+  ) -> None:
+
+    '''
+    Rebuilds the ring for a new replica count (or a new index of this replica).
+    '''
+
+    if not 0 <= replica_index < replica_count:
+      raise Exception(f'Replica index {replica_index} is not within [0, {replica_count}).')
+
+    ring : list[tuple[int, int]] = sorted(
+      (hash_key(f'{replica}:{vnode}'), replica)
+      for replica in range(replica_count)
+      for vnode in range(self.vnodes)
+    )
+
+    with self.__lock:
+
+      self.replica_index : int = replica_index
+      self.replica_count : int = replica_count
+
+      self.__points : list[int] = [point for point, _ in ring]
+      self.__owners : list[int] = [owner for _, owner in ring]
+
+  def owner(self, key : str) -> int:
+
+    ''' Returns the index of the replica that owns key. '''
+
+    with self.__lock:
+
+      position : int = bisect.bisect(self.__points, hash_key(key)) % len(self.__points)
+
+      return self.__owners[position]
+
+  def owns(self, key : str) -> bool:
+
+    return self.owner(key) == self.replica_index
+
+class PartitionedQueries:
+
+  '''
+  Expands a BundleQuery into one query per task owned by this replica that has bundles to consume.
+
+  The API cannot filter by hash, so instead of polling every owned task, task_ids discovers the tasks with
+  pending bundles (at most every refresh seconds, measured with clock) and only those are polled.
+  A task is polled again in the next iteration while its polls return at least min_batch bundles, i.e. while
+  its bundles arrive faster than they are polled. Otherwise it waits for a later discovery to find bundles for it.
+  Idle tasks cost no polls and busy tasks are consumed in batches, in exchange bundles that arrive between
+  discoveries wait for the next one (up to refresh seconds).
+  '''
+
+  def __init__(
+    self,
+    partitioner : Partitioner,
+    task_ids : typing.Callable[[BundleQuery], typing.Iterable[str]],
+    refresh : float = 5.0,
+    min_batch : int = 2,
+    clock : typing.Callable[[], float] = time.monotonic,
+  ) -> None:
+
+    self.partitioner : Partitioner = partitioner
+    self.task_ids = task_ids
+    self.refresh : float = refresh
+    self.min_batch : int = min_batch
+    self.clock = clock
+
+    # owned tasks to poll by query along with the time of the last discovery
+    self.__tasks : dict[str, tuple[float, set[str]]] = {}
+
+  def __active_tasks(self, query : BundleQuery) -> set[str]:
+
+    key : str = repr(sorted(query.items()))
+
+    now : float = self.clock()
+
+    if key in self.__tasks and now - self.__tasks[key][0] < self.refresh:
+      return self.__tasks[key][1]
+
+    active : set[str] = self.__tasks[key][1] if key in self.__tasks else set()
+
+    active.update(task_id for task_id in set(self.task_ids(query)) if self.partitioner.owns(task_id))
+
+    self.__tasks[key] = (now, active)
+
+    return active
+
+  def queries(self, query : BundleQuery) -> list[BundleQuery]:
+
+    '''
+    Returns the queries to poll in this iteration.
+    '''
+
+    if 'taskId' in query:
+      return [query] if self.partitioner.owns(query['taskId']) else []
+
+    active : set[str] = self.__active_tasks(query)
+
+    # tasks moved to another replica by a rebalance
+    active.difference_update([task_id for task_id in active if not self.partitioner.owns(task_id)])
+
+    return [{ **query, 'taskId': task_id } for task_id in sorted(active)]
+
+  def report(self, task_id : str, count : int) -> None:
+
+    '''
+    Feeds back the number of bundles consumed by polling a task.
+    '''
+
+    if count >= self.min_batch:
+      return
+
+    # the task has (most likely) been drained, the next discovery that finds bundles for it brings it back
+    for _, active in self.__tasks.values():
+      active.discard(task_id)
+
+def pending_task_ids(
+  api : 'PipelineApi',
+  limit : int = 100
+) -> typing.Callable[[BundleQuery], list[str]]:
+
+  '''
+  Task discovery for PartitionedQueries: the tasks of the first limit bundles matching the query, without consuming them.
+
+  The API returns whole bundles, limit bounds the size of a discovery response. Tasks behind the first limit
+  bundles are discovered once the bundles in front of them have been consumed.
+  '''
+
+  return lambda query: [bundle['taskId'] for bundle in api.get_bundles({ **query, 'limit': limit })]
@@ -1,7 +1,12 @@
 
+import collections.abc
 import typing
 from typing_extensions import NotRequired
-from xmlrpc.client import boolean
+
+if typing.TYPE_CHECKING:
+
+  from pplns_python.tracing import Trace
+  from pplns_python.columnar import ColumnarBatch
 
 from pplns_types import \
   DataItem, \
@@ -9,8 +14,61 @@ from pplns_types import \
   FlowIdSchema
 
 
-PreparedInput = typing.TypedDict(
-  'PreparedInput',
+class BundleRef:
+
+  '''
+  Immutable reference to the bundle a PreparedInput was created from.
+  '''
+
+  __slots__ = ('bundle_id', 'task_id', 'consumer_id', 'consumption_id', 'worker_id')
+
+  bundle_id : str
+  task_id : str
+  consumer_id : str
+  consumption_id : str | None
+  worker_id : str | None
+
+  def __init__(
+    self,
+    bundle_id : str,
+    task_id : str,
+    consumer_id : str,
+    consumption_id : str | None = None,
+    worker_id : str | None = None,
+  ) -> None:
+
+    object.__setattr__(self, 'bundle_id', bundle_id)
+    object.__setattr__(self, 'task_id', task_id)
+    object.__setattr__(self, 'consumer_id', consumer_id)
+    object.__setattr__(self, 'consumption_id', consumption_id)
+    object.__setattr__(self, 'worker_id', worker_id)
+
+  @staticmethod
+  def from_bundle(bundle : BundleRead) -> 'BundleRef':
+
+    return BundleRef(
+      bundle['_id'],
+      bundle['taskId'],
+      bundle['consumerId'],
+      bundle['consumptionId'] if 'consumptionId' in bundle else None,
+      bundle['workerId'] if 'workerId' in bundle else None,
+    )
+
+  def __setattr__(self, name : str, value : typing.Any) -> None:
+
+    raise AttributeError('BundleRef is immutable.')
+
+  def __delattr__(self, name : str) -> None:
+
+    raise AttributeError('BundleRef is immutable.')
+
+  def __repr__(self) -> str:
+
+    return f'BundleRef({self.bundle_id!r}, task_id={self.task_id!r}, consumer_id={self.consumer_id!r})'
+
+# dict layout of a PreparedInput as returned by PreparedInput.as_dict()
+PreparedInputDict = typing.TypedDict(
+  'PreparedInputDict',
   {
     # bundle id
     '_id': str,
@@ -25,12 +83,102 @@ PreparedInput = typing.TypedDict(
   },
 )
 
+class PreparedInput(collections.abc.Mapping):
+
+  '''
+  Immutable, slotted record of a bundle that is ready to be processed.
+
+  Fields are accessed as attributes (inp.ref.task_id, inp.inputs).
+  For existing processors, the record is also a read-only mapping with the keys of PreparedInputDict
+  (inp['taskId'], inp['inputs'], ...).
+  '''
+
+  __slots__ = ('ref', 'inputs', 'bundle', 'trace', 'deadline')
+
+  _keys = ('_id', 'taskId', 'consumerId', 'inputs', 'bundle')
+
+  ref : BundleRef
+  # data items by their name
+  inputs : dict[str, DataItem]
+  # original bundle, referenced rather than copied: processors read fields the record does not expose (inp['bundle']).
+  # prepare_bundle drops its 'items' once lazy items own them
+  bundle : BundleRead
+  # stage timestamps if the bundle has been sampled for tracing
+  trace : typing.Optional['Trace']
+  # time.monotonic() after which the stream abandons the bundle, if the stream has a deadline
+  deadline : float | None
+
+  def __init__(
+    self,
+    ref : BundleRef,
+    inputs : dict[str, DataItem],
+    bundle : BundleRead,
+    trace : typing.Optional['Trace'] = None,
+    deadline : float | None = None,
+  ) -> None:
+
+    object.__setattr__(self, 'ref', ref)
+    object.__setattr__(self, 'inputs', inputs)
+    object.__setattr__(self, 'bundle', bundle)
+    object.__setattr__(self, 'trace', trace)
+    object.__setattr__(self, 'deadline', deadline)
+
+  def __setattr__(self, name : str, value : typing.Any) -> None:
+
+    raise AttributeError('PreparedInput is immutable.')
+
+  def __delattr__(self, name : str) -> None:
+
+    raise AttributeError('PreparedInput is immutable.')
+
+  def __getitem__(self, key : str) -> typing.Any:
+
+    if key == 'inputs':
+      return self.inputs
+    elif key == 'taskId':
+      return self.ref.task_id
+    elif key == '_id':
+      return self.ref.bundle_id
+    elif key == 'consumerId':
+      return self.ref.consumer_id
+    elif key == 'bundle':
+      return self.bundle
+
+    raise KeyError(key)
+
+  def __iter__(self) -> typing.Iterator[str]:
+
+    return iter(self._keys)
+
+  def __len__(self) -> int:
+
+    return len(self._keys)
+
+  def as_dict(self) -> PreparedInputDict:
+
+    '''
+    Returns a plain dict copy in the layout PreparedInput used to have.
+    '''
+
+    return {
+      '_id': self.ref.bundle_id,
+      'taskId': self.ref.task_id,
+      'consumerId': self.ref.consumer_id,
+      'inputs': self.inputs,
+      'bundle': self.bundle,
+    }
+
+  def __repr__(self) -> str:
+
+    return f'PreparedInput({self.ref!r}, inputs={list(self.inputs.keys())!r})'
+
 # partial data item to emit from a single output channel
 OutputPerChannel = typing.TypedDict(
   'OutputPerChannel',
   {
-    'done': NotRequired[boolean],
-    'data': list[typing.Any],
+    'done': NotRequired[bool],
+    # may be a generator for large outputs, which are then sent as a streamed request body
+    'data': typing.Iterable[typing.Any],
   }
 )
 
@@ -41,11 +189,46 @@ class BatchProcessor:
 
   max_batch_size : int = 50
 
-  def __call__(self, inputs : list[PreparedInput]) -> list[ProcessorOutput] | None:
+  # receive a ColumnarBatch (see pplns_python.columnar) instead of a list of inputs
+  columnar : bool = False
+
+  def __call__(self, inputs : typing.Union[list[PreparedInput], 'ColumnarBatch']) -> list[ProcessorOutput] | None:
+
+    raise Exception('Not implemented.')
+
+class TaskProcessor:
+
+  '''
+  Processor with lifecycle hooks. The stream calls setup once before the first bundle and teardown on close.
+
+  setup_task builds the warm state of a task (e.g. a model loaded according to the task params) the first time
+  a bundle of that task is consumed, with an executor in the background while the bundle is queued.
+  process receives that state with every bundle of the task. States of up to max_tasks tasks are kept,
+  the least recently used are handed to teardown_task, as are states older than state_ttl seconds
+  so that changed task params are picked up.
+  '''
+
+  max_tasks : int = 8
+
+  state_ttl : float | None = None
+
+  def setup(self) -> None:
+    pass
+
+  def teardown(self) -> None:
+    pass
+
+  def setup_task(self, task_id : str, params : typing.Any) -> typing.Any:
+    return None
+
+  def teardown_task(self, task_id : str, state : typing.Any) -> None:
+    pass
+
+  def process(self, inp : PreparedInput, state : typing.Any) -> ProcessorOutput | None:
 
     raise Exception('Not implemented.')
 
 BundleProcessor = typing.Callable[
   [PreparedInput],
   ProcessorOutput | None
-] | BatchProcessor
+] | BatchProcessor | TaskProcessor
@@ -0,0 +1,228 @@
+
+import os
+import sys
+import threading
+import time
+import typing
+
+if typing.TYPE_CHECKING:
+
+  import types
+
+class NullStage:
+
+  ''' Stage context used while profiling is disabled. '''
+
+  def __enter__(self) -> None:
+    pass
+
+  def __exit__(self, *exc : typing.Any) -> None:
+    pass
+
+null_stage = NullStage()
+
+class Stage:
+
+  '''
+  Marks the current thread as being inside a named stage while profiling is enabled.
+  '''
+
+  def __init__(self, sampler : 'StackSampler', name : str) -> None:
+
+    self.sampler = sampler
+    self.name : str = name
+
+  def __enter__(self) -> None:
+
+    self.sampler.push_stage(self.name)
+
+  def __exit__(self, *exc : typing.Any) -> None:
+
+    self.sampler.pop_stage()
+
+class StackSampler:
+
+  '''
+  Stack sampling profiler for the stages of an InputStream (prepare_bundle, processor, encode, emit_item, ...).
+
+  While enabled, a background thread periodically samples the stacks of all threads that are inside a stage.
+  Samples are aggregated in collapsed-stack format ("stage;frame;frame count"), which flamegraph.pl and
+  speedscope read directly, and written to output_dir when profiling is disabled.
+  '''
+
+  def __init__(
+    self,
+    output_dir : str | None = None,
+    interval : float = 0.005,
+  ) -> None:
+
+    self.output_dir : str = output_dir or os.environ.get('PPLNS_PROFILE_DIR', 'profiles')
+    self.interval : float = interval
+
+    self.__enabled : bool = False
+    self.__lock = threading.Lock()
+    self.__thread : threading.Thread | None = None
+
+    # stage stacks by thread ident
+    self.__stages : dict[int, list[str]] = {}
+    self.__samples : dict[str, int] = {}
+
+  @property
+  def enabled(self) -> bool:
+
+    return self.__enabled
+
+  def stage(self, name : str) -> Stage | NullStage:
+
+    '''
+    Context manager marking a stage. Costs a single attribute lookup while profiling is disabled.
+    '''
+
+    return Stage(self, name) if self.__enabled else null_stage
+
+  def push_stage(self, name : str) -> None:
+
+    self.__stages.setdefault(threading.get_ident(), []).append(name)
+
+  def pop_stage(self) -> None:
+
+    stages = self.__stages.get(threading.get_ident())
+
+    if stages:
+      stages.pop()
+
+  def enable(self) -> None:
+
+    with self.__lock:
+
+      if self.__enabled:
+        return
+
+      self.__samples = {}
+      self.__enabled = True
+
+      self.__thread = threading.Thread(target=self.__run, name='pplns-profiler', daemon=True)
+      self.__thread.start()
+
+  def disable(self) -> str | None:
+
+    '''
+    Stops sampling and writes the collected samples. Returns the path of the written file.
+    '''
+
+    with self.__lock:
+
+      if not self.__enabled:
+        return None
+
+      self.__enabled = False
+
+      thread = self.__thread
+      self.__thread = None
+
+    if thread:
+      thread.join()
+
+    self.__stages.clear()
+
+    return self.write()
+
+  def toggle(self) -> str | None:
+
+    if self.__enabled:
+      return self.disable()
+
+    self.enable()
+
+    return None
+
+  def install_signal(self, signum : int | None = None) -> None:
+
+    '''
+    Toggles profiling when the process receives signum (SIGUSR2 by default).
+    '''
+
+    import signal
+
+    signal.signal(
+      signum or signal.SIGUSR2,
+      lambda signum, frame: threading.Thread(target=self.__toggle_and_report).start()
+    )
+
+  def __toggle_and_report(self) -> None:
+
+    # disabling joins the sampler thread, which must not happen inside the signal handler
+    path : str | None = self.toggle()
+
+    print(f'[profiler] wrote {path}' if path else '[profiler] enabled', file=sys.stderr)
+
+  def samples(self) -> dict[str, int]:
+
+    ''' Collapsed stacks collected so far. '''
+
+    with self.__lock:
+      return dict(self.__samples)
+
+  def write(self) -> str | None:
+
+    samples : dict[str, int] = self.samples()
+
+    if not samples:
+      return None
+
+    os.makedirs(self.output_dir, exist_ok=True)
+
+    path : str = os.path.join(
+      self.output_dir,
+      f'profile-{os.getpid()}-{time.strftime("%Y%m%d-%H%M%S")}.folded'
+    )
+
+    with open(path, 'w') as f:
+
+      for stack, count in sorted(samples.items()):
+        f.write(f'{stack} {count}\n')
+
+    return path
+
+  def __run(self) -> None:
+
+    own_ident : int = threading.get_ident()
+
+    while self.__enabled:
+
+      frames : dict[int, 'types.FrameType'] = sys._current_frames()
+
+      for ident, stages in list(self.__stages.items()):
+
+        if ident == own_ident or not stages or not ident in frames:
+          continue
+
+        stack : str = ';'.join(['stage:' + stages[-1]] + format_stack(frames[ident]))
+
+        with self.__lock:
+          self.__samples[stack] = self.__samples.get(stack, 0) + 1
+
+      del frames
+
+      time.sleep(self.interval)
+
+def format_stack(frame : typing.Optional['types.FrameType']) -> list[str]:
+
+  ''' Frames from outermost to innermost as "function (file:line)". '''
+
+  names : list[str] = []
+
+  while frame is not None:
+
+    code = frame.f_code
+
+    names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+
+    frame = frame.f_back
+
+  names.reverse()
+
+  return names
+
+# process wide profiler used by the InputStream and PipelineApi stages
+profiler = StackSampler()
@@ -0,0 +1,132 @@
+
+import threading
+import time
+import typing
+
+class TokenBucket:
+
+  '''
+  Thread safe token bucket. Tokens refill at rate per second up to burst.
+  '''
+
+  def __init__(
+    self,
+    rate : float,
+    burst : float,
+  ) -> None:
+
+    if rate <= 0 or burst < 1:
+      raise Exception('TokenBucket requires rate > 0 and burst >= 1.')
+
+    self.rate : float = rate
+    self.burst : float = burst
+
+    self.__tokens : float = burst
+    self.__updated : float = time.monotonic()
+    self.__blocked_until : float = 0.0
+    self.__lock = threading.Lock()
+
+  def __reserve(self, tokens : float) -> float:
+
+    ''' Takes tokens (possibly going into debt) and returns how long the caller has to wait. '''
+
+    with self.__lock:
+
+      now : float = time.monotonic()
+
+      self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+      self.__updated = now
+
+      self.__tokens -= tokens
+
+      wait : float = -self.__tokens / self.rate if self.__tokens < 0 else 0.0
+
+      return max(wait, self.__blocked_until - now)
+
+  def acquire(self, tokens : float = 1) -> float:
+
+    '''
+    Blocks until tokens are available. Returns the number of seconds waited.
+    '''
+
+    wait : float = self.__reserve(tokens)
+
+    if wait > 0:
+      time.sleep(wait)
+
+    return wait
+
+  def block_for(self, seconds : float) -> None:
+
+    '''
+    Stops handing out tokens for the given number of seconds (used to honour Retry-After).
+    '''
+
+    with self.__lock:
+
+      self.__blocked_until = max(self.__blocked_until, time.monotonic() + seconds)
+
+      # start from an empty bucket afterwards instead of sending a full burst right away
+      self.__tokens = min(self.__tokens, 0)
+
+class RateLimiter:
+
+  '''
+  Token buckets by API route ('consume', 'bundles', 'outputs', 'unconsume', 'tasks', 'workers', see api.route_of).
+  Routes without a budget are not limited.
+  '''
+
+  def __init__(self, budgets : dict[str, tuple[float, float]]) -> None:
+
+    '''
+    budgets: maps route to (requests per second, burst)
+    '''
+
+    self.buckets : dict[str, TokenBucket] = {
+      route: TokenBucket(rate, burst) for route, (rate, burst) in budgets.items()
+    }
+
+  def acquire(self, route : str | None) -> float:
+
+    if route is None or not route in self.buckets:
+      return 0.0
+
+    return self.buckets[route].acquire()
+
+  def block_for(self, route : str | None, seconds : float) -> bool:
+
+    ''' Returns False if there is no budget for route (the caller has to wait itself). '''
+
+    if route is None or not route in self.buckets:
+      return False
+
+    self.buckets[route].block_for(seconds)
+
+    return True
+
+def parse_retry_after(value : typing.Optional[str]) -> float | None:
+
+  '''
+  Parses a Retry-After header (delay in seconds or HTTP date) into seconds from now.
+  '''
+
+  if not value:
+    return None
+
+  try:
+
+    return max(0.0, float(value))
+
+  except ValueError:
+
+    import email.utils
+
+    try:
+
+      date = email.utils.parsedate_to_datetime(value)
+
+    except (TypeError, ValueError):
+
+      return None
+
+    return max(0.0, date.timestamp() - time.time())
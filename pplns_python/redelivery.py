@@ -0,0 +1,123 @@
+
+import collections
+import json
+import threading
+import time
+import typing
+
+from pplns_python.processor import PreparedInput
+
+# called with the input, the last error and the number of failed attempts
+QuarantineHandler = typing.Callable[[PreparedInput, Exception, int], None]
+
+class RedeliveryPolicy:
+
+  '''
+  Counts processing failures per bundle and decides what happens to a failed bundle.
+
+  The n-th failure of a bundle delays its unconsume by base_delay * 2 ** (n - 1) seconds (at most max_delay),
+  so that a bundle that keeps failing does not come straight back in a hot loop. After max_attempts failures,
+  the bundle is quarantined instead: it stays consumed (and with that out of the queue) and on_quarantine is called.
+
+  Failure counts are kept per worker process for at most max_entries bundles (least recently failed are forgotten).
+  '''
+
+  def __init__(
+    self,
+    max_attempts : int = 5,
+    base_delay : float = 1.0,
+    max_delay : float = 300.0,
+    on_quarantine : QuarantineHandler | None = None,
+    max_entries : int = 10000,
+  ) -> None:
+
+    self.max_attempts : int = max_attempts
+    self.base_delay : float = base_delay
+    self.max_delay : float = max_delay
+    self.on_quarantine : QuarantineHandler | None = on_quarantine
+    self.max_entries : int = max_entries
+
+    self.__failures : collections.OrderedDict[str, int] = collections.OrderedDict()
+    self.__lock = threading.Lock()
+
+  def failed(self, bundle_id : str) -> int:
+
+    ''' Records a failure and returns the number of failed attempts of the bundle. '''
+
+    with self.__lock:
+
+      attempts : int = self.__failures.pop(bundle_id, 0) + 1
+
+      self.__failures[bundle_id] = attempts
+
+      while len(self.__failures) > self.max_entries:
+        self.__failures.popitem(last=False)
+
+    return attempts
+
+  def succeeded(self, bundle_id : str) -> None:
+
+    with self.__lock:
+      self.__failures.pop(bundle_id, None)
+
+  def attempts(self, bundle_id : str) -> int:
+
+    return self.__failures.get(bundle_id, 0)
+
+  def delay(self, attempts : int) -> float:
+
+    ''' Seconds to hold a bundle before unconsuming it after its attempts-th failure. '''
+
+    return min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+
+  def quarantine(
+    self,
+    inp : PreparedInput,
+    error : Exception,
+    attempts : int
+  ) -> None:
+
+    with self.__lock:
+      self.__failures.pop(inp.ref.bundle_id, None)
+
+    if self.on_quarantine:
+      self.on_quarantine(inp, error, attempts)
+
+class DeadLetterFile:
+
+  '''
+  Quarantine handler that appends one JSON line per quarantined bundle to a file.
+  '''
+
+  def __init__(self, path : str) -> None:
+
+    self.path : str = path
+    self.__file = open(path, 'a', buffering=1)
+    self.__lock = threading.Lock()
+
+  def __call__(
+    self,
+    inp : PreparedInput,
+    error : Exception,
+    attempts : int
+  ) -> None:
+
+    line : str = json.dumps(
+      {
+        'time': time.time(),
+        'bundleId': inp.ref.bundle_id,
+        'taskId': inp.ref.task_id,
+        'consumerId': inp.ref.consumer_id,
+        'consumptionId': inp.ref.consumption_id,
+        'attempts': attempts,
+        'error': repr(error),
+      }
+    )
+
+    with self.__lock:
+      self.__file.write(line + '\n')
+
+  def close(self) -> None:
+
+    with self.__lock:
+      self.__file.close()
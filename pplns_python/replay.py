@@ -0,0 +1,387 @@
+
+'''
+pplns-replay: replays captured consume/emit traffic (see capture.py) against a local stand-in API.
+
+  pplns-replay capture.jsonl --speed 10 --processor my_module:processor --output report.json
+
+Bundles become available at the time they were consumed in the capture, divided by --speed
+(--speed 0 releases all bundles right away). The worker definitions of the capture are registered again
+and, without --processor, each bundle is answered with the outputs that were emitted for it in the capture.
+The report holds the throughput and the latency from release to first emit per bundle, so reports of
+different client versions can be compared directly.
+'''
+
+import argparse
+import collections
+import http.server
+import json
+import re
+import sys
+import threading
+import time
+import typing
+
+from urllib.parse import \
+  urlsplit, \
+  parse_qs
+
+from pplns_python.capture import \
+  CapturedRequest, \
+  read_capture
+
+from pplns_types import BundleRead
+
+def read_body(request : http.server.BaseHTTPRequestHandler) -> bytes:
+
+  '''
+  Reads the request body, sent with Content-Length or chunked (e.g. streamed emits, see PipelineApi.should_stream).
+  '''
+
+  if 'chunked' in request.headers.get('Transfer-Encoding', '').lower():
+
+    chunks : list[bytes] = []
+
+    while True:
+
+      # chunk extensions (after ';') are not used by any client we talk to
+      size : int = int(request.rfile.readline().split(b';', 1)[0].strip(), 16)
+
+      if size == 0:
+
+        # trailers end with an empty line
+        while request.rfile.readline() not in (b'\r\n', b'\n', b''):
+          pass
+
+        return b''.join(chunks)
+
+      chunks.append(request.rfile.read(size))
+
+      request.rfile.readline()
+
+  length : int = int(request.headers.get('Content-Length') or 0)
+
+  return request.rfile.read(length) if length else b''
+
+def bundle_key(bundle : BundleRead) -> str:
+
+  ''' Emitted items reference their bundle by consumptionId. '''
+
+  return bundle['consumptionId'] if 'consumptionId' in bundle and bundle['consumptionId'] else bundle['_id']
+
+class StandInApi:
+
+  '''
+  Local HTTP server that hands out the bundles of a capture and records what the worker does with them.
+  '''
+
+  def __init__(
+    self,
+    records : list[CapturedRequest],
+    speed : float = 1.0,
+  ) -> None:
+
+    self.speed : float = speed
+
+    # (release time relative to start, bundle), each bundle once at the time it was first consumed
+    self.schedule : collections.deque[tuple[float, BundleRead]] = collections.deque()
+
+    self.by_id : dict[str, BundleRead] = {}
+
+    for record in records:
+
+      if not record['route'] == 'consume' or not record['response']:
+        continue
+
+      for bundle in record['response']['results']:
+
+        if bundle['_id'] in self.by_id:
+          continue
+
+        self.by_id[bundle['_id']] = bundle
+
+        self.schedule.append((record['t'] / speed if speed > 0 else 0.0, bundle))
+
+    self.bundles : int = len(self.schedule)
+
+    self.pending : collections.deque[BundleRead] = collections.deque()
+    self.released_at : dict[str, float] = {}
+    self.emitted_at : dict[str, float] = {}
+    self.requests : collections.Counter[str] = collections.Counter()
+
+    self.lock = threading.Lock()
+    self.started : float = 0.0
+
+    stand_in = self
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+      protocol_version = 'HTTP/1.1'
+
+      def do_GET(self) -> None:
+        stand_in.handle(self, 'get')
+
+      def do_POST(self) -> None:
+        stand_in.handle(self, 'post')
+
+      def do_PUT(self) -> None:
+        stand_in.handle(self, 'put')
+
+      def log_message(self, *args : typing.Any) -> None:
+        pass
+
+    self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    self.httpd.daemon_threads = True
+
+    self.url : str = f'http://127.0.0.1:{self.httpd.server_port}/api'
+
+  def start(self) -> None:
+
+    self.started = time.monotonic()
+
+    threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+  def close(self) -> None:
+
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+  @property
+  def done(self) -> bool:
+
+    return not self.schedule and len(self.emitted_at) >= self.bundles
+
+  def __release(self, now : float) -> None:
+
+    while self.schedule and self.schedule[0][0] <= now - self.started:
+
+      _, bundle = self.schedule.popleft()
+
+      self.pending.append(bundle)
+
+      self.released_at[bundle_key(bundle)] = now
+
+  def handle(self, request : http.server.BaseHTTPRequestHandler, method : str) -> None:
+
+    url = urlsplit(request.path)
+
+    raw : bytes = read_body(request)
+
+    body : typing.Any = json.loads(raw) if raw else None
+
+    now : float = time.monotonic()
+
+    response : typing.Any = {}
+
+    with self.lock:
+
+      if method == 'get' and url.path.endswith('/bundles'):
+
+        self.requests['consume'] += 1
+
+        self.__release(now)
+
+        limit : int = int(parse_qs(url.query).get('limit', ['100'])[0])
+
+        response = { 'results': [self.pending.popleft() for _ in range(min(limit, len(self.pending)))] }
+
+      elif method == 'post' and url.path.endswith('/outputs'):
+
+        self.requests['outputs'] += 1
+
+        self.emitted_at.setdefault(body['consumptionId'], now)
+
+        response = { **body, '_id': f'replay-{self.requests["outputs"]}' }
+
+      elif method == 'put' and (match := re.search(r'/tasks/[^/]+/bundles/([^/]+)$', url.path)):
+
+        self.requests['unconsume'] += 1
+
+        # the bundle becomes available again
+        if match.group(1) in self.by_id:
+          self.pending.append(self.by_id[match.group(1)])
+
+        response = { '_id': match.group(1) }
+
+      elif url.path.rsplit('/', 2)[-2:-1] == ['workers']:
+
+        self.requests['workers'] += 1
+
+        response = { **body, '_id': url.path.rsplit('/', 1)[-1] }
+
+      else:
+
+        self.requests['other'] += 1
+
+    encoded : bytes = json.dumps(response).encode()
+
+    request.send_response(200)
+    request.send_header('Content-Type', 'application/json')
+    request.send_header('Content-Length', str(len(encoded)))
+    request.end_headers()
+    request.wfile.write(encoded)
+
+  def report(self) -> dict[str, typing.Any]:
+
+    latencies : list[float] = sorted(
+      self.emitted_at[key] - self.released_at[key] for key in self.emitted_at if key in self.released_at
+    )
+
+    duration : float = (max(self.emitted_at.values()) - self.started) if self.emitted_at else 0.0
+
+    def percentile(p : float) -> float | None:
+
+      return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+
+    return {
+      'bundles': self.bundles,
+      'emitted': len(self.emitted_at),
+      'speed': self.speed,
+      'duration': duration,
+      'throughput': len(self.emitted_at) / duration if duration > 0 else None,
+      'latency': {
+        'p50': percentile(0.5),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': latencies[-1] if latencies else None,
+      },
+      'requests': dict(self.requests),
+    }
+
+class CapturedProcessor:
+
+  '''
+  Answers each bundle with the outputs that were emitted for it in the capture.
+  '''
+
+  def __init__(self, records : list[CapturedRequest]) -> None:
+
+    self.outputs : dict[str, dict[str, typing.Any]] = collections.defaultdict(dict)
+
+    for record in records:
+
+      if record['route'] == 'outputs' and record['body']:
+
+        item : typing.Any = record['body']
+
+        self.outputs[item['consumptionId']][item['outputChannel']] = {
+          'data': item['data'],
+          'done': item['done'] if 'done' in item else True,
+        }
+
+  def __call__(self, inp : typing.Any) -> typing.Any:
+
+    return self.outputs.get(inp.ref.consumption_id) or None
+
+def replay(
+  records : list[CapturedRequest],
+  processor : typing.Any = None,
+  speed : float = 1.0,
+  timeout : float | None = None,
+  **input_stream_args : typing.Any
+) -> dict[str, typing.Any]:
+
+  '''
+  Replays records against a StandInApi with an InputStream running processor (CapturedProcessor by default).
+  Returns the report once all bundles have been emitted or after timeout seconds.
+
+  Bundles for which the capture has no outputs are never emitted, a timeout is required to replay such captures.
+  '''
+
+  from pplns_python.api import PipelineApi
+
+  stand_in = StandInApi(records, speed)
+
+  stand_in.start()
+
+  try:
+
+    api = PipelineApi(stand_in.url, 'replay')
+
+    for record in records:
+
+      if record['route'] == 'workers' and record['method'] == 'put' and record['body']:
+        api.register_worker(record['body'])
+
+    stream = api.create_input_stream({}, **input_stream_args)
+
+    stream.on('error', lambda e: print(f'[replay] {e}', file=sys.stderr))
+
+    stream.on_data(processor or CapturedProcessor(records))
+
+    stream.start()
+
+    deadline : float | None = time.monotonic() + timeout if timeout is not None else None
+
+    while not stand_in.done and (deadline is None or time.monotonic() < deadline):
+      time.sleep(0.01)
+
+    interval = stream.interval
+
+    stream.drain(timeout=5.0)
+    stream.close()
+
+    # the stand-in must outlive the last poll
+    if interval:
+      interval.join()
+
+    return { **stand_in.report(), 'stream': stream.stats.snapshot() }
+
+  finally:
+
+    stand_in.close()
+
+def parse_args(argv : list[str] | None = None) -> argparse.Namespace:
+
+  parser = argparse.ArgumentParser(
+    prog='pplns-replay',
+    description='Replays captured pplns traffic against a local stand-in API and reports throughput and latency.',
+  )
+
+  parser.add_argument('capture', help='capture file written by CapturingClient')
+  parser.add_argument('--speed', type=float, default=1.0, help='time compression, 0 releases all bundles at once')
+  parser.add_argument('--processor', default=None, help='processor to run, as module:attribute (default: captured outputs)')
+  parser.add_argument('--max-concurrency', type=int, default=1)
+  parser.add_argument('--polling-time', type=float, default=0.5)
+  parser.add_argument('--timeout', type=float, default=None, help='stop after this many seconds')
+  parser.add_argument('--output', default=None, help='file to write the report to (JSON, default: stdout)')
+
+  return parser.parse_args(argv)
+
+def main(argv : list[str] | None = None) -> int:
+
+  import concurrent.futures
+
+  from pplns_python.supervisor import load_processor
+
+  args = parse_args(argv)
+
+  executor = concurrent.futures.ThreadPoolExecutor(args.max_concurrency) \
+    if args.max_concurrency > 1 else None
+
+  report = replay(
+    read_capture(args.capture),
+    load_processor(args.processor) if args.processor else None,
+    speed=args.speed,
+    timeout=args.timeout,
+    max_concurrency=args.max_concurrency,
+    polling_time=args.polling_time,
+    executor=executor,
+  )
+
+  if executor:
+    executor.shutdown(wait=False)
+
+  if args.output:
+
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+
+  else:
+
+    print(json.dumps(report, indent=2))
+
+  return 0
+
+if __name__ == '__main__':
+
+  sys.exit(main())
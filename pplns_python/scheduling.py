@@ -0,0 +1,92 @@
+
+import heapq
+import itertools
+import threading
+import time
+
+from pplns_python.processor import PreparedInput
+
+class BundleQueue:
+
+  '''
+  Thread safe priority queue of prepared inputs waiting to be dispatched.
+
+  Higher priorities are dispatched first, equal priorities in FIFO order.
+  With aging > 0, a waiting input gains aging priority points per second, so low priority work
+  cannot be starved by a constant stream of high priority bundles.
+  '''
+
+  def __init__(self, aging : float = 0.0) -> None:
+
+    self.aging : float = aging
+
+    # entries are (key, sequence, enqueue time, input)
+    self.__heap : list[tuple[float, int, float, PreparedInput]] = []
+    self.__sequence = itertools.count()
+    self.__lock = threading.Lock()
+
+  def push(
+    self,
+    inp : PreparedInput,
+    priority : float = 0.0
+  ) -> None:
+
+    now : float = time.monotonic()
+
+    # the effective priority at time t is priority + aging * (t - now), which orders inputs
+    # the same way as the time independent key priority - aging * now
+    key : float = self.aging * now - priority
+
+    with self.__lock:
+      heapq.heappush(self.__heap, (key, next(self.__sequence), now, inp))
+
+  def pop(self) -> PreparedInput | None:
+
+    ''' Removes and returns the input with the highest effective priority or None if the queue is empty. '''
+
+    with self.__lock:
+
+      if not self.__heap:
+        return None
+
+      return heapq.heappop(self.__heap)[3]
+
+  def pop_many(self, count : int) -> list[PreparedInput]:
+
+    ''' Removes and returns up to count inputs in dispatch order. '''
+
+    with self.__lock:
+
+      return [
+        heapq.heappop(self.__heap)[3] for _ in range(min(count, len(self.__heap)))
+      ]
+
+  def oldest_wait(self) -> float:
+
+    ''' Seconds the longest waiting input has been queued. '''
+
+    with self.__lock:
+
+      if not self.__heap:
+        return 0.0
+
+      return time.monotonic() - min(entry[2] for entry in self.__heap)
+
+  def __len__(self) -> int:
+
+    return len(self.__heap)
+
+def resolve_priority(
+  inp : PreparedInput,
+  query_priority : float,
+  task_priorities : dict[str, float] | None
+) -> float:
+
+  '''
+  Per-task priorities take precedence over the priority of the query the bundle was consumed with.
+  '''
+
+  if task_priorities and inp.ref.task_id in task_priorities:
+    return task_priorities[inp.ref.task_id]
+
+  return query_priority
@@ -0,0 +1,89 @@
+
+import threading
+import typing
+
+class Stats:
+
+  '''
+  Thread safe collection of counters, gauges and timings.
+
+  snapshot() flattens everything into a dict of numbers, timings are reported as
+  <name>.count, <name>.total and <name>.max (seconds).
+  '''
+
+  def __init__(self) -> None:
+
+    self.__lock = threading.Lock()
+    self.__counters : dict[str, float] = {}
+    self.__gauges : dict[str, float] = {}
+    self.__timings : dict[str, list[float]] = {}
+
+  def incr(self, name : str, value : float = 1) -> None:
+
+    with self.__lock:
+      self.__counters[name] = self.__counters.get(name, 0) + value
+
+  def gauge(self, name : str, value : float) -> None:
+
+    with self.__lock:
+      self.__gauges[name] = value
+
+  def timing(self, name : str, seconds : float) -> None:
+
+    with self.__lock:
+
+      timing = self.__timings.get(name)
+
+      if timing is None:
+
+        self.__timings[name] = [1, seconds, seconds]
+
+      else:
+
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+
+  def get(self, name : str, default : float = 0) -> float:
+
+    ''' Returns the current value of a counter or gauge. '''
+
+    with self.__lock:
+
+      if name in self.__gauges:
+        return self.__gauges[name]
+
+      return self.__counters.get(name, default)
+
+  def snapshot(self) -> dict[str, float]:
+
+    with self.__lock:
+
+      result : dict[str, float] = { **self.__counters, **self.__gauges }
+
+      for name, (count, total, maximum) in self.__timings.items():
+
+        result[name + '.count'] = count
+        result[name + '.total'] = total
+        result[name + '.max'] = maximum
+
+      return result
+
+def merge_snapshots(snapshots : typing.Iterable[dict[str, float]]) -> dict[str, float]:
+
+  '''
+  Aggregates snapshots of several Stats instances. Values are summed, except for *.max which takes the maximum.
+  '''
+
+  result : dict[str, float] = {}
+
+  for snapshot in snapshots:
+
+    for name, value in snapshot.items():
+
+      if name.endswith('.max'):
+        result[name] = max(result.get(name, value), value)
+      else:
+        result[name] = result.get(name, 0) + value
+
+  return result
@@ -1,13 +1,32 @@
 
+import heapq
+import inspect
 import threading
 import time
 import typing
 
 # required to avoid circular dependencies in runtime
 if typing.TYPE_CHECKING:
+
+  import asyncio
+  import concurrent.futures
   
   from pplns_python.api import PipelineApi
 
+  from pplns_python.partitioning import PartitionedQueries
+
+  from pplns_python.idempotency import \
+    CachedOutput, \
+    IdempotencyCache
+
+  from pplns_python.item_cache import ItemCache
+
+  from pplns_python.notifications import NotificationListener
+
+  from pplns_python.redelivery import RedeliveryPolicy
+
+  from pplns_python.validation import Validation
+
 from pplns_types import \
   BundleQuery, \
   BundleRead, \
@@ -17,8 +36,47 @@ from pplns_types import \
 
 from pplns_python.processor import \
   BatchProcessor, \
+  TaskProcessor, \
   BundleProcessor, \
-  PreparedInput
+  BundleRef, \
+  PreparedInput, \
+  ProcessorOutput
+
+from pplns_python.lazy_item import \
+  LazyDataItem, \
+  release_item
+
+from pplns_python.deferred import \
+  DeferredHandler, \
+  OverflowPolicy
+
+from pplns_python.scheduling import \
+  BundleQueue, \
+  resolve_priority
+
+from pplns_python.concurrency import ConcurrencyLimit
+
+from pplns_python.stats import Stats
+
+from pplns_python.profiling import profiler
+
+from pplns_python.idempotency import is_cacheable
+
+from pplns_python.columnar import ColumnarBatch
+
+from pplns_python.item_cache import item_size
+
+from pplns_python.lifecycle import TaskStates
+
+from pplns_python.ordering import \
+  OrderingMode, \
+  ReorderBuffer, \
+  ordering_key
+
+from pplns_python.tracing import \
+  Trace, \
+  Tracer, \
+  span
 
 class Stream:
 
@@ -33,9 +91,37 @@ class Stream:
   def on(
     self,
     event : str,
-    handler : typing.Callable
+    handler : typing.Callable,
+    executor : typing.Optional['concurrent.futures.Executor'] = None,
+    loop : typing.Optional['asyncio.AbstractEventLoop'] = None,
+    max_queue : int = 100,
+    overflow : OverflowPolicy = 'drop_newest',
+    on_error : typing.Callable[[Exception], typing.Any] | None = None,
   ):
 
+    '''
+    Adds a handler for event.
+
+    By default, handlers are called inline by emit. If an executor is passed, the handler runs on the executor instead.
+    Coroutine functions always run on an event loop (loop or a shared background loop).
+    Deferred handlers buffer up to max_queue calls, overflow decides what happens when that queue is full.
+    Their errors are passed to on_error, by default they are emitted as 'error' (see DeferredHandler).
+    '''
+
+    if executor is not None or inspect.iscoroutinefunction(handler):
+
+      handler = DeferredHandler(
+        self,
+        event,
+        handler,
+        executor=executor,
+        loop=loop,
+        is_coroutine=inspect.iscoroutinefunction(handler),
+        max_queue=max_queue,
+        overflow=overflow,
+        on_error=on_error,
+      )
+
     if not event in self.handlers:
       self.handlers[event] = []
 
@@ -54,18 +140,50 @@ class Stream:
     event : str,
     *args : typing.Any
   ) -> typing.Any:
+
+    '''
+    Calls all handlers of event and returns the result of the last one (None for deferred handlers).
+    '''
+
+    handlers : list[typing.Callable] | None = self.handlers.get(event)
   
-    if (not event in self.handlers):
-      return
+    if not handlers:
+      return None
+
+    # fast path for the common case of a single handler
+    if len(handlers) == 1:
+      return handlers[0](*args)
 
     res = None
 
-    for fnc in self.handlers[event]:
+    for fnc in handlers:
 
       res = fnc(*args)
 
     return res
 
+  def flush(self, timeout : float | None = None) -> bool:
+
+    '''
+    Waits for all deferred handlers to finish their queued calls. Returns False on timeout.
+    '''
+
+    deadline : float | None = None if timeout is None else time.monotonic() + timeout
+
+    for handlers in list(self.handlers.values()):
+
+      for handler in handlers:
+
+        if isinstance(handler, DeferredHandler):
+
+          remaining : float | None = \
+            None if deadline is None else max(0, deadline - time.monotonic())
+
+          if not handler.join(remaining):
+            return False
+
+    return True
+
 class Interval:
 
   '''
@@ -78,21 +196,46 @@ class Interval:
     self.interval=interval
     self.action=action
     self.stopEvent=threading.Event()
-    thread=threading.Thread(target=self.__setInterval)
-    thread.start()
+    self.wakeEvent=threading.Event()
+    self.thread=threading.Thread(target=self.__setInterval)
+    self.thread.start()
 
   def __setInterval(self) -> None:
 
     nextTime=time.time()+self.interval
 
-    while not self.stopEvent.wait(nextTime-time.time()):
+    while True:
+
+        woken=self.wakeEvent.wait(max(0, nextTime-time.time()))
+
+        if self.stopEvent.is_set():
+          break
+
+        if woken:
+          self.wakeEvent.clear()
+          nextTime=time.time()+self.interval
+        else:
+          nextTime+=self.interval
 
-        nextTime+=self.interval
         self.action()
 
+  def trigger(self) -> None:
+
+    ''' Runs the action right away (on the interval thread) and restarts the interval. '''
+
+    self.wakeEvent.set()
+
   def cancel(self)  -> None:
 
     self.stopEvent.set()
+    self.wakeEvent.set()
+
+  def join(self, timeout : float | None = None) -> None:
+
+    ''' Waits for a running action to finish after cancel(). '''
+
+    if not self.thread is threading.current_thread():
+      self.thread.join(timeout)
 
 class Counter:
 
@@ -131,13 +274,54 @@ class Counter:
     
     return self.__counter < self.__max
 
+  def set_max(self, max_count : int) -> None:
+
+    with self.__lock:
+      self.__max = max_count
+
+  def try_inc(self) -> bool:
+
+    ''' Increments the counter only if counter < max. Returns true if the counter has been incremented.'''
+
+    with self.__lock:
+
+      if self.__counter >= self.__max:
+        return False
+
+      self.__counter += 1
+
+      return True
+
+  @property
+  def value(self) -> int:
+
+    return self.__counter
+
+  @property
+  def max(self) -> int:
+
+    return self.__max
+
 def prepare_bundle(
   worker : WorkerWrite,
-  bundle : BundleRead
+  bundle : BundleRead,
+  spill_threshold : int | None = None,
+  spill_dir : str | None = None,
+  trace : Trace | None = None,
+  item_cache : typing.Optional['ItemCache'] = None,
+  deadline : float | None = None,
+  size_bound : int | None = None,
 ) -> PreparedInput:
 
   '''
   Prepares a bundle to be processed by sorting the data items to match the workers inputs.
+
+  If spill_threshold is set, items are wrapped in LazyDataItem (payloads larger than spill_threshold
+  bytes are spilled to spill_dir) and the 'bundle' reference no longer holds the raw items.
+  size_bound (e.g. the size of the response the bundle was parsed from) spares the spill check for small payloads.
+
+  If item_cache is set, items are shared with other bundles that contain the same item (see ItemCache),
+  the 'bundle' reference does not hold the raw items either.
   '''
 
   # first, sort the item references by their position
@@ -154,44 +338,218 @@ def prepare_bundle(
     bundle['items'][item_ids.index(ref['itemId'])] for ref in item_refs_sorted
   ]
 
-  return {
-    '_id': bundle['_id'],
-    'taskId': bundle['taskId'],
-    'consumerId': bundle['consumerId'],
-    'inputs': dict(zip(worker['inputs'].keys(), items_sorted)),
-    'bundle': bundle,
-  }
+  ref = BundleRef.from_bundle(bundle)
+
+  # LazyDataItems stand in for the (read-only) DataItems of the bundle
+  if item_cache is not None:
+
+    items_sorted = typing.cast(list[DataItem], [
+      item_cache.share(item, spill_threshold, spill_dir, size_bound) for item in items_sorted
+    ])
+
+  elif spill_threshold is not None:
+
+    items_sorted = typing.cast(list[DataItem], [
+      LazyDataItem(item, spill_threshold, spill_dir, size_bound) for item in items_sorted
+    ])
+
+  if item_cache is not None or spill_threshold is not None:
+
+    # the raw items are owned by the lazy items now, keeping them here would defeat spilling and sharing
+    bundle = { key: value for key, value in bundle.items() if not key == 'items' }  # type: ignore
+
+  return PreparedInput(
+    ref,
+    dict(zip(worker['inputs'].keys(), items_sorted)),
+    bundle,
+    trace,
+    deadline,
+  )
+
+def release_prepared_input(inp : PreparedInput) -> None:
+
+  '''
+  Frees the payloads held by a prepared input (only has an effect on lazy items).
+  Must not be used on inputs prepared with an ItemCache, their items may still be used by other bundles.
+  '''
+
+  for item in inp.inputs.values():
+    release_item(item)
 
 class InputStream(Stream):
 
   '''
   Emits 'data' event when there are new data bundles to be consumed from the api.
+
+  Consumed bundles are put into a local priority queue and dispatched from there to the data callback,
+  at most max_concurrency (batches of) bundles at a time.
   '''
 
   interval : Interval | None = None
 
+  data_callback : typing.Optional['InputStreamDataCallback'] = None
+
+  # set by drain() to stop dispatching queued bundles
+  draining : bool = False
+
   def __init__(
     self,
     api : 'PipelineApi',
     query : BundleQuery,
     max_concurrency : int = 1,
     polling_time : float = 0.5,
+    spill_threshold : int | None = None,
+    spill_dir : str | None = None,
+    priority : float = 0.0,
+    task_priorities : dict[str, float] | None = None,
+    aging : float = 0.0,
+    executor : typing.Optional['concurrent.futures.Executor'] = None,
+    concurrency_limit : ConcurrencyLimit | None = None,
+    partition : typing.Optional['PartitionedQueries'] = None,
+    tracer : Tracer | None = None,
+    idempotency : typing.Optional['IdempotencyCache'] = None,
+    item_cache : typing.Optional['ItemCache'] = None,
+    deadline : float | None = None,
+    notifications : typing.Optional['NotificationListener'] = None,
+    max_polling_time : float = 5.0,
+    max_inflight_bytes : int | None = None,
+    redelivery : typing.Optional['RedeliveryPolicy'] = None,
+    narrow_failures : bool = False,
+    validation : typing.Optional['Validation'] = None,
+    ordering : OrderingMode = 'unordered',
+    max_held_outputs : int = 1000,
   ) -> None:
 
+    '''
+    spill_threshold: if set, inputs are delivered as LazyDataItem and payloads with a JSON encoding
+    larger than spill_threshold bytes are kept in memory-mapped temporary files (in spill_dir).
+
+    priority: dispatch priority of bundles consumed with query (higher first), see add_query.
+    task_priorities: priorities by taskId, these take precedence over query priorities.
+    aging: priority points a queued bundle gains per second of waiting.
+    executor: if set, data callbacks run on the executor, otherwise inline on the polling thread.
+    concurrency_limit: adapts the concurrency budget to the observed batch latency (replaces max_concurrency).
+    partition: only poll the tasks assigned to this replica (see partitioning.py).
+    tracer: records stage timestamps for a sample of bundles.
+    idempotency: caches outputs so that redelivered bundles are not processed again.
+    item_cache: shares items that are part of several bundles instead of holding a copy per bundle.
+    deadline: seconds after consume within which a bundle has to be processed. Expired bundles are unconsumed
+    instead of being dispatched, bundles that are still being processed on the executor are abandoned
+    (unconsumed, their outputs are discarded). Threads cannot be stopped, so the processor keeps its slot until it returns.
+    notifications: polls right away when the server announces new bundles (see api.create_notification_listener).
+    While connected, the stream only polls every max_polling_time seconds as a safety net. While disconnected,
+    it polls every polling_time seconds, backing off to max_polling_time while polls come back empty.
+    max_inflight_bytes: stops consuming while the payloads of queued and processing bundles exceed this many bytes
+    (approximated by the size of their JSON encoding, or by their share of the consume response for plain items).
+    redelivery: delays the unconsume of failed bundles and quarantines bundles that keep failing.
+    narrow_failures: if a batch fails, the processor is run again on halves of the batch to find the failing
+    bundles. Only those are unconsumed, the outputs of the others are emitted. Processors with side effects
+    run again on the bundles that did not fail, which is why this is opt-in.
+    validation: checks inputs and outputs against the channel schemas of the worker (see validation.py).
+    Invalid inputs are failed right after consume, invalid outputs fail their bundle before anything is emitted.
+    ordering: order in which the outputs of bundles consumed with query are emitted, see add_query.
+    max_held_outputs: stops consuming while this many outputs are held back to preserve their order.
+    '''
+
     Stream.__init__(self)
 
     self.api: 'PipelineApi' = api
     self.query: BundleQuery = query
+    self.queries: list[tuple[BundleQuery, float, OrderingMode]] = [(query, priority, ordering)]
+    self.task_priorities: dict[str, float] | None = task_priorities
     self.polling_time: float = polling_time
-    self.active_callbacks: Counter = Counter(max_count=max_concurrency)
+    self.concurrency_limit: ConcurrencyLimit | None = concurrency_limit
+    self.active_callbacks: Counter = Counter(
+      max_count=concurrency_limit.limit if concurrency_limit else max_concurrency
+    )
+    self.stats: Stats = Stats()
+    self.spill_threshold: int | None = spill_threshold
+    self.spill_dir: str | None = spill_dir
+    self.queue: BundleQueue = BundleQueue(aging)
+    self.executor = executor
+    self.partition: typing.Optional['PartitionedQueries'] = partition
+    self.tracer: Tracer | None = tracer
+    self.idempotency: typing.Optional['IdempotencyCache'] = idempotency
+    self.item_cache: typing.Optional['ItemCache'] = item_cache
+    self.deadline: float | None = deadline
+
+    # dispatched inputs by id(), for abandoning them after their deadline
+    self.__in_flight: dict[int, PreparedInput] = {}
+    self.__abandoned: set[int] = set()
+    self.__in_flight_lock = threading.Lock()
+
+    self.notifications: typing.Optional['NotificationListener'] = notifications
+    self.max_polling_time: float = max_polling_time
+
+    self.max_inflight_bytes: int | None = max_inflight_bytes
+    self.__inflight_bytes: int = 0
+    # payload sizes of queued and processing inputs by id()
+    self.__sizes: dict[int, int] = {}
+    self.__sizes_lock = threading.Lock()
+
+    self.redelivery: typing.Optional['RedeliveryPolicy'] = redelivery
+    self.narrow_failures: bool = narrow_failures
+    self.validation: typing.Optional['Validation'] = validation
+    self.max_held_outputs: int = max_held_outputs
+    # only created for ordered queries, unordered outputs are emitted right away
+    self.reorder: ReorderBuffer | None = \
+      ReorderBuffer(max_held_outputs, self.stats) if not ordering == 'unordered' else None
+    # (due, sequence, bundle) of failed bundles waiting to be unconsumed
+    self.__redeliveries: list[tuple[float, int, BundleRef]] = []
+    self.__redelivery_sequence: int = 0
+    self.__redeliveries_lock = threading.Lock()
+
+    # warm states of a TaskProcessor, set with the data callback
+    self.task_states: TaskStates | None = None
+    self.__torn_down: bool = False
+    self.__teardown_lock = threading.Lock()
+
+    self.stats.gauge('concurrency_limit', self.active_callbacks.max)
 
     # kill the timer after close
     self.on('close', self.pause)
 
+    # bundles that have not been dispatched yet are handed back
+    self.on('close', self.unconsume_queued)
+
+    # as well as failed bundles that are waiting for their redelivery delay
+    self.on('close', self.redeliver_all)
+
+    if notifications:
+      self.on('close', notifications.close)
+
+  def add_query(
+    self,
+    query : BundleQuery,
+    priority : float = 0.0,
+    ordering : OrderingMode = 'unordered',
+  ) -> 'InputStream':
+
+    '''
+    Adds another query to poll. Bundles are dispatched by priority across all queries.
+
+    ordering: 'unordered' emits outputs as soon as they are ready. 'task' emits the outputs of the bundles
+    of a task in the order they were consumed, 'consumer' does the same per consumer node of a task.
+    Outputs that complete early are held back until the outputs of all earlier bundles have been emitted
+    (see ReorderBuffer). Bundles that fail are unconsumed and do not hold back the bundles after them.
+    '''
+
+    if not ordering == 'unordered' and self.reorder is None:
+      self.reorder = ReorderBuffer(self.max_held_outputs, self.stats)
+
+    self.queries.append((query, priority, ordering))
+
+    return self
+
   def on(
     self,
     event : str,
-    callback : typing.Callable
+    handler : typing.Callable | BundleProcessor,
+    executor : typing.Optional['concurrent.futures.Executor'] = None,
+    loop : typing.Optional['asyncio.AbstractEventLoop'] = None,
+    max_queue : int = 100,
+    overflow : OverflowPolicy = 'drop_newest',
+    on_error : typing.Callable[[Exception], typing.Any] | None = None,
   ) -> Stream:
 
     '''
@@ -205,17 +563,62 @@ class InputStream(Stream):
 
         raise Exception('InputStream can only have one data callback.')
 
+      elif executor is not None or loop is not None:
+
+        # dropping or delaying 'data' events would leave consumed bundles unprocessed
+        raise Exception('InputStream data callbacks cannot be deferred.')
+
       else:
 
+        self.data_callback = InputStreamDataCallback(self, handler)
+
+        if isinstance(handler, TaskProcessor):
+          self.set_task_processor(handler)
+
         return Stream.on(
           self, 
           event,
-          InputStreamDataCallback(self, callback)
+          self.data_callback
         )
 
     else:
 
-      return Stream.on(self, event, callback)
+      return Stream.on(self, event, typing.cast(typing.Callable, handler), executor, loop, max_queue, overflow, on_error)
+
+  def set_task_processor(self, processor : TaskProcessor) -> None:
+
+    '''
+    Runs the worker-level setup of processor and tears it down, along with all task states, on close.
+    '''
+
+    processor.setup()
+
+    self.task_states = TaskStates(
+      processor,
+      lambda task_id: self.api.get_task(task_id).get('params'),
+      self.stats,
+      lambda e: self.emit('error', e)
+    )
+
+    self.on('close', self.teardown_processor)
+
+  def teardown_processor(self) -> None:
+
+    '''
+    Tears down the task states and the processor once no batch is being processed anymore:
+    right away if the stream is idle, otherwise when the last running batch returns.
+    '''
+
+    with self.__teardown_lock:
+
+      if self.task_states is None or self.__torn_down or self.active_callbacks.value > 0:
+        return
+
+      self.__torn_down = True
+
+    self.task_states.close()
+
+    self.task_states.processor.teardown()
 
   def pause(self) -> None:
 
@@ -233,159 +636,945 @@ class InputStream(Stream):
       
       self.interval = Interval(self.polling_time, self.poll)
 
+      if self.notifications:
+        self.notifications.start(self.notify)
+
+  def notify(self, event : str, data : str = '') -> None:
+
+    '''
+    Handles a notification: polls right away on the polling thread.
+    '''
+
+    self.stats.incr('notifications.' + event)
+
+    interval : Interval | None = self.interval
+
+    if not interval:
+      return
+
+    if event == 'disconnected':
+      interval.interval = self.polling_time
+
+    interval.trigger()
+
   def resume(self) -> None:
 
     ''' Resumes or stars stream. '''
 
     return self.start()
 
+  def drain(self, timeout : float | None = None) -> bool:
+
+    '''
+    Stops polling and dispatching and waits until all dispatched bundles have been processed.
+    Queued bundles are left for close() to unconsume. Returns False on timeout.
+    '''
+
+    self.pause()
+
+    self.draining = True
+
+    deadline : float | None = None if timeout is None else time.monotonic() + timeout
+
+    while self.active_callbacks.value > 0:
+
+      if deadline is not None and time.monotonic() >= deadline:
+        return False
+
+      time.sleep(0.05)
+
+    return True
+
   def poll(self) -> None:
 
     '''
     Runs one single polling iteration.
     '''
 
-    bundles: list[BundleRead] = self.api.consume(self.query)
-    
-    for bundle in bundles:
-
-      self.emit(
-        'data',
-        prepare_bundle(
-          self.api.get_registered_worker(
-            bundle['workerId'] if 'workerId' in bundle else None
-          ), 
-          bundle
-        )
-      )
+    consumed : int = 0
 
-  def handle_callback_error(
+    for query, priority, ordering in self.queries:
+
+      for partition_query in (self.partition.queries(query) if self.partition else [query]):
+
+        # no need to lease more bundles while there is enough queued work to saturate all slots
+        if len(self.queue) >= self.active_callbacks.max:
+          break
+
+        if self.over_budget():
+
+          self.stats.incr('polls.over_budget')
+
+          break
+
+        if self.reorder is not None and self.reorder.full():
+
+          self.stats.incr('polls.reorder_full')
+
+          break
+
+        count : int = self.__consume(partition_query, priority, ordering)
+
+        consumed += count
+
+        if self.partition:
+          self.partition.report(partition_query['taskId'], count)
+
+    interval : Interval | None = self.interval
+
+    if self.notifications and interval:
+
+      interval.interval = self.next_polling_time(interval.interval, consumed)
+
+      self.stats.gauge('polling_time', interval.interval)
+
+    if self.deadline is not None:
+      self.abandon_expired()
+
+    if self.__redeliveries:
+      self.redeliver_due()
+
+    self.dispatch()
+
+  def next_polling_time(self, current : float, consumed : int) -> float:
+
+    ''' Polling interval while notifications are enabled. '''
+
+    if typing.cast('NotificationListener', self.notifications).connected:
+      return self.max_polling_time
+
+    if consumed > 0:
+      return self.polling_time
+
+    return min(2 * current, self.max_polling_time)
+
+  def __consume(
     self,
-    task_id : str,
-    bundle_id : str,
-    consumption_id : str | None,
-    error : Exception
-  ) -> None:
+    query : BundleQuery,
+    priority : float,
+    ordering : OrderingMode = 'unordered',
+  ) -> int:
 
-    # no need to unconsume the bundle if it has not been consumed in the first place
-    if not consumption_id == None:
+    '''
+    Consumes bundles for query and queues them. Returns the number of bundles consumed.
+    '''
 
-      self.api.unconsume(task_id, bundle_id, consumption_id)
+    consume_start : float = time.time()
 
-    self.emit('error', error)
+    with profiler.stage('consume'):
+      bundles: list[BundleRead] = self.api.consume(query)
 
-  def on_data(self, processor : BundleProcessor) -> Stream:
+    consume_end : float = time.time()
+
+    deadline : float | None = time.monotonic() + self.deadline if self.deadline is not None else None
+
+    count : int = len(bundles)
+
+    self.stats.incr('polls')
+
+    if count == 0:
+      self.stats.incr('polls.empty')
+
+    response_bytes : int | None = getattr(bundles, 'nbytes', None)
+
+    # share of the response body per bundle, estimates the payload size of plain items without encoding them again
+    bundle_bytes : int | None = response_bytes // count if response_bytes is not None and count else None
+
+    # pop the bundles off the response so that each raw bundle can be freed once it has been prepared
+    bundles.reverse()
+
+    while bundles:
+
+      bundle : BundleRead = bundles.pop()
+
+      trace : Trace | None = \
+        self.tracer.start(bundle, consume_start, consume_end) if self.tracer else None
+
+      with profiler.stage('prepare_bundle'), span(trace, 'prepare_bundle'):
+        inp : PreparedInput = self.prepare(bundle, trace, deadline, response_bytes)
+
+      if self.validation is not None and not self.validate_input(inp):
+        continue
+
+      if trace:
+        trace.mark('queue')
+
+      if self.max_inflight_bytes is not None:
+        self.__track(inp, bundle_bytes)
+
+      key : tuple[str, ...] | None = ordering_key(inp, ordering)
+
+      if key is not None:
+        typing.cast(ReorderBuffer, self.reorder).register(inp, key)
+
+      self.queue.push(
+        inp,
+        resolve_priority(inp, priority, self.task_priorities)
+      )
+
+      # set up the state of a new task while its first bundle is queued
+      if self.task_states is not None:
+        self.task_states.warm(inp.ref.task_id, self.executor)
+
+    return count
+
+  def batch_size(self) -> int:
+
+    ''' Number of queued inputs handed to the data callback at once. '''
+
+    if self.data_callback and isinstance(self.data_callback.processor, BatchProcessor):
+      return self.data_callback.processor.max_batch_size
+
+    return 1
+
+  def dispatch(self) -> None:
 
     '''
-    Typed alias for on('data', processor).
+    Hands queued inputs to the data callback while there are free slots.
     '''
 
-    return self.on('data', processor)
+    if not self.data_callback or self.draining:
+      return
 
+    while self.active_callbacks.try_inc():
 
-class InputStreamDataCallback:
+      batch : list[PreparedInput] = self.queue.pop_many(self.batch_size())
 
-  '''
-  Wraps a 'data' callback for an InputStream.
-  '''
+      if not batch:
 
-  def __init__(
-    self,
-    stream : InputStream,
-    processor : BundleProcessor
-  ) -> None:
+        self.active_callbacks.dec()
 
-    self.stream: InputStream = stream
-    self.processor = processor
+        return
 
-  def __call__(self, inp : PreparedInput) -> None:
+      if self.deadline is not None:
 
-    # TODO: actually implement batching in the InputStream class
-    return self.process_batch([inp])
+        batch = self.__drop_expired(batch)
 
-  def process_batch(self, inputs : list[PreparedInput]) -> None:
+        if not batch:
 
-    try:
+          self.active_callbacks.dec()
 
-      if not self.stream.active_callbacks.inc():
-        
-        self.stream.pause()
+          continue
 
+        with self.__in_flight_lock:
 
-      if isinstance(self.processor, BatchProcessor):
+          for inp in batch:
+            self.__in_flight[id(inp)] = inp
+
+      for inp in batch:
+
+        if inp.trace:
+          inp.trace.end_mark('queue')
+
+      if self.executor:
+
+        self.executor.submit(self.__run_batch, batch)
 
-        outputs = self.processor(inputs)
-        
       else:
 
-        outputs_or_none = [
-          self.processor(inp) for inp in inputs
-        ]
+        self.__run_batch(batch)
 
-        outputs = [o for o in outputs_or_none if o]
+  def __drop_expired(self, batch : list[PreparedInput]) -> list[PreparedInput]:
 
-      # TODO: this method allow the processor to only populate one output channel
-      # TODO: allow the processor to return dict[channel, item]
-      if outputs and len(outputs) > 0:
+    ''' Unconsumes inputs whose deadline has passed while they were queued. '''
 
-        if not len(outputs) == len(inputs):
+    now : float = time.monotonic()
 
-          raise Exception(
-            'Received {} outputs for {} inputs.'.format(
-              len(outputs), len(inputs)
-            )
-          )
-
-        # TODO: add bulk request feature to API
-        for output, bundle in zip(outputs, inputs):
-
-          for channel,o in output.items():
-            
-            consumption_id : str | None = \
-              bundle['bundle']['consumptionId'] \
-                if 'consumptionId' in bundle['bundle'] \
-                  else None
-
-            if (consumption_id == None):
-
-              raise Exception('Cannot emit bundle that has not been consumed.')
-
-            item : DataItemWrite = \
-            { 
-              **o,
-              'outputChannel': channel,
-              'done': o['done'] if 'done' in o else True,
-              'consumptionId': consumption_id,
-            }
-
-            self.stream.api.emit_item(
-              {
-                'nodeId': bundle['consumerId'],
-                'taskId': bundle['taskId'],
-              },
-              item
-            )
+    expired : list[PreparedInput] = [inp for inp in batch if inp.deadline is not None and inp.deadline <= now]
 
-    except Exception as e:
-      print(e)
-      for inp in inputs:
+    for inp in expired:
 
-        consumption_id : str | None = \
-              inp['bundle']['consumptionId'] \
-                if 'consumptionId' in inp['bundle'] \
-                  else None
+      self.stats.incr('deadline.expired')
 
+      self.__unconsume(inp, 'expired')
 
-        self.stream.handle_callback_error(
-          inp['taskId'],
-          inp['_id'],
-          consumption_id,
-          e
-        )
-          
+      self.release(inp)
 
-    finally:
+    return [inp for inp in batch if inp.deadline is None or inp.deadline > now] if expired else batch
+
+  def abandon_expired(self) -> None:
+
+    '''
+    Unconsumes dispatched inputs whose deadline has passed. Their outputs are discarded once the processor returns.
+    '''
+
+    now : float = time.monotonic()
+
+    with self.__in_flight_lock:
+
+      expired : list[PreparedInput] = [
+        inp for inp in self.__in_flight.values() if inp.deadline is not None and inp.deadline <= now
+      ]
+
+      for inp in expired:
+
+        del self.__in_flight[id(inp)]
+
+        self.__abandoned.add(id(inp))
+
+    for inp in expired:
+
+      self.stats.incr('deadline.abandoned')
+
+      self.__unconsume(inp)
+
+      # the processor may take a while to return, the outputs after the abandoned input do not wait for it
+      if self.reorder is not None:
+        self.emit_ready(self.reorder.discard(inp))
+
+  def claim(self, inputs : list[PreparedInput]) -> list[bool]:
+
+    '''
+    Marks processed inputs as done. Returns False for inputs that have been abandoned after their deadline,
+    these must neither be emitted nor unconsumed again.
+    '''
+
+    if self.deadline is None:
+      return [True] * len(inputs)
+
+    claimed : list[bool] = []
 
-      if self.stream.active_callbacks.dec():
+    with self.__in_flight_lock:
 
-        self.stream.resume()
+      for inp in inputs:
+
+        if id(inp) in self.__abandoned:
+
+          self.__abandoned.discard(id(inp))
+
+          claimed.append(False)
+
+        else:
+
+          self.__in_flight.pop(id(inp), None)
+
+          claimed.append(True)
+
+    return claimed
+
+  def __unconsume(self, inp : PreparedInput, status : str | None = None) -> None:
+
+    if inp.ref.consumption_id is not None:
+
+      with span(inp.trace, 'unconsume'):
+        self.api.unconsume(inp.ref.task_id, inp.ref.bundle_id, inp.ref.consumption_id)
+
+    if status:
+      self.finish_trace(inp, status)
+
+  def __run_batch(self, batch : list[PreparedInput]) -> None:
+
+    succeeded : bool = False
+    start : float = time.monotonic()
+
+    try:
+
+      succeeded = typing.cast(InputStreamDataCallback, self.data_callback).process_batch(batch)
+
+    finally:
+
+      latency : float = time.monotonic() - start
+
+      self.stats.timing('batch', latency)
+      self.stats.incr('bundles', len(batch))
+
+      if self.concurrency_limit:
+
+        self.active_callbacks.set_max(
+          self.concurrency_limit.update(latency, self.active_callbacks.value, not succeeded)
+        )
+
+        self.stats.gauge('concurrency_limit', self.active_callbacks.max)
+
+      self.active_callbacks.dec()
+
+      # a processor is torn down on close only after its last batch
+      if self.closed:
+        self.teardown_processor()
+
+      # when running inline, the dispatch loop picks up the next batch itself
+      if self.executor:
+        self.dispatch()
+
+  def unconsume_queued(self) -> None:
+
+    '''
+    Removes all queued (not yet dispatched) inputs and puts their bundles back into the unconsumed bundles collection.
+    '''
+
+    for inp in self.queue.pop_many(len(self.queue)):
+
+      self.__unconsume(inp, 'unconsumed')
+
+      self.release(inp)
+
+  def prepare(
+    self,
+    bundle : BundleRead,
+    trace : Trace | None = None,
+    deadline : float | None = None,
+    size_bound : int | None = None,
+  ) -> PreparedInput:
+
+    '''
+    Runs prepare_bundle with the worker that has been registered for the bundle.
+    '''
+
+    return prepare_bundle(
+      self.api.get_registered_worker(
+        bundle['workerId'] if 'workerId' in bundle else None
+      ), 
+      bundle,
+      self.spill_threshold,
+      self.spill_dir,
+      trace,
+      self.item_cache,
+      deadline,
+      size_bound,
+    )
+
+  def validate_input(self, inp : PreparedInput) -> bool:
+
+    '''
+    Validates a sample of the consumed inputs. Invalid inputs are failed, returns False for those.
+    '''
+
+    validation : 'Validation' = typing.cast('Validation', self.validation)
+
+    if not validation.sample():
+      return True
+
+    self.stats.incr('validation.inputs')
+
+    try:
+
+      validation.validator(self.api.get_registered_worker(inp.ref.worker_id)).check_input(inp)
+
+      return True
+
+    except Exception as e:
+
+      self.stats.incr('validation.invalid_inputs')
+
+      try:
+        self.handle_failures([(inp, e)])
+      finally:
+
+        self.finish_trace(inp, 'invalid')
+
+        self.release(inp)
+
+      return False
+
+  def release(self, inp : PreparedInput) -> None:
+
+    '''
+    Frees the payloads of a processed or unconsumed input. Shared items are left to the item cache.
+    '''
+
+    if self.max_inflight_bytes is not None:
+      self.__untrack(inp)
+
+    if self.item_cache is None:
+      release_prepared_input(inp)
+
+    # inputs that leave without an output no longer hold back the outputs after them
+    if self.reorder is not None:
+      self.emit_ready(self.reorder.discard(inp))
+
+  def emit_ready(
+    self,
+    ready : typing.Iterable[tuple[PreparedInput, ProcessorOutput | None]],
+    batch : set[int] = set(),
+    failed : list[tuple[PreparedInput, Exception]] | None = None,
+  ) -> None:
+
+    '''
+    Emits outputs released by the reorder buffer and finishes their traces. Failed emits of inputs in batch (by id())
+    are appended to failed, those of inputs processed in other batches are handled right away.
+
+    The iterator is always exhausted: the reorder buffer only hands out the outputs of a key to one caller at a time.
+    '''
+
+    for inp, output in ready:
+
+      try:
+
+        if output:
+          typing.cast(InputStreamDataCallback, self.data_callback).emit_output(inp, output)
+
+      except Exception as e:
+
+        self.stats.incr('emit_errors')
+
+        if failed is not None and id(inp) in batch:
+
+          failed.append((inp, e))
+
+          continue
+
+        try:
+          self.handle_failures([(inp, e)])
+        except Exception as unconsume_error:
+          self.emit('error', unconsume_error)
+
+        self.finish_trace(inp, 'error')
+
+        continue
+
+      self.finish_trace(inp, 'ok')
+
+  def finish_trace(self, inp : PreparedInput, status : str) -> None:
+
+    ''' Hands the trace of a sampled input to the tracer. Tracing must never break processing, export errors are counted. '''
+
+    if self.tracer is None or inp.trace is None:
+      return
+
+    try:
+      self.tracer.finish(inp.trace, status)
+    except Exception:
+      self.stats.incr('tracing.export_errors')
+
+  @property
+  def inflight_bytes(self) -> int:
+
+    ''' Approximate payload bytes of the queued and processing bundles. '''
+
+    return self.__inflight_bytes
+
+  def over_budget(self) -> bool:
+
+    return self.max_inflight_bytes is not None and self.__inflight_bytes >= self.max_inflight_bytes
+
+  def __track(self, inp : PreparedInput, estimate : int | None = None) -> None:
+
+    # the share of the response spares encoding the payloads (again) just to size them
+    size : int = sum(item_size(item) for item in inp.inputs.values()) if estimate is None else estimate
+
+    with self.__sizes_lock:
+
+      self.__sizes[id(inp)] = size
+      self.__inflight_bytes += size
+
+      self.stats.gauge('inflight_bytes', self.__inflight_bytes)
+
+  def __untrack(self, inp : PreparedInput) -> None:
+
+    with self.__sizes_lock:
+
+      was_over : bool = self.over_budget()
+
+      self.__inflight_bytes -= self.__sizes.pop(id(inp), 0)
+
+      self.stats.gauge('inflight_bytes', self.__inflight_bytes)
+
+      resumed : bool = was_over and not self.over_budget()
+
+    interval : Interval | None = self.interval
+
+    # consume again right away instead of waiting for the next tick
+    if resumed and interval:
+      interval.trigger()
+
+  def handle_failures(self, failed : list[tuple[PreparedInput, Exception]]) -> None:
+
+    '''
+    Unconsumes failed inputs (right away or after the delay of the redelivery policy) or quarantines them.
+    '''
+
+    self.stats.incr('errors', len(failed))
+
+    unconsume : list[PreparedInput] = []
+
+    for inp, error in failed:
+
+      # no need to unconsume the bundle if it has not been consumed in the first place
+      if inp.ref.consumption_id is None:
+        continue
+
+      if self.redelivery is None:
+
+        unconsume.append(inp)
+
+      else:
+
+        attempts : int = self.redelivery.failed(inp.ref.bundle_id)
+
+        if attempts >= self.redelivery.max_attempts:
+
+          self.stats.incr('quarantined')
+
+          self.redelivery.quarantine(inp, error, attempts)
+
+          self.emit('quarantine', inp, error)
+
+        else:
+
+          self.stats.incr('redeliveries')
+
+          with self.__redeliveries_lock:
+
+            self.__redelivery_sequence += 1
+
+            heapq.heappush(
+              self.__redeliveries,
+              (time.monotonic() + self.redelivery.delay(attempts), self.__redelivery_sequence, inp.ref)
+            )
+
+    try:
+
+      if unconsume:
+
+        start : float = time.time()
+
+        self.api.unconsume_many(
+          [(inp.ref.task_id, inp.ref.bundle_id, typing.cast(str, inp.ref.consumption_id)) for inp in unconsume]
+        )
+
+        for inp in unconsume:
+
+          if inp.trace:
+            inp.trace.add('unconsume', start, time.time())
+
+    finally:
+
+      for _, error in failed:
+        self.emit('error', error)
+
+  def redeliver_due(self, now : float | None = None) -> None:
+
+    ''' Unconsumes failed bundles whose redelivery delay has passed. '''
+
+    now = time.monotonic() if now is None else now
+
+    with self.__redeliveries_lock:
+
+      due : list[tuple[float, int, BundleRef]] = []
+
+      while self.__redeliveries and self.__redeliveries[0][0] <= now:
+        due.append(heapq.heappop(self.__redeliveries))
+
+    if not due:
+      return
+
+    try:
+
+      self.api.unconsume_many(
+        [(ref.task_id, ref.bundle_id, typing.cast(str, ref.consumption_id)) for _, _, ref in due]
+      )
+
+    except Exception:
+
+      # the bundles are still consumed, the next call tries again
+      with self.__redeliveries_lock:
+
+        for entry in due:
+          heapq.heappush(self.__redeliveries, entry)
+
+      raise
+
+  def redeliver_all(self) -> None:
+
+    self.redeliver_due(now=float('inf'))
+
+  def handle_callback_error(
+    self,
+    task_id : str,
+    bundle_id : str,
+    consumption_id : str | None,
+    error : Exception
+  ) -> None:
+
+    # no need to unconsume the bundle if it has not been consumed in the first place
+    if not consumption_id == None:
+
+      self.api.unconsume(task_id, bundle_id, consumption_id)
+
+    self.emit('error', error)
+
+  def on_data(self, processor : BundleProcessor) -> Stream:
+
+    '''
+    Typed alias for on('data', processor).
+    '''
+
+    return self.on('data', processor)
+
+
+class InputStreamDataCallback:
+
+  '''
+  Wraps a 'data' callback for an InputStream.
+  '''
+
+  def __init__(
+    self,
+    stream : InputStream,
+    processor : BundleProcessor
+  ) -> None:
+
+    self.stream: InputStream = stream
+    self.processor = processor
+
+  def __call__(self, inp : PreparedInput) -> bool:
+
+    # InputStream.dispatch calls process_batch directly, this is used when 'data' is emitted manually
+    return self.process_batch([inp])
+
+  def process_batch(self, inputs : list[PreparedInput]) -> bool:
+
+    '''
+    Runs the processor on inputs and emits the outputs. Returns False if processing failed.
+    '''
+
+    # trace status by id() of the input, 'ok' unless it failed or was abandoned after its deadline
+    status : dict[int, str] = {}
+
+    failed : list[tuple[PreparedInput, Exception]] = []
+
+    try:
+
+      self.__process(inputs, failed, status)
+
+      if failed:
+
+        claimed : list[bool] = self.stream.claim([inp for inp, _ in failed])
+
+        for (inp, _), owned in zip(failed, claimed):
+          status[id(inp)] = 'error' if owned else 'abandoned'
+
+        self.stream.handle_failures([f for f, owned in zip(failed, claimed) if owned])
+
+      elif self.stream.redelivery:
+
+        for inp in inputs:
+          self.stream.redelivery.succeeded(inp.ref.bundle_id)
+
+      return not failed
+
+    finally:
+
+      for inp in inputs:
+
+        # outputs that went through the reorder buffer finish their trace once they are emitted (see emit_ready)
+        if not status.get(id(inp)) == 'reordered':
+          self.stream.finish_trace(inp, status.get(id(inp), 'ok'))
+
+        self.stream.release(inp)
+
+  def __process(
+    self,
+    inputs : list[PreparedInput],
+    failed : list[tuple[PreparedInput, Exception]],
+    status : dict[int, str],
+  ) -> None:
+
+    '''
+    Runs the processor and emits the outputs of inputs, appends inputs that failed to failed.
+    '''
+
+    try:
+
+      outputs : list[ProcessorOutput | None] = self.run_processor(inputs)
+
+    except Exception as e:
+
+      if len(inputs) > 1 and self.stream.narrow_failures:
+
+        self.stream.stats.incr('bisections')
+
+        middle : int = len(inputs) // 2
+
+        self.__process(inputs[:middle], failed, status)
+        self.__process(inputs[middle:], failed, status)
+
+      else:
+
+        failed.extend((inp, e) for inp in inputs)
+
+      return
+
+    reorder : ReorderBuffer | None = self.stream.reorder
+
+    batch : set[int] = { id(inp) for inp in inputs } if reorder is not None else set()
+
+    # TODO: add bulk request feature to API
+    for output, inp, owned in zip(outputs, inputs, self.stream.claim(inputs)):
+
+      if not owned:
+
+        status[id(inp)] = 'abandoned'
+
+        continue
+
+      if reorder is None:
+
+        try:
+
+          if output:
+            self.emit_output(inp, output)
+
+        except Exception as e:
+
+          self.stream.stats.incr('emit_errors')
+
+          failed.append((inp, e))
+
+      else:
+
+        status[id(inp)] = 'reordered'
+
+        # the outputs of earlier bundles may be released along with this one (or this one held back)
+        self.stream.emit_ready(reorder.complete(inp, output), batch, failed)
+
+  def run_processor(self, inputs : list[PreparedInput]) -> list[ProcessorOutput | None]:
+
+    '''
+    Returns one output (or None) per input.
+    Bundles found in the stream's idempotency cache are not processed again.
+    '''
+
+    cache : typing.Optional['IdempotencyCache'] = self.stream.idempotency
+
+    outputs : list[ProcessorOutput | None] = [None] * len(inputs)
+
+    keys : list[str] = [cache.key(inp) for inp in inputs] if cache is not None else []
+
+    pending : list[int] = []
+
+    for i in range(len(inputs)):
+
+      cached : typing.Optional['CachedOutput'] = cache.get(keys[i]) if cache is not None else None
+
+      if cached is None:
+
+        pending.append(i)
+
+        continue
+
+      self.stream.stats.incr('idempotency.hits')
+      self.stream.stats.incr('idempotency.saved_seconds', cached.seconds)
+
+      if typing.cast('IdempotencyCache', cache).on_duplicate == 'reemit':
+        outputs[i] = cached.output
+
+    if not pending:
+      return outputs
+
+    pending_inputs : list[PreparedInput] = [inputs[i] for i in pending]
+
+    processor_start : float = time.time()
+
+    results : list[ProcessorOutput | None]
+
+    with profiler.stage('processor'):
+
+      if isinstance(self.processor, BatchProcessor):
+
+        batch_results : list[ProcessorOutput] | None = self.processor(
+          ColumnarBatch(pending_inputs) if self.processor.columnar else pending_inputs
+        )
+
+        results = list(batch_results) if batch_results else [None] * len(pending_inputs)
+
+      elif isinstance(self.processor, TaskProcessor):
+
+        results = [self.run_task_processor(self.processor, inp) for inp in pending_inputs]
+
+      else:
+
+        results = [self.processor(inp) for inp in pending_inputs]
+
+    processor_end : float = time.time()
+
+    if not len(results) == len(pending_inputs):
+
+      raise Exception(
+        'Received {} outputs for {} inputs.'.format(
+          len(results), len(pending_inputs)
+        )
+      )
+
+    for i, result in zip(pending, results):
+
+      outputs[i] = result
+
+      trace : Trace | None = inputs[i].trace
+
+      if trace:
+        trace.add('processor', processor_start, processor_end)
+
+      # outputs are stored before emitting so that a failed emit does not cost another processor run
+      if cache is not None and is_cacheable(result or {}):
+        cache.put(keys[i], result or {}, (processor_end - processor_start) / len(pending))
+
+    return outputs
+
+  def run_task_processor(
+    self,
+    processor : TaskProcessor,
+    inp : PreparedInput
+  ) -> ProcessorOutput | None:
+
+    task_states : TaskStates = typing.cast(TaskStates, self.stream.task_states)
+
+    with task_states.use(inp.ref.task_id) as state:
+      return processor.process(inp, state)
+
+  def emit_output(
+    self,
+    inp : PreparedInput,
+    output : ProcessorOutput
+  ) -> None:
+
+    '''
+    Emits the output of a single bundle, one item per output channel.
+    '''
+
+    validation : typing.Optional['Validation'] = self.stream.validation
+
+    # all channels are checked before the first item is emitted
+    if validation is not None and validation.sample():
+
+      self.stream.stats.incr('validation.outputs')
+
+      validator = validation.validator(self.stream.api.get_registered_worker(inp.ref.worker_id))
+
+      try:
+
+        for channel, o in output.items():
+          validator.check_output(channel, o)
+
+      except Exception:
+
+        self.stream.stats.incr('validation.invalid_outputs')
+
+        raise
+
+    # TODO: allow the processor to return dict[channel, item]
+    for channel,o in output.items():
+      
+      consumption_id : str | None = inp.ref.consumption_id
+
+      if (consumption_id == None):
+
+        raise Exception('Cannot emit bundle that has not been consumed.')
+
+      item : DataItemWrite = \
+      { 
+        **o,
+        'outputChannel': channel,
+        'done': o['done'] if 'done' in o else True,
+        'consumptionId': consumption_id,
+      }
+
+      with profiler.stage('emit_item'), span(inp.trace, 'emit_item'):
+
+        self.stream.api.emit_item(
+          {
+            'nodeId': inp.ref.consumer_id,
+            'taskId': inp.ref.task_id,
+          },
+          item
+        )
@@ -0,0 +1,418 @@
+
+'''
+pplns-worker: runs a processor in several worker processes.
+
+  pplns-worker my_module:processor --worker my_module:worker_definition --processes 4
+
+Each child process registers the worker, creates its own InputStream and polls until it receives SIGTERM,
+at which point it stops consuming and drains the bundles it has in flight.
+The parent restarts crashed children, forwards SIGTERM/SIGINT and aggregates the children's stats.
+'''
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import typing
+
+from pplns_python.stats import merge_snapshots
+
+if typing.TYPE_CHECKING:
+
+  from pplns_python.stream import InputStream
+
+def load_object(path : str) -> typing.Any:
+
+  '''
+  Loads 'package.module:attribute'.
+  '''
+
+  if not ':' in path:
+    raise Exception(f'Expected module:attribute, got {path}.')
+
+  module_name, attribute = path.split(':', 1)
+
+  obj : typing.Any = importlib.import_module(module_name)
+
+  for name in attribute.split('.'):
+    obj = getattr(obj, name)
+
+  return obj
+
+def load_processor(path : str) -> typing.Any:
+
+  ''' Loads a processor, classes are instantiated without arguments. '''
+
+  processor = load_object(path)
+
+  return processor() if isinstance(processor, type) else processor
+
+def parse_args(argv : list[str] | None = None) -> argparse.Namespace:
+
+  parser = argparse.ArgumentParser(
+    prog='pplns-worker',
+    description='Runs a pplns processor in several supervised worker processes.',
+  )
+
+  parser.add_argument('processor', help='processor to run, as module:attribute (classes are instantiated)')
+  parser.add_argument('--worker', required=True, help='WorkerWrite definition, as module:attribute')
+  parser.add_argument('--query', default=None, help='BundleQuery as JSON (default: {"workerId": <worker _id>})')
+  parser.add_argument('--api', default=os.environ.get('PPLNS_API'), help='API base url (default: $PPLNS_API)')
+  parser.add_argument('--api-key-env', default='PPLNS_API_KEY', help='environment variable holding the API key')
+  parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count())
+  parser.add_argument('--max-concurrency', type=int, default=1, help='concurrently processed bundles per process')
+  parser.add_argument('--polling-time', type=float, default=0.5)
+  parser.add_argument('--max-inflight-bytes', type=int, default=None, help='stop consuming above this many payload bytes per process')
+  parser.add_argument('--ordering', choices=['unordered', 'task', 'consumer'], default='unordered', help='emit outputs in input order per task or consumer')
+  parser.add_argument('--validate', choices=['off', 'sampled', 'full'], default='off', help='check items against the worker schemas')
+  parser.add_argument('--validate-sample-rate', type=float, default=0.01)
+  parser.add_argument('--narrow-failures', action='store_true', help='run failed batches again in halves to find the failing bundles')
+  parser.add_argument('--replica-count', type=int, default=os.environ.get('PPLNS_REPLICA_COUNT'), help='partition tasks across this many replicas of pplns-worker (default: $PPLNS_REPLICA_COUNT)')
+  parser.add_argument('--replica-index', type=int, default=os.environ.get('PPLNS_REPLICA_INDEX', '0'), help='index of this replica (default: $PPLNS_REPLICA_INDEX or 0)')
+  parser.add_argument('--partition-refresh', type=float, default=5.0, help='seconds between discoveries of the tasks with pending bundles')
+  parser.add_argument('--max-poll-errors', type=int, default=5, help='consecutive failed polls after which a process restarts')
+  parser.add_argument('--drain-timeout', type=float, default=30.0, help='seconds to wait for in-flight bundles on shutdown')
+  parser.add_argument('--metrics-interval', type=float, default=10.0)
+  parser.add_argument('--metrics-file', default=None, help='file to write aggregated stats to (JSON)')
+  parser.add_argument('--worker-cache-dir', default=None)
+  parser.add_argument('--profile-dir', default=None, help='enables toggling a stack sampling profiler with SIGUSR2')
+
+  args = parser.parse_args(argv)
+
+  if not args.api:
+    parser.error('--api or $PPLNS_API is required.')
+
+  if args.replica_count is not None and not 0 <= args.replica_index < args.replica_count:
+    parser.error(f'--replica-index must be within [0, {args.replica_count}).')
+
+  return args
+
+def run_worker(
+  args : argparse.Namespace,
+  index : int,
+  metrics : 'multiprocessing.Queue[tuple[int, dict[str, float]]]',
+) -> None:
+
+  '''
+  Entry point of a child process.
+  '''
+
+  import concurrent.futures
+
+  from pplns_python.api import PipelineApi
+
+  from pplns_python.validation import Validation
+
+  stop = threading.Event()
+
+  # the parent forwards shutdown signals, Ctrl+C in a terminal reaches the children directly as well
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+  if args.profile_dir:
+
+    from pplns_python.profiling import profiler
+
+    profiler.output_dir = args.profile_dir
+    profiler.install_signal()
+
+  api = PipelineApi(
+    args.api,
+    os.environ.get(args.api_key_env, ''),
+    worker_cache_dir=args.worker_cache_dir,
+  )
+
+  worker = api.register_worker(load_object(args.worker))
+
+  query = json.loads(args.query) if args.query else { 'workerId': worker['_id'] }
+
+  executor = concurrent.futures.ThreadPoolExecutor(args.max_concurrency) \
+    if args.max_concurrency > 1 else None
+
+  partition = None
+
+  if args.replica_count is not None:
+
+    from pplns_python.partitioning import \
+      Partitioner, \
+      PartitionedQueries, \
+      pending_task_ids
+
+    # the processes of all replicas share one ring
+    partition = PartitionedQueries(
+      Partitioner(args.replica_index * args.processes + index, args.replica_count * args.processes),
+      pending_task_ids(api),
+      refresh=args.partition_refresh,
+    )
+
+  stream = api.create_input_stream(
+    query,
+    max_concurrency=args.max_concurrency,
+    polling_time=args.polling_time,
+    executor=executor,
+    max_inflight_bytes=args.max_inflight_bytes,
+    validation=Validation(args.validate, args.validate_sample_rate) if not args.validate == 'off' else None,
+    ordering=args.ordering,
+    narrow_failures=args.narrow_failures,
+    partition=partition,
+  )
+
+  stream.on('error', lambda e: print(f'[worker {index}] {e}', file=sys.stderr))
+
+  stream.on_data(load_processor(args.processor))
+
+  def report() -> None:
+
+    metrics.put((
+      index,
+      {
+        **stream.stats.snapshot(),
+        **{ 'api.' + name: value for name, value in api.stats.snapshot().items() }
+      }
+    ))
+
+  try:
+    poll_until_stopped(stream, stop, args, index, report)
+  finally:
+
+    if executor:
+      executor.shutdown(wait=False)
+
+    report()
+
+def poll_until_stopped(
+  stream : 'InputStream',
+  stop : threading.Event,
+  args : argparse.Namespace,
+  index : int,
+  report : typing.Callable[[], None],
+) -> None:
+
+  '''
+  Polls stream until stop is set, then drains and closes it.
+
+  Failed polls (e.g. API timeouts) are counted in the stream's stats and retried in the next iteration.
+  After max_poll_errors failures in a row, the stream is drained and closed as well and the last error is raised,
+  so that the process exits and the parent restarts it without leaving consumed bundles behind.
+  '''
+
+  last_report : float = time.monotonic()
+
+  errors : int = 0
+
+  try:
+
+    # polling is driven from here instead of an Interval so that errors end the process and the parent restarts it
+    while not stop.wait(args.polling_time):
+
+      try:
+
+        stream.poll()
+
+        errors = 0
+
+      except Exception as e:
+
+        errors += 1
+
+        stream.stats.incr('poll_errors')
+
+        print(f'[worker {index}] poll failed ({errors}/{args.max_poll_errors}): {e}', file=sys.stderr)
+
+        if errors >= args.max_poll_errors:
+          raise
+
+      if time.monotonic() - last_report >= args.metrics_interval:
+
+        report()
+
+        last_report = time.monotonic()
+
+  finally:
+
+    if not stream.drain(args.drain_timeout):
+      print(f'[worker {index}] drain timed out', file=sys.stderr)
+
+    stream.close()
+
+class Supervisor:
+
+  '''
+  Starts, restarts and stops the worker processes.
+  '''
+
+  def __init__(
+    self,
+    args : argparse.Namespace,
+    max_restart_delay : float = 30.0,
+  ) -> None:
+
+    self.args : argparse.Namespace = args
+    self.max_restart_delay : float = max_restart_delay
+
+    self.context = multiprocessing.get_context()
+    self.metrics : typing.Any = self.context.Queue()
+
+    self.children : dict[int, multiprocessing.process.BaseProcess] = {}
+    self.restarts : dict[int, int] = {}
+    self.restart_at : dict[int, float] = {}
+    self.started_at : dict[int, float] = {}
+
+    # latest stats snapshot by child index
+    self.snapshots : dict[int, dict[str, float]] = {}
+
+    self.stopping : bool = False
+
+  def spawn(self, index : int) -> None:
+
+    process = self.context.Process(
+      target=run_worker,
+      args=(self.args, index, self.metrics),
+      name=f'pplns-worker-{index}',
+    )
+
+    process.start()
+
+    self.children[index] = process
+    self.started_at[index] = time.monotonic()
+
+  def forward_signal(self, signum : int, frame : typing.Any = None) -> None:
+
+    ''' Forwards signum (e.g. SIGUSR2 to toggle profiling) to all children. '''
+
+    for process in self.children.values():
+
+      if process.is_alive() and process.pid:
+        os.kill(process.pid, signum)
+
+  def stop(self, signum : int | None = None, frame : typing.Any = None) -> None:
+
+    ''' Starts a graceful shutdown by forwarding SIGTERM to all children. '''
+
+    self.stopping = True
+
+    self.forward_signal(signal.SIGTERM)
+
+  def aggregate(self) -> dict[str, float]:
+
+    ''' Stats of all children added up. '''
+
+    return {
+      **merge_snapshots(self.snapshots.values()),
+      'processes': sum(p.is_alive() for p in self.children.values()),
+      'restarts': sum(self.restarts.values()),
+    }
+
+  def __collect_metrics(self, timeout : float) -> None:
+
+    try:
+
+      while True:
+
+        index, snapshot = self.metrics.get(timeout=timeout)
+
+        self.snapshots[index] = snapshot
+
+        timeout = 0
+
+    except queue.Empty:
+
+      pass
+
+  def __write_metrics(self) -> None:
+
+    if not self.args.metrics_file:
+      return
+
+    tmp_path : str = self.args.metrics_file + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+      json.dump(self.aggregate(), f)
+
+    os.replace(tmp_path, self.args.metrics_file)
+
+  def check_children(self) -> None:
+
+    ''' Restarts children that exited, after a delay that doubles with each restart (up to max_restart_delay). '''
+
+    now : float = time.monotonic()
+
+    for index, process in list(self.children.items()):
+
+      if process.is_alive():
+        continue
+
+      if self.stopping:
+
+        del self.children[index]
+
+        continue
+
+      if not index in self.restart_at:
+
+        # a child that has been running for a while starts over with the shortest restart delay
+        if now - self.started_at[index] > 2 * self.max_restart_delay:
+          self.restarts[index] = 0
+
+        restarts : int = self.restarts.get(index, 0)
+
+        delay : float = min(self.max_restart_delay, 2 ** restarts - 1)
+
+        print(
+          f'[supervisor] worker {index} exited with {process.exitcode}, restarting in {delay}s',
+          file=sys.stderr
+        )
+
+        self.restarts[index] = restarts + 1
+        self.restart_at[index] = now + delay
+
+      elif now >= self.restart_at[index]:
+
+        del self.restart_at[index]
+
+        self.spawn(index)
+
+  def run(self) -> int:
+
+    signal.signal(signal.SIGTERM, self.stop)
+    signal.signal(signal.SIGINT, self.stop)
+
+    if self.args.profile_dir:
+      signal.signal(signal.SIGUSR2, self.forward_signal)
+
+    for index in range(self.args.processes):
+      self.spawn(index)
+
+    last_write : float = time.monotonic()
+
+    while self.children:
+
+      self.__collect_metrics(timeout=0.5)
+
+      self.check_children()
+
+      if time.monotonic() - last_write >= self.args.metrics_interval:
+
+        self.__write_metrics()
+
+        last_write = time.monotonic()
+
+    # children report once more after draining
+    self.__collect_metrics(timeout=0)
+    self.__write_metrics()
+
+    return 0
+
+def main(argv : list[str] | None = None) -> int:
+
+  return Supervisor(parse_args(argv)).run()
+
+if __name__ == '__main__':
+
+  sys.exit(main())
@@ -1,5 +1,4 @@
 
-from distutils.command.clean import clean
 import os
 
 from pplns_python.api import PipelineApi
@@ -14,7 +13,9 @@ from pplns_types import \
   Worker, \
   BundleRead
 
-from pplns_python.processor import PreparedInput
+from pplns_python.processor import \
+  BundleRef, \
+  PreparedInput
 
 def env(s : str) -> str:
 
@@ -37,14 +38,15 @@ mock_bundle : BundleRead = \
   "_id": "mock-bundle-id",
 }  # type: ignore
 
-mock_prepared_input : PreparedInput = \
-{
-  '_id': mock_bundle['_id'],
-  'bundle': mock_bundle,
-  'taskId': 'mock_prepared_input.task_id',
-  'consumerId': 'mock_prepared_input.consumerId',
-  'inputs': {},
-}
+mock_prepared_input : PreparedInput = PreparedInput(
+  BundleRef(
+    mock_bundle['_id'],
+    'mock_prepared_input.task_id',
+    'mock_prepared_input.consumerId',
+  ),
+  {},
+  mock_bundle,
+)
 
 def sink_node(source_node : NodeRead) -> NodeWrite:
 
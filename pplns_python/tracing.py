@@ -0,0 +1,186 @@
+
+import json
+import os
+import random
+import threading
+import time
+import typing
+
+from pplns_types import BundleRead
+
+class Span:
+
+  ''' Records a stage of a Trace from __enter__ to __exit__. '''
+
+  __slots__ = ('trace', 'name', 'start')
+
+  def __init__(self, trace : 'Trace', name : str) -> None:
+
+    self.trace = trace
+    self.name : str = name
+    self.start : float = 0.0
+
+  def __enter__(self) -> None:
+
+    self.start = time.time()
+
+  def __exit__(self, *exc : typing.Any) -> None:
+
+    self.trace.add(self.name, self.start, time.time())
+
+class NullSpan:
+
+  ''' Span used for bundles that are not sampled. '''
+
+  def __enter__(self) -> None:
+    pass
+
+  def __exit__(self, *exc : typing.Any) -> None:
+    pass
+
+null_span = NullSpan()
+
+class Trace:
+
+  '''
+  Timestamps of the stages a single bundle passes through:
+  consume -> prepare_bundle -> queue -> processor -> emit_item / unconsume.
+  '''
+
+  __slots__ = ('trace_id', 'bundle_id', 'task_id', 'spans', 'marks', 'status')
+
+  def __init__(
+    self,
+    bundle_id : str,
+    task_id : str,
+  ) -> None:
+
+    self.trace_id : str = os.urandom(8).hex()
+    self.bundle_id : str = bundle_id
+    self.task_id : str = task_id
+
+    # (stage, start, end) with unix timestamps
+    self.spans : list[tuple[str, float, float]] = []
+
+    # points in time that start a span which ends somewhere else (e.g. being queued)
+    self.marks : dict[str, float] = {}
+
+    self.status : str = 'ok'
+
+  def add(self, name : str, start : float, end : float) -> None:
+
+    self.spans.append((name, start, end))
+
+  def mark(self, name : str) -> None:
+
+    self.marks[name] = time.time()
+
+  def end_mark(self, name : str) -> None:
+
+    ''' Adds a span from the mark name until now. '''
+
+    if name in self.marks:
+      self.add(name, self.marks.pop(name), time.time())
+
+  def as_dict(self) -> dict[str, typing.Any]:
+
+    return {
+      'traceId': self.trace_id,
+      'bundleId': self.bundle_id,
+      'taskId': self.task_id,
+      'status': self.status,
+      'spans': [
+        { 'name': name, 'start': start, 'end': end, 'duration': end - start }
+        for name, start, end in self.spans
+      ],
+    }
+
+def span(trace : Trace | None, name : str) -> Span | NullSpan:
+
+  ''' Returns a span of trace or a no-op if the bundle is not traced. '''
+
+  return Span(trace, name) if trace is not None else null_span
+
+class SpanExporter:
+
+  ''' Receives finished traces. '''
+
+  def export(self, trace : Trace) -> None:
+
+    raise Exception('Not implemented.')
+
+  def close(self) -> None:
+    pass
+
+class JsonlExporter(SpanExporter):
+
+  '''
+  Appends one JSON object per finished trace to a file.
+  '''
+
+  def __init__(self, path : str) -> None:
+
+    self.path : str = path
+    self.__file = open(path, 'a', buffering=1)
+    self.__lock = threading.Lock()
+
+  def export(self, trace : Trace) -> None:
+
+    line : str = json.dumps(trace.as_dict())
+
+    with self.__lock:
+      self.__file.write(line + '\n')
+
+  def close(self) -> None:
+
+    with self.__lock:
+      self.__file.close()
+
+class Tracer:
+
+  '''
+  Starts traces for a sample_rate fraction of bundles and hands finished traces to the exporter.
+  Bundles that are not sampled carry no trace, so all stages reduce to a None check.
+  '''
+
+  def __init__(
+    self,
+    exporter : SpanExporter,
+    sample_rate : float = 0.01,
+  ) -> None:
+
+    self.exporter : SpanExporter = exporter
+    self.sample_rate : float = sample_rate
+
+    self.__random = random.Random()
+
+  def start(
+    self,
+    bundle : BundleRead,
+    consume_start : float,
+    consume_end : float,
+  ) -> Trace | None:
+
+    if self.__random.random() >= self.sample_rate:
+      return None
+
+    trace = Trace(bundle['_id'], bundle['taskId'])
+
+    trace.add('consume', consume_start, consume_end)
+
+    return trace
+
+  def finish(
+    self,
+    trace : Trace | None,
+    status : str = 'ok',
+  ) -> None:
+
+    ''' Exports a finished trace. Errors of the exporter are raised, InputStream counts them. '''
+
+    if trace is None:
+      return
+
+    trace.status = status
+
+    self.exporter.export(trace)
@@ -0,0 +1,357 @@
+
+'''
+Transports send the HTTP requests of a PipelineApi.
+
+A transport is any object with get/post/put/patch/delete methods that take the keyword arguments of requests
+(url, headers, data, timeout, stream) and return a response like requests does (status_code, headers, json(),
+text, iter_content(), close()). The requests module itself is the default transport.
+
+Workers on the same host as the API can talk to it over a Unix domain socket instead of loopback TCP:
+
+  api = PipelineApi('http+unix://%2Fvar%2Frun%2Fpplns.sock/api', api_key)
+
+The netloc of an http+unix:// url is the percent-encoded path of the socket.
+'''
+
+import threading
+import typing
+
+from urllib.parse import \
+  unquote, \
+  urlsplit
+
+# http.client and socket are only imported once a Unix socket is used to keep worker start-up fast
+if typing.TYPE_CHECKING:
+
+  import http.client
+  import socket
+
+from pplns_python.lazy_import import LazyModule
+
+requests : typing.Any = LazyModule('requests')
+
+UNIX_SCHEME : str = 'http+unix'
+
+# (connect, read) timeout in seconds, a single value for both or None to wait forever
+Timeout = float | tuple[float, float] | None
+
+class Transport(typing.Protocol):
+
+  def get(self, **params : typing.Any) -> typing.Any: ...
+
+  def post(self, **params : typing.Any) -> typing.Any: ...
+
+  def put(self, **params : typing.Any) -> typing.Any: ...
+
+  def patch(self, **params : typing.Any) -> typing.Any: ...
+
+  def delete(self, **params : typing.Any) -> typing.Any: ...
+
+class RequestsTransport:
+
+  '''
+  Sends requests through a requests.Session, which keeps connections alive between requests.
+  '''
+
+  def __init__(self, session : typing.Any = None) -> None:
+
+    self.session : typing.Any = session or requests.Session()
+
+  @property
+  def exceptions(self) -> typing.Any:
+
+    return requests.exceptions
+
+  def request(self, method : str, **params : typing.Any) -> typing.Any:
+
+    return self.session.request(method, **params)
+
+  def get(self, **params : typing.Any) -> typing.Any:
+    return self.request('get', **params)
+
+  def post(self, **params : typing.Any) -> typing.Any:
+    return self.request('post', **params)
+
+  def put(self, **params : typing.Any) -> typing.Any:
+    return self.request('put', **params)
+
+  def patch(self, **params : typing.Any) -> typing.Any:
+    return self.request('patch', **params)
+
+  def delete(self, **params : typing.Any) -> typing.Any:
+    return self.request('delete', **params)
+
+  def close(self) -> None:
+
+    self.session.close()
+
+def unix_socket_path(netloc : str) -> str:
+
+  ''' Socket path of the netloc of an http+unix:// url. '''
+
+  return unquote(netloc)
+
+def split_timeout(timeout : Timeout) -> tuple[float | None, float | None]:
+
+  return timeout if isinstance(timeout, tuple) else (timeout, timeout)
+
+def unix_connection(socket_path : str, timeout : float | None = None) -> 'http.client.HTTPConnection':
+
+  '''
+  HTTPConnection over the Unix domain socket at socket_path.
+  '''
+
+  import http.client
+  import socket
+
+  class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def connect(self) -> None:
+
+      sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+      try:
+
+        sock.settimeout(self.timeout)
+        sock.connect(socket_path)
+
+      except Exception:
+
+        sock.close()
+
+        raise
+
+      self.sock = sock
+
+  # the Host header is required by HTTP/1.1, the socket path is of no use to the server
+  return UnixHTTPConnection('localhost', timeout=timeout)
+
+class UnixSocketResponse:
+
+  '''
+  The parts of requests.Response that PipelineApi uses.
+  '''
+
+  # unread bytes of a closed response that are read to keep the connection (e.g. the end of a streamed document)
+  drain_limit : int = 1 << 16
+
+  class Request:
+
+    def __init__(self, method : str, url : str) -> None:
+
+      self.method : str = method.upper()
+      self.url : str = url
+
+  def __init__(
+    self,
+    method : str,
+    url : str,
+    response : 'http.client.HTTPResponse',
+    on_close : typing.Callable[[bool], None],
+    stream : bool,
+  ) -> None:
+
+    self.request = UnixSocketResponse.Request(method, url)
+    self.url : str = url
+    self.status_code : int = response.status
+    self.reason : str = response.reason
+    self.headers : typing.Any = response.headers
+
+    self.__response = response
+    self.__on_close = on_close
+    self.__content : bytes | None = None
+    self.__closed : bool = False
+
+    if not stream:
+
+      self.__content = response.read()
+
+      self.close()
+
+  @property
+  def content(self) -> bytes:
+
+    if self.__content is None:
+
+      self.__content = self.__response.read()
+
+      self.close()
+
+    return self.__content
+
+  @property
+  def text(self) -> str:
+
+    return self.content.decode('utf-8', errors='replace')
+
+  def json(self) -> typing.Any:
+
+    import json
+
+    return json.loads(self.content)
+
+  def iter_content(self, chunk_size : int = 1 << 16) -> typing.Iterator[bytes]:
+
+    if self.__content is not None:
+
+      yield self.__content
+
+      return
+
+    while True:
+
+      chunk : bytes = self.__response.read1(chunk_size)
+
+      if not chunk:
+        break
+
+      yield chunk
+
+  def close(self) -> None:
+
+    if self.__closed:
+      return
+
+    self.__closed = True
+
+    response = self.__response
+
+    if not response.isclosed() and response.length is not None and response.length <= self.drain_limit:
+      response.read()
+
+    # a connection can only be reused once the response has been read completely
+    self.__on_close(self.__response.isclosed() and not self.__response.will_close)
+
+class UnixSocketTransport:
+
+  '''
+  Sends HTTP/1.1 requests over a Unix domain socket.
+
+  socket_path: socket to connect to, by default the one in the netloc of each http+unix:// url.
+
+  Each thread keeps one connection per socket alive between requests. Requests on a connection that
+  the server has closed in the meantime are sent again on a new connection, unless the body was streamed.
+  Timeouts raise the builtin TimeoutError.
+  '''
+
+  def __init__(self, socket_path : str | None = None) -> None:
+
+    self.socket_path : str | None = socket_path
+
+    self.__local = threading.local()
+
+  def connection(self, socket_path : str, timeout : float | None) -> 'http.client.HTTPConnection':
+
+    ''' Opens a new connection (overridden e.g. to compare with TCP). '''
+
+    return unix_connection(socket_path, timeout)
+
+  def __connections(self) -> dict[str, 'http.client.HTTPConnection']:
+
+    if not hasattr(self.__local, 'connections'):
+      self.__local.connections = {}
+
+    return self.__local.connections
+
+  def request(
+    self,
+    method : str,
+    url : str,
+    headers : dict[str, str] | None = None,
+    data : typing.Any = None,
+    timeout : Timeout = None,
+    stream : bool = False,
+  ) -> UnixSocketResponse:
+
+    import http.client
+
+    split = urlsplit(url)
+
+    socket_path : str = self.socket_path or unix_socket_path(split.netloc)
+
+    target : str = (split.path or '/') + ('?' + split.query if split.query else '')
+
+    body : typing.Any = data.encode('utf-8') if isinstance(data, str) else data
+
+    # streamed bodies cannot be sent twice
+    retry : bool = isinstance(body, (bytes, type(None)))
+
+    connect_timeout, read_timeout = split_timeout(timeout)
+
+    connections = self.__connections()
+
+    while True:
+
+      connection = connections.pop(socket_path, None)
+
+      reused : bool = connection is not None
+
+      if connection is None:
+        connection = self.connection(socket_path, connect_timeout)
+
+      try:
+
+        if connection.sock is None:
+          connection.connect()
+
+        typing.cast('socket.socket', connection.sock).settimeout(read_timeout)
+
+        connection.request(method.upper(), target, body=body, headers=headers or {})
+
+        response = connection.getresponse()
+
+      except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+
+        connection.close()
+
+        if reused and retry:
+          continue
+
+        raise
+
+      except Exception:
+
+        connection.close()
+
+        raise
+
+      def on_close(reusable : bool, connection=connection) -> None:
+
+        if reusable and not socket_path in connections:
+          connections[socket_path] = connection
+        else:
+          connection.close()
+
+      return UnixSocketResponse(method, url, response, on_close, stream)
+
+  def get(self, **params : typing.Any) -> UnixSocketResponse:
+    return self.request('get', **params)
+
+  def post(self, **params : typing.Any) -> UnixSocketResponse:
+    return self.request('post', **params)
+
+  def put(self, **params : typing.Any) -> UnixSocketResponse:
+    return self.request('put', **params)
+
+  def patch(self, **params : typing.Any) -> UnixSocketResponse:
+    return self.request('patch', **params)
+
+  def delete(self, **params : typing.Any) -> UnixSocketResponse:
+    return self.request('delete', **params)
+
+  def close(self) -> None:
+
+    ''' Closes the connections of the calling thread. '''
+
+    connections = self.__connections()
+
+    while connections:
+      connections.popitem()[1].close()
+
+def default_transport(base_url : str) -> Transport | None:
+
+  '''
+  Transport required by base_url, None if the default (requests) can be used.
+  '''
+
+  return UnixSocketTransport() if urlsplit(base_url).scheme == UNIX_SCHEME else None
@@ -0,0 +1,290 @@
+
+'''
+Client-side validation of input and output items against the channel schemas of a worker.
+
+Channel schemas (WorkerWrite inputs/outputs) describe the elements of an item's data, e.g. { 'type': 'string' }.
+Schemas are compiled once per registered worker into plain Python checks. The supported keywords are
+type, enum, const, properties, required, additionalProperties, items, minItems, maxItems, minLength, maxLength,
+minimum and maximum, other keywords are ignored (the API still validates everything).
+'''
+
+import random
+import threading
+import typing
+
+from pplns_types import WorkerWrite
+
+from pplns_python.processor import PreparedInput
+
+# returns an error message or None if value is valid
+Check = typing.Callable[[typing.Any], str | None]
+
+class ValidationError(Exception):
+
+  def __init__(self, worker_id : str, channel : str, message : str) -> None:
+
+    super().__init__(f'Invalid item in channel {channel} of worker {worker_id}: {message}')
+
+    self.worker_id : str = worker_id
+    self.channel : str = channel
+    self.message : str = message
+
+def is_number(value : typing.Any) -> bool:
+
+  return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+TYPE_CHECKS : dict[str, typing.Callable[[typing.Any], bool]] = {
+  'string': lambda value: isinstance(value, str),
+  'number': is_number,
+  'integer': lambda value: is_number(value) and float(value).is_integer(),
+  'boolean': lambda value: isinstance(value, bool),
+  'object': lambda value: isinstance(value, dict),
+  'array': lambda value: isinstance(value, (list, tuple)),
+  'null': lambda value: value is None,
+}
+
+# compares a value (or length) with the bound of a keyword
+Compare = typing.Callable[[typing.Any, typing.Any], bool]
+
+def number_bound(keyword : str, bound : typing.Any, compare : Compare) -> Check:
+
+  return lambda value: \
+    None if not is_number(value) or compare(value, bound) else f'{value} violates {keyword} {bound}'
+
+def length_bound(keyword : str, bound : typing.Any, kinds : tuple[type[typing.Sized], ...], compare : Compare) -> Check:
+
+  return lambda value: \
+    None if not isinstance(value, kinds) or compare(len(value), bound) else f'length {len(value)} violates {keyword} {bound}'
+
+def compile_schema(schema : typing.Any) -> Check:
+
+  '''
+  Compiles a (JSON) schema into a check.
+  '''
+
+  if not isinstance(schema, dict):
+    return lambda value: None
+
+  checks : list[Check] = []
+
+  if 'type' in schema:
+
+    types : list[str] = schema['type'] if isinstance(schema['type'], list) else [schema['type']]
+
+    type_checks = [TYPE_CHECKS[t] for t in types if t in TYPE_CHECKS]
+
+    if type_checks:
+
+      expected : str = ' or '.join(types)
+
+      checks.append(
+        lambda value: None if any(check(value) for check in type_checks) else f'expected {expected}, got {type(value).__name__}'
+      )
+
+  if 'enum' in schema:
+
+    enum : list[typing.Any] = schema['enum']
+
+    checks.append(lambda value: None if value in enum else f'{value!r} is not one of {enum!r}')
+
+  if 'const' in schema:
+
+    const : typing.Any = schema['const']
+
+    checks.append(lambda value: None if value == const else f'expected {const!r}')
+
+  for keyword, compare in (
+    ('minimum', lambda a, b: a >= b),
+    ('maximum', lambda a, b: a <= b),
+  ):
+
+    if keyword in schema:
+
+      checks.append(number_bound(keyword, schema[keyword], compare))
+
+  for keyword, kinds, compare in (
+    ('minLength', (str,), lambda a, b: a >= b),
+    ('maxLength', (str,), lambda a, b: a <= b),
+    ('minItems', (list, tuple), lambda a, b: a >= b),
+    ('maxItems', (list, tuple), lambda a, b: a <= b),
+  ):
+
+    if keyword in schema:
+
+      checks.append(length_bound(keyword, schema[keyword], kinds, compare))
+
+  if 'items' in schema:
+
+    check_items : Check = compile_schema(schema['items'])
+
+    def items(value : typing.Any) -> str | None:
+
+      if not isinstance(value, (list, tuple)):
+        return None
+
+      for i, element in enumerate(value):
+
+        error : str | None = check_items(element)
+
+        if error is not None:
+          return f'[{i}]: {error}'
+
+      return None
+
+    checks.append(items)
+
+  if 'properties' in schema or 'required' in schema or schema.get('additionalProperties') is False:
+
+    properties : dict[str, Check] = {
+      key: compile_schema(property_schema) for key, property_schema in schema.get('properties', {}).items()
+    }
+
+    required : list[str] = schema.get('required', [])
+
+    additional : bool = not schema.get('additionalProperties') is False
+
+    def properties_check(value : typing.Any) -> str | None:
+
+      if not isinstance(value, dict):
+        return None
+
+      for key in required:
+
+        if not key in value:
+          return f'missing property {key}'
+
+      for key, element in value.items():
+
+        if key in properties:
+
+          error : str | None = properties[key](element)
+
+          if error is not None:
+            return f'{key}: {error}'
+
+        elif not additional:
+
+          return f'unexpected property {key}'
+
+      return None
+
+    checks.append(properties_check)
+
+  if not checks:
+    return lambda value: None
+
+  if len(checks) == 1:
+    return checks[0]
+
+  def check_all(value : typing.Any) -> str | None:
+
+    for check in checks:
+
+      error : str | None = check(value)
+
+      if error is not None:
+        return error
+
+    return None
+
+  return check_all
+
+class WorkerValidator:
+
+  '''
+  Compiled checks of all input and output channels of a worker.
+  '''
+
+  def __init__(self, worker : WorkerWrite) -> None:
+
+    self.worker_id : str = worker['_id']
+
+    self.inputs : dict[str, Check] = {
+      channel: compile_schema(schema) for channel, schema in worker['inputs'].items()
+    }
+
+    self.outputs : dict[str, Check] = {
+      channel: compile_schema(schema) for channel, schema in worker['outputs'].items()
+    }
+
+  def check(self, checks : dict[str, Check], channel : str, data : typing.Any) -> None:
+
+    '''
+    Raises a ValidationError if an element of data does not match the schema of channel.
+    Data that is not a list (e.g. a generator for a streamed upload) is not checked, iterating it would consume it.
+    '''
+
+    if not channel in checks:
+      raise ValidationError(self.worker_id, channel, 'unknown channel')
+
+    if not isinstance(data, (list, tuple)):
+      return
+
+    check : Check = checks[channel]
+
+    for i, element in enumerate(data):
+
+      error : str | None = check(element)
+
+      if error is not None:
+        raise ValidationError(self.worker_id, channel, f'data[{i}]: {error}')
+
+  def check_input(self, inp : PreparedInput) -> None:
+
+    for channel, item in inp.inputs.items():
+      self.check(self.inputs, channel, item['data'])
+
+  def check_output(self, channel : str, item : typing.Any) -> None:
+
+    self.check(self.outputs, channel, item['data'] if 'data' in item else None)
+
+ValidationMode = typing.Literal['off', 'sampled', 'full']
+
+class Validation:
+
+  '''
+  Validates prepared inputs and processor outputs of an InputStream.
+
+  mode: 'full' checks every bundle, 'sampled' checks a sample_rate fraction of the bundles, 'off' none.
+  Invalid inputs are handled like failed bundles, invalid outputs fail their bundle before anything is emitted.
+  Checking inputs loads spilled items (see LazyDataItem).
+  '''
+
+  def __init__(
+    self,
+    mode : ValidationMode = 'full',
+    sample_rate : float = 0.01,
+  ) -> None:
+
+    self.mode : ValidationMode = mode
+    self.sample_rate : float = sample_rate
+
+    # by worker _id: the definition a validator was compiled from and the validator
+    self.__validators : dict[str, tuple[WorkerWrite, WorkerValidator]] = {}
+    self.__lock = threading.Lock()
+    self.__random = random.Random()
+
+  def sample(self) -> bool:
+
+    ''' Whether to validate the next bundle. '''
+
+    if self.mode == 'full':
+      return True
+
+    return self.mode == 'sampled' and self.__random.random() < self.sample_rate
+
+  def validator(self, worker : WorkerWrite) -> WorkerValidator:
+
+    ''' Returns the validator of worker, compiling it if the worker has not been seen (or has changed). '''
+
+    cached = self.__validators.get(worker['_id'])
+
+    if cached is not None and cached[0] is worker:
+      return cached[1]
+
+    validator = WorkerValidator(worker)
+
+    with self.__lock:
+      self.__validators[worker['_id']] = (worker, validator)
+
+    return validator
@@ -0,0 +1,91 @@
+
+import hashlib
+import json
+import os
+import typing
+
+from pplns_types import \
+  Worker, \
+  WorkerWrite
+
+class WorkerCache:
+
+  '''
+  On-disk cache of registered Worker definitions.
+
+  Entries are keyed by a hash of the API endpoint and the WorkerWrite definition,
+  so any change to the definition (or a different API) misses the cache and is registered again.
+  '''
+
+  def __init__(self, directory : str) -> None:
+
+    self.directory : str = directory
+
+  def key(
+    self,
+    endpoint : str,
+    worker : WorkerWrite
+  ) -> str:
+
+    content : str = json.dumps([endpoint, worker], sort_keys=True)
+
+    return hashlib.sha256(content.encode()).hexdigest()
+
+  def __path(self, key : str) -> str:
+
+    return os.path.join(self.directory, key + '.json')
+
+  def get(
+    self,
+    endpoint : str,
+    worker : WorkerWrite
+  ) -> Worker | None:
+
+    '''
+    Returns the cached Worker or None if the definition has not been registered before.
+    '''
+
+    try:
+
+      with open(self.__path(self.key(endpoint, worker))) as f:
+
+        cached : Worker = json.load(f)
+
+        return cached
+
+    except (OSError, ValueError):
+
+      return None
+
+  def put(
+    self,
+    endpoint : str,
+    worker : WorkerWrite,
+    worker_read : Worker
+  ) -> None:
+
+    '''
+    Stores a registered Worker. The file is replaced atomically so concurrent pods never read partial entries.
+    '''
+
+    os.makedirs(self.directory, exist_ok=True)
+
+    path : str = self.__path(self.key(endpoint, worker))
+    tmp_path : str = f'{path}.{os.getpid()}.tmp'
+
+    with open(tmp_path, 'w') as f:
+      json.dump(worker_read, f)
+
+    os.replace(tmp_path, path)
+
+  def clear(self) -> None:
+
+    ''' Removes all cached entries. '''
+
+    if not os.path.isdir(self.directory):
+      return
+
+    for name in os.listdir(self.directory):
+
+      if name.endswith('.json'):
+        os.remove(os.path.join(self.directory, name))
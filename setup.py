@@ -1,9 +1,15 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+from setuptools import setup
 
 setup(
   name='pplns_python',
   version='1.0',
-  py_modules=['api', 'stream', 'processor', 'example_worker'],
-)
\ No newline at end of file
+  packages=['pplns_python'],
+  entry_points={
+    'console_scripts': [
+      'pplns-worker=pplns_python.supervisor:main',
+      'pplns-replay=pplns_python.replay:main',
+    ],
+  },
+)
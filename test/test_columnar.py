@@ -0,0 +1,123 @@
+
+import typing
+
+import pytest
+
+from pplns_python.api import PipelineApi
+
+from pplns_python.processor import \
+  BatchProcessor, \
+  BundleRef, \
+  PreparedInput
+
+from pplns_python.stream import \
+  InputStream, \
+  InputStreamDataCallback
+
+from pplns_python.columnar import \
+  Column, \
+  ColumnarBatch, \
+  split_outputs
+
+def make_input(bundle_id : str, inputs : dict[str, list[typing.Any]]) -> PreparedInput:
+
+  bundle : typing.Any = { '_id': bundle_id, 'taskId': 'task', 'consumerId': 'consumer' }
+
+  return PreparedInput(
+    BundleRef.from_bundle(bundle),
+    { name: { 'data': data } for name, data in inputs.items() },  # type: ignore
+    bundle
+  )
+
+inputs : list[PreparedInput] = [
+  make_input('a', { 'x': [1, 2], 'y': ['p'] }),
+  make_input('b', { 'x': [] }),
+  make_input('c', { 'x': [3, 4, 5], 'y': ['q', 'r'] }),
+]
+
+def test_columnar_batch():
+
+  batch = ColumnarBatch(inputs, use_numpy=False)
+
+  assert list(batch) == ['x', 'y']
+
+  assert batch['x'].values == [1, 2, 3, 4, 5]
+  assert batch['x'].offsets == [0, 2, 2, 5]
+  assert [batch['x'][i] for i in range(len(batch['x']))] == [[1, 2], [], [3, 4, 5]]
+
+  # bundle b has no channel y
+  assert batch['y'].offsets == [0, 1, 1, 3]
+
+  outputs = batch.split_outputs({ 'doubled': [2 * v for v in batch['x'].values] })
+
+  assert [o['doubled']['data'] for o in outputs] == [[2, 4], [], [6, 8, 10]]
+  assert all(o['doubled']['done'] for o in outputs)
+
+def test_columnar_batch_numpy():
+
+  pytest.importorskip('numpy')
+
+  batch = ColumnarBatch(inputs, use_numpy=True)
+
+  outputs = batch.split_outputs({ 'doubled': batch['x'].values * 2 })
+
+  # numpy scalars are converted back to plain values for JSON encoding
+  assert [o['doubled']['data'] for o in outputs] == [[2, 4], [], [6, 8, 10]]
+  assert type(outputs[0]['doubled']['data'][0]) == int
+
+def test_columnar_batch_numpy_ragged():
+
+  numpy = pytest.importorskip('numpy')
+
+  batch = ColumnarBatch(
+    [
+      make_input('a', { 'points': [[1, 2], [3]], 'x': [1.5] }),
+      make_input('b', { 'points': [[4, 5, 6]], 'x': [2] }),
+    ],
+    use_numpy=True
+  )
+
+  # ragged (and other non-numeric) channels stay lists instead of becoming object arrays
+  assert batch['points'].values == [[1, 2], [3], [4, 5, 6]]
+  assert list(batch['points'].offsets) == [0, 2, 3]
+
+  assert isinstance(batch['x'].values, numpy.ndarray)
+  assert batch['x'].values.dtype == numpy.float64
+
+  # string channels stay lists as well
+  assert ColumnarBatch(inputs, use_numpy=True)['y'].values == ['p', 'q', 'r']
+
+def test_split_outputs():
+
+  outputs = split_outputs(
+    {
+      'sum': Column([3, 0, 12], [0, 1, 2, 3]),
+      'values': [1, 2, 3],
+    },
+    [0, 2, 2, 3],
+    done=False
+  )
+
+  assert outputs[0] == { 'sum': { 'data': [3], 'done': False }, 'values': { 'data': [1, 2], 'done': False } }
+  assert outputs[1]['values']['data'] == []
+
+  with pytest.raises(Exception):
+    split_outputs({ 'a': Column([1], [0, 1]), 'b': Column([1, 2], [0, 1, 2]) })
+
+def test_columnar_processor():
+
+  class Processor(BatchProcessor):
+
+    columnar = True
+
+    def __call__(self, batch):
+
+      assert isinstance(batch, ColumnarBatch)
+
+      return batch.split_outputs({ 'out': [v + 1 for v in batch['x'].values] })
+
+  stream = InputStream(PipelineApi('http://example.com/api', ''), {})
+
+  outputs = InputStreamDataCallback(stream, Processor()).run_processor(inputs)
+
+  assert [typing.cast(typing.Any, o)['out']['data'] for o in outputs] == [[2, 3], [], [4, 5, 6]]
@@ -0,0 +1,79 @@
+
+from pplns_python.concurrency import \
+  AIMDLimit, \
+  GradientLimit
+
+from pplns_python.stats import \
+  Stats, \
+  merge_snapshots
+
+def test_aimd_limit():
+
+  limit = AIMDLimit(initial=4, min_limit=2, max_limit=8, latency_target=1.0)
+
+  # fast, fully utilized batches grow the limit
+  for _ in range(20):
+    limit.update(0.1, in_flight=limit.limit)
+
+  assert limit.limit > 4
+
+  grown = limit.limit
+
+  limit.update(2.0, in_flight=limit.limit)
+
+  assert limit.limit < grown
+
+  # failures back off down to min_limit but never below
+  for _ in range(50):
+    limit.update(0.1, in_flight=1, failed=True)
+
+  assert limit.limit == 2
+
+def test_aimd_limit_idle():
+
+  limit = AIMDLimit(initial=4, max_limit=64)
+
+  # a limit that is not used must not grow
+  for _ in range(100):
+    limit.update(0.1, in_flight=1)
+
+  assert limit.limit == 4
+
+def test_gradient_limit():
+
+  limit = GradientLimit(initial=4, max_limit=32)
+
+  for _ in range(50):
+    limit.update(0.1, in_flight=limit.limit)
+
+  assert limit.limit > 4
+
+  grown = limit.limit
+
+  # latency far above the baseline shrinks the limit
+  for _ in range(10):
+    limit.update(1.0, in_flight=limit.limit)
+
+  assert limit.limit < grown
+
+def test_stats():
+
+  stats = Stats()
+
+  stats.incr('bundles', 2)
+  stats.gauge('concurrency_limit', 4)
+  stats.timing('batch', 0.5)
+  stats.timing('batch', 1.5)
+
+  snapshot = stats.snapshot()
+
+  assert snapshot['bundles'] == 2
+  assert snapshot['concurrency_limit'] == 4
+  assert snapshot['batch.count'] == 2
+  assert snapshot['batch.total'] == 2.0
+  assert snapshot['batch.max'] == 1.5
+
+  merged = merge_snapshots([snapshot, snapshot])
+
+  assert merged['bundles'] == 4
+  assert merged['batch.max'] == 1.5
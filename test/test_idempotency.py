@@ -0,0 +1,64 @@
+
+import time
+import typing
+
+from pplns_python.processor import \
+  BundleRef, \
+  PreparedInput
+
+from pplns_python.idempotency import \
+  IdempotencyCache, \
+  SqliteBackend
+
+def make_input(bundle_id : str, item_ids : list[str]) -> PreparedInput:
+
+  bundle : typing.Any = { '_id': bundle_id, 'taskId': 'task', 'consumerId': 'consumer' }
+
+  return PreparedInput(
+    BundleRef.from_bundle(bundle),
+    { f'in{i}': { '_id': item_id } for i, item_id in enumerate(item_ids) },  # type: ignore
+    bundle
+  )
+
+def test_idempotency_key():
+
+  cache = IdempotencyCache()
+
+  assert cache.key(make_input('b', ['x', 'y'])) == cache.key(make_input('b', ['y', 'x']))
+  assert not cache.key(make_input('b', ['x', 'y'])) == cache.key(make_input('b', ['x', 'z']))
+
+def test_idempotency_cache_eviction():
+
+  cache = IdempotencyCache(max_entries=2, ttl=0.05)
+
+  cache.put('a', { 'out': { 'data': [1] } }, 1.0)
+  cache.put('b', { 'out': { 'data': [2] } }, 1.0)
+
+  # touch a so that b is the least recently used entry
+  assert cache.get('a') is not None
+
+  cache.put('c', { 'out': { 'data': [3] } }, 1.0)
+
+  assert cache.get('b') is None
+  assert typing.cast(typing.Any, cache.get('a')).output == { 'out': { 'data': [1] } }
+
+  time.sleep(0.06)
+
+  assert cache.get('a') is None
+
+def test_idempotency_sqlite_backend(tmp_path):
+
+  path = str(tmp_path / 'outputs.db')
+
+  cache = IdempotencyCache(backend=SqliteBackend(path))
+
+  cache.put('a', { 'out': { 'data': [1] } }, 2.5)
+
+  # a new cache (e.g. after a restart) finds the entry in the backend
+  restarted = IdempotencyCache(backend=SqliteBackend(path))
+
+  entry = restarted.get('a')
+
+  assert entry is not None
+  assert entry.output == { 'out': { 'data': [1] } }
+  assert entry.seconds == 2.5
@@ -3,13 +3,60 @@ from urllib.parse import \
   urlparse,\
   parse_qs
 
+import concurrent.futures
+import json
+import threading
+import time
+import types
 import typing
 
+import pytest
+
 from pplns_types import \
   DataItemWrite, \
   BundleQuery
 
-from pplns_python.stream import PreparedInput, prepare_bundle
+from pplns_python.api import BundleList
+
+from pplns_python.stream import \
+  InputStream, \
+  PreparedInput, \
+  Stream, \
+  prepare_bundle, \
+  release_prepared_input
+
+from pplns_python.processor import \
+  BatchProcessor, \
+  BundleRef, \
+  TaskProcessor
+
+from pplns_python.redelivery import \
+  DeadLetterFile, \
+  RedeliveryPolicy
+
+from pplns_python.validation import Validation
+
+from pplns_python.lifecycle import TaskStates
+
+from pplns_python.idempotency import IdempotencyCache
+
+from pplns_python.tracing import Tracer
+
+from pplns_python.concurrency import \
+  AIMDLimit, \
+  GradientLimit
+
+from pplns_python.lazy_item import LazyDataItem
+
+from pplns_python.item_cache import \
+  ItemCache, \
+  item_size
+
+from pplns_python.deferred import DeferredHandler
+
+from pplns_python.scheduling import \
+  BundleQueue, \
+  resolve_priority
 
 from pplns_python.testing_utils import \
   TestPipelineApi as PipelineApi
@@ -350,3 +397,1074 @@ def test_emit_returned_items():
 
   assert len(bundles) == 1
   assert bundles[0]['items'][0]['data'][0] == 'processed: example data'
+
+def test_prepare_bundle_spill():
+
+  bundle : typing.Any  = \
+  {
+    '_id': 'something',
+    'taskId': 'some_task_id',
+    'consumerId': 'some_consumer_id',
+    'inputItems': 
+    [
+      { 'position': 0, 'inputChannel': 'small', 'itemId': 'small' },
+      { 'position': 1, 'inputChannel': 'large', 'itemId': 'large' },
+    ],
+    'items': 
+    [
+      { '_id': 'small', 'data': [1] },
+      { '_id': 'large', 'data': list(range(1000)) },
+    ]
+  }
+
+  worker : typing.Any = { '_id': 'mock-worker', 'inputs': { 'small': {}, 'large': {} } }
+
+  prepared: PreparedInput = prepare_bundle(worker, bundle, spill_threshold=100)
+
+  small = typing.cast(LazyDataItem, prepared['inputs']['small'])
+  large = typing.cast(LazyDataItem, prepared['inputs']['large'])
+
+  assert not small.spilled
+  assert large.spilled
+
+  assert 'items' not in prepared['bundle']
+
+  assert large['_id'] == 'large'
+  assert large['data'] == list(range(1000))
+  assert dict(small) == { '_id': 'small', 'data': [1] }
+
+  release_prepared_input(prepared)
+
+  assert not large.spilled
+
+def test_prepare_bundle_item_cache():
+
+  def make_bundle(bundle_id : str, item_ids : list[str]) -> typing.Any:
+
+    return {
+      '_id': bundle_id,
+      'taskId': 'task',
+      'consumerId': 'consumer',
+      'inputItems': [
+        { 'position': i, 'inputChannel': f'in{i}', 'itemId': item_id } for i, item_id in enumerate(item_ids)
+      ],
+      'items': [{ '_id': item_id, 'data': [item_id] * 10 } for item_id in item_ids],
+    }
+
+  worker : typing.Any = { '_id': 'mock-worker', 'inputs': { 'in0': {}, 'in1': {} } }
+
+  # room for two items
+  cache = ItemCache(max_bytes=2 * item_size({ 'data': ['a'] * 10 }))
+
+  first = prepare_bundle(worker, make_bundle('b1', ['a', 'b']), item_cache=cache)
+  second = prepare_bundle(worker, make_bundle('b2', ['a', 'c']), item_cache=cache)
+
+  # the join partner a is shared, b is evicted to make room for c
+  assert first.inputs['in0'] is second.inputs['in0']
+  assert cache.get('b') is None
+  assert len(cache) == 2
+  assert cache.stats.get('hits') == 1
+  assert cache.stats.get('evictions') == 1
+
+  assert 'items' not in first.bundle
+  assert second.inputs['in1']['data'] == ['c'] * 10
+
+  # shared items are read-only
+  with pytest.raises(TypeError):
+    first.inputs['in0']['data'] = []  # type: ignore
+
+def test_prepared_input_record():
+
+  bundle : typing.Any = \
+  {
+    '_id': 'bundle',
+    'taskId': 'task',
+    'consumerId': 'consumer',
+    'consumptionId': 'consumption',
+  }
+
+  inp = PreparedInput(BundleRef.from_bundle(bundle), { 'in': { '_id': 'item' } }, bundle)
+
+  assert inp.ref.consumption_id == 'consumption'
+  assert inp['_id'] == 'bundle'
+  assert inp['taskId'] == 'task'
+  assert inp['inputs']['in']['_id'] == 'item'
+  assert dict(inp) == inp.as_dict()
+
+  try:
+    inp.inputs = {}  # type: ignore
+    assert False, 'PreparedInput should be immutable'
+  except AttributeError:
+    pass
+
+def test_stream_deferred_handlers():
+
+  stream = Stream()
+
+  release = threading.Event()
+  received : list[int] = []
+
+  def slow_handler(i : int):
+
+    release.wait()
+    received.append(i)
+
+  async def async_handler(i : int):
+
+    received.append(-i)
+
+  with concurrent.futures.ThreadPoolExecutor(1) as executor:
+
+    stream.on('slow', slow_handler, executor=executor, max_queue=2, overflow='drop_newest')
+    stream.on('async', async_handler)
+
+    # the emitting thread is never blocked by the slow handler
+    for i in range(5):
+      stream.emit('slow', i)
+
+    handler = stream.handlers['slow'][0]
+
+    assert isinstance(handler, DeferredHandler)
+
+    # the first call may or may not have been picked up by the executor yet
+    assert handler.dropped in (2, 3)
+
+    stream.emit('async', 1)
+
+    release.set()
+
+    assert stream.flush(timeout=5)
+
+  assert [i for i in received if i >= 0] in ([0, 1, 2], [0, 1])
+  assert -1 in received
+
+def test_stream_deferred_handler_errors():
+
+  stream = Stream()
+
+  def failing_handler(e : Exception):
+
+    raise ValueError('handler failed')
+
+  errors : list[Exception] = []
+
+  with concurrent.futures.ThreadPoolExecutor(1) as executor:
+
+    # a deferred 'error' handler cannot report its errors as 'error' events, they go to on_error
+    stream.on('error', failing_handler, executor=executor, on_error=errors.append)
+    stream.on('other', failing_handler, executor=executor)
+
+    stream.emit('error', Exception('error'))
+    stream.emit('other', Exception('other'))
+
+    # the 'other' handler may queue its error after the 'error' handler has been joined
+    assert stream.flush(timeout=5)
+    assert stream.flush(timeout=5)
+
+  handler = stream.handlers['error'][0]
+
+  assert isinstance(handler, DeferredHandler)
+
+  # the error of the 'other' handler is emitted as 'error' and fails the 'error' handler again
+  assert [str(e) for e in errors] == ['handler failed', 'handler failed']
+  assert handler.errors == 2
+
+def make_prepared_input(bundle_id : str, task_id : str = 'task') -> PreparedInput:
+
+  bundle : typing.Any = { '_id': bundle_id, 'taskId': task_id, 'consumerId': 'consumer' }
+
+  return PreparedInput(BundleRef.from_bundle(bundle), {}, bundle)
+
+def test_bundle_queue_priorities():
+
+  queue = BundleQueue()
+
+  queue.push(make_prepared_input('backfill-0'), priority=0)
+  queue.push(make_prepared_input('interactive'), priority=10)
+  queue.push(make_prepared_input('backfill-1'), priority=0)
+
+  assert [inp.ref.bundle_id for inp in queue.pop_many(3)] == \
+    ['interactive', 'backfill-0', 'backfill-1']
+
+  assert queue.pop() is None
+
+def test_bundle_queue_aging():
+
+  queue = BundleQueue(aging=1000)
+
+  queue.push(make_prepared_input('old'), priority=0)
+
+  time.sleep(0.02)
+
+  # 20ms of waiting are worth ~20 priority points with aging=1000
+  queue.push(make_prepared_input('new'), priority=10)
+
+  assert typing.cast(PreparedInput, queue.pop()).ref.bundle_id == 'old'
+
+def test_resolve_priority():
+
+  inp = make_prepared_input('bundle', task_id='interactive-task')
+
+  assert resolve_priority(inp, 1, None) == 1
+  assert resolve_priority(inp, 1, { 'interactive-task': 5 }) == 5
+  assert resolve_priority(inp, 1, { 'other-task': 5 }) == 1
+
+def test_priority_dispatch():
+
+  api = FakeApi(['backfill-0', 'backfill-1'])
+  api.add(['interactive'], 'interactive-task')
+
+  stream = InputStream(api, {}, polling_time=-1, task_priorities={ 'interactive-task': 10 })  # type: ignore
+
+  # without a data callback the bundles stay queued
+  stream.poll()
+
+  processed : list[str] = []
+
+  stream.on_data(lambda inp: processed.append(inp.ref.bundle_id))
+
+  stream.dispatch()
+
+  # the bundle of the prioritized task was consumed last but is dispatched first
+  assert processed == ['interactive', 'backfill-0', 'backfill-1']
+
+@pytest.mark.parametrize('limit', [
+  AIMDLimit(initial=1, max_limit=8, backoff=0.5),
+  GradientLimit(initial=1, max_limit=8),
+])
+def test_concurrency_limit(limit):
+
+  api = FakeApi([f'a{i}' for i in range(8)])
+
+  stream = InputStream(api, {}, polling_time=-1, concurrency_limit=limit)  # type: ignore
+
+  stream.on('error', lambda e: None)
+
+  def processor(inp):
+
+    if inp.ref.bundle_id.startswith('bad'):
+      raise Exception('failed')
+
+  stream.on_data(processor)
+
+  # running inline, one batch is in flight at a time: the limit grows to 2 and stops there
+  stream.poll()
+
+  assert limit.limit == 2
+  assert stream.active_callbacks.max == limit.limit
+  assert stream.stats.get('concurrency_limit') == 2
+
+  # failed batches shrink the limit down to min_limit
+  api.add(['bad-0', 'bad-1'])
+
+  stream.poll()
+
+  assert limit.limit == 1
+  assert stream.active_callbacks.max == 1
+
+class FakeApi:
+
+  '''
+  Hands out the given bundles on the first consume and records unconsumed bundles and emitted items.
+  '''
+
+  def __init__(self, bundle_ids : list[str]):
+
+    self.bundles : list[typing.Any] = []
+
+    self.polls : int = 0
+    self.unconsumed : list[str] = []
+    self.unconsume_requests : int = 0
+    self.emitted : list[typing.Any] = []
+
+    self.add(bundle_ids)
+
+  def add(self, bundle_ids : list[str], task_id : str = 'task'):
+
+    self.bundles += [self.bundle(bundle_id, task_id) for bundle_id in bundle_ids]
+
+  def bundle(self, bundle_id : str, task_id : str = 'task') -> typing.Any:
+
+    return {
+      '_id': bundle_id,
+      'taskId': task_id,
+      'consumerId': 'node',
+      'consumptionId': 'consumption-' + bundle_id,
+      'inputItems': [{ 'position': 0, 'inputChannel': 'in', 'itemId': bundle_id }],
+      'items': [{ '_id': bundle_id, 'data': [bundle_id] }],
+    }
+
+  def consume(self, query):
+
+    self.polls += 1
+
+    bundles, self.bundles = self.bundles, []
+
+    return bundles
+
+  def unconsume(self, task_id, bundle_id, consumption_id):
+
+    self.unconsumed.append(bundle_id)
+
+    # the bundle can be consumed again
+    self.bundles.append(self.bundle(bundle_id))
+
+  def unconsume_many(self, bundles):
+
+    self.unconsume_requests += 1
+
+    for task_id, bundle_id, consumption_id in bundles:
+      self.unconsume(task_id, bundle_id, consumption_id)
+
+  def emit_item(self, query, item):
+
+    self.emitted.append(item)
+
+  def get_registered_worker(self, worker_id):
+
+    return { '_id': 'worker', 'inputs': { 'in': {} } }
+
+  def get_task(self, task_id):
+
+    return { '_id': task_id, 'params': { 'scale': len(task_id) } }
+
+def test_deadline_queued():
+
+  api = FakeApi(['a', 'b'])
+
+  stream = InputStream(api, {}, polling_time=-1, deadline=0.05)  # type: ignore
+
+  # without a data callback, the bundles stay queued until they expire
+  stream.poll()
+
+  time.sleep(0.06)
+
+  stream.on_data(lambda inp: { 'out': { 'data': inp['inputs']['in']['data'] } })
+
+  stream.dispatch()
+
+  assert sorted(api.unconsumed) == ['a', 'b']
+  assert api.emitted == []
+  assert stream.stats.get('deadline.expired') == 2
+
+def test_deadline_abandoned():
+
+  api = FakeApi(['slow', 'fast'])
+
+  executor = concurrent.futures.ThreadPoolExecutor(2)
+
+  stream = InputStream(api, {}, max_concurrency=2, polling_time=-1, executor=executor, deadline=0.1)  # type: ignore
+
+  def processor(inp):
+
+    if inp.ref.bundle_id == 'slow':
+      time.sleep(0.3)
+
+    return { 'out': { 'data': inp['inputs']['in']['data'] } }
+
+  stream.on_data(processor)
+
+  stream.poll()
+
+  time.sleep(0.15)
+
+  # the slow bundle is handed back while its processor is still running
+  stream.abandon_expired()
+
+  assert api.unconsumed == ['slow']
+
+  executor.shutdown(wait=True)
+
+  # its late output is discarded
+  assert [item['data'] for item in api.emitted] == [['fast']]
+  assert stream.stats.get('deadline.abandoned') == 1
+
+def test_inflight_bytes_budget():
+
+  api = FakeApi(['a', 'b'])
+
+  # each payload ('["a"]') takes 5 bytes
+  stream = InputStream(api, {}, max_concurrency=4, polling_time=-1, max_inflight_bytes=8)  # type: ignore
+
+  stream.poll()
+
+  assert stream.inflight_bytes == 10
+  assert stream.stats.snapshot()['inflight_bytes'] == 10
+
+  api.add(['c'])
+
+  # over budget, nothing is consumed until outputs have been emitted
+  stream.poll()
+
+  assert api.polls == 1
+  assert stream.stats.get('polls.over_budget') == 1
+
+  stream.on_data(lambda inp: { 'out': { 'data': inp['inputs']['in']['data'] } })
+
+  stream.dispatch()
+
+  assert len(api.emitted) == 2
+  assert stream.inflight_bytes == 0
+
+  stream.poll()
+
+  assert api.polls == 2
+  assert [item['data'] for item in api.emitted] == [['a'], ['b'], ['c']]
+  assert stream.inflight_bytes == 0
+
+def test_inflight_bytes_estimate(monkeypatch):
+
+  class SizedApi(FakeApi):
+
+    def consume(self, query):
+
+      bundles = BundleList(super().consume(query))
+      bundles.nbytes = 300
+
+      return bundles
+
+  # plain items: the response is split between the bundles
+  stream = InputStream(SizedApi(['a', 'b']), {}, max_concurrency=4, polling_time=-1, max_inflight_bytes=1000)  # type: ignore
+
+  stream.poll()
+
+  assert stream.inflight_bytes == 300
+
+  encoded = []
+
+  dumps = json.dumps
+
+  monkeypatch.setattr(json, 'dumps', lambda value, *args, **kwargs: encoded.append(value) or dumps(value, *args, **kwargs))
+
+  # lazy items: a response far below spill_threshold spares the spill check, the payloads are not encoded at all
+  stream = InputStream(
+    SizedApi(['a', 'b']), {}, max_concurrency=4, polling_time=-1, max_inflight_bytes=1000, spill_threshold=1 << 20  # type: ignore
+  )
+
+  stream.poll()
+
+  assert stream.inflight_bytes == 300
+  assert encoded == []
+
+  # a response that might hold a payload above spill_threshold: each payload is encoded once for the spill check
+  stream = InputStream(
+    SizedApi(['a', 'b']), {}, max_concurrency=4, polling_time=-1, max_inflight_bytes=1000, spill_threshold=1000  # type: ignore
+  )
+
+  stream.poll()
+
+  inputs = [typing.cast(LazyDataItem, inp.inputs['in']) for inp in stream.queue.pop_many(2)]
+
+  # the size of that encoding is reused
+  assert [item.encoded_size for item in inputs] == [5, 5]
+  assert encoded == [['a'], ['b']]
+
+def test_narrow_batch_failures():
+
+  api = FakeApi(['a', 'b', 'bad', 'c', 'd'])
+
+  class Processor(BatchProcessor):
+
+    max_batch_size = 5
+
+    def __call__(self, inputs):
+
+      if any(inp.ref.bundle_id == 'bad' for inp in inputs):
+        raise Exception('Poisoned batch.')
+
+      return [{ 'out': { 'data': inp['inputs']['in']['data'] } } for inp in inputs]
+
+  # by default the whole batch is handed back
+  stream = InputStream(api, {}, polling_time=-1)  # type: ignore
+
+  stream.on_data(Processor())
+
+  stream.poll()
+
+  assert api.emitted == []
+  assert sorted(api.unconsumed) == ['a', 'b', 'bad', 'c', 'd']
+  assert stream.stats.get('bisections') == 0
+
+  api = FakeApi(['a', 'b', 'bad', 'c', 'd'])
+
+  stream = InputStream(api, {}, polling_time=-1, narrow_failures=True)  # type: ignore
+
+  errors : list[Exception] = []
+
+  stream.on('error', lambda e: errors.append(e))
+
+  stream.on_data(Processor())
+
+  stream.poll()
+
+  # only the failing bundle is handed back, the outputs of the others are emitted
+  assert sorted(item['data'][0] for item in api.emitted) == ['a', 'b', 'c', 'd']
+  assert api.unconsumed == ['bad']
+  assert len(errors) == 1
+  assert stream.stats.get('errors') == 1
+  assert stream.stats.get('bisections') > 0
+
+def test_redelivery_and_quarantine(tmp_path):
+
+  api = FakeApi(['poison'])
+
+  path = str(tmp_path / 'dead-letters.jsonl')
+
+  stream = InputStream(
+    api,  # type: ignore
+    {},
+    polling_time=-1,
+    redelivery=RedeliveryPolicy(max_attempts=2, base_delay=0.05, on_quarantine=DeadLetterFile(path)),
+  )
+
+  quarantined : list[str] = []
+
+  stream.on('error', lambda e: None)
+  stream.on('quarantine', lambda inp, e: quarantined.append(inp.ref.bundle_id))
+
+  stream.on_data(ErrorProcessor())
+
+  stream.poll()
+
+  # the first failure holds the bundle back for base_delay
+  assert api.unconsumed == []
+
+  time.sleep(0.06)
+
+  stream.poll()
+
+  assert api.unconsumed == ['poison']
+
+  # the redelivered bundle fails a second time and is quarantined instead of unconsumed
+  stream.poll()
+
+  assert api.unconsumed == ['poison']
+  assert quarantined == ['poison']
+  assert stream.stats.get('quarantined') == 1
+
+  with open(path) as f:
+    assert json.loads(f.readline())['attempts'] == 2
+
+def test_redelivery_unconsume_failure():
+
+  class FlakyUnconsumeApi(FakeApi):
+
+    def unconsume_many(self, bundles):
+
+      self.unconsume_requests += 1
+
+      if self.unconsume_requests == 1:
+        raise Exception('unconsume failed')
+
+      super().unconsume_many(bundles)
+
+  api = FlakyUnconsumeApi(['a'])
+
+  stream = InputStream(api, {}, polling_time=-1, redelivery=RedeliveryPolicy(base_delay=0))  # type: ignore
+
+  stream.on('error', lambda e: None)
+
+  stream.on_data(ErrorProcessor())
+
+  stream.poll()
+
+  with pytest.raises(Exception):
+    stream.redeliver_due()
+
+  # the bundle is kept for the next attempt instead of being lost
+  stream.redeliver_due()
+
+  assert api.unconsumed == ['a']
+
+class ScalingProcessor(TaskProcessor):
+
+  max_tasks = 1
+
+  def __init__(self):
+
+    self.events : list[tuple[str, typing.Any]] = []
+
+  def setup(self):
+
+    self.events.append(('setup', None))
+
+  def teardown(self):
+
+    self.events.append(('teardown', None))
+
+  def setup_task(self, task_id, params):
+
+    self.events.append(('setup_task', task_id))
+
+    return params['scale']
+
+  def teardown_task(self, task_id, state):
+
+    self.events.append(('teardown_task', task_id))
+
+  def process(self, inp, state):
+
+    return { 'out': { 'data': [state], 'done': True } }
+
+def test_task_processor():
+
+  api = FakeApi(['a1', 'a2'])
+
+  processor = ScalingProcessor()
+
+  stream = InputStream(api, {}, polling_time=-1)  # type: ignore
+
+  stream.on_data(processor)
+
+  # the worker-level setup runs as soon as the processor is set
+  assert processor.events == [('setup', None)]
+
+  stream.poll()
+
+  # the task state is set up once for both bundles of the task
+  assert processor.events[1:] == [('setup_task', 'task')]
+  assert [item['data'] for item in api.emitted] == [[4], [4]]
+
+  # max_tasks = 1: the state of 'task' is torn down before the state of 'other-task' is set up
+  api.add(['b'], 'other-task')
+
+  stream.poll()
+
+  assert processor.events[2:] == [('teardown_task', 'task'), ('setup_task', 'other-task')]
+  assert api.emitted[-1]['data'] == [10]
+  assert stream.stats.get('task_states.evictions') == 1
+
+  stream.close()
+
+  assert processor.events[4:] == [('teardown_task', 'other-task'), ('teardown', None)]
+
+def test_task_processor_warm_up():
+
+  api = FakeApi(['a'])
+
+  processor = ScalingProcessor()
+
+  executor = concurrent.futures.ThreadPoolExecutor(2)
+
+  stream = InputStream(api, {}, polling_time=-1, executor=executor)  # type: ignore
+
+  # without a data callback the bundle stays queued, the task state is set up regardless
+  stream.set_task_processor(processor)
+
+  stream.poll()
+
+  executor.shutdown(wait=True)
+
+  assert processor.events == [('setup', None), ('setup_task', 'task')]
+  assert stream.stats.get('task_states.evictions') == 0
+
+def test_task_processor_teardown_after_last_batch():
+
+  class SlowProcessor(ScalingProcessor):
+
+    def __init__(self):
+
+      super().__init__()
+
+      self.started = threading.Event()
+      self.gate = threading.Event()
+
+    def process(self, inp, state):
+
+      self.started.set()
+      self.gate.wait(5)
+
+      self.events.append(('process', inp.ref.bundle_id))
+
+      return super().process(inp, state)
+
+  api = FakeApi(['a'])
+
+  processor = SlowProcessor()
+
+  executor = concurrent.futures.ThreadPoolExecutor(1)
+
+  stream = InputStream(api, {}, polling_time=-1, executor=executor)  # type: ignore
+
+  stream.on_data(processor)
+
+  stream.poll()
+
+  assert processor.started.wait(5)
+
+  # closing while the bundle is processed defers the teardown
+  stream.close()
+
+  assert not ('teardown', None) in processor.events
+
+  processor.gate.set()
+
+  executor.shutdown(wait=True)
+
+  assert processor.events[-3:] == [('process', 'a'), ('teardown_task', 'task'), ('teardown', None)]
+  assert processor.events.count(('teardown', None)) == 1
+
+def test_task_states_teardown():
+
+  class FailingProcessor(ScalingProcessor):
+
+    def teardown_task(self, task_id, state):
+
+      super().teardown_task(task_id, state)
+
+      raise ValueError(task_id)
+
+  processor = FailingProcessor()
+
+  errors : list[Exception] = []
+
+  task_states = TaskStates(processor, lambda task_id: { 'scale': 1 }, on_error=errors.append)
+
+  # without an executor the state is set up right away
+  task_states.warm('task')
+
+  assert processor.events == [('setup_task', 'task')]
+
+  with task_states.use('task'):
+
+    # evicts 'task' while it is in use, it is torn down once, by the last user
+    with task_states.use('other-task'):
+      assert not ('teardown_task', 'task') in processor.events
+
+    assert not ('teardown_task', 'task') in processor.events
+
+  task_states.close()
+
+  # states are not set up anymore after close
+  task_states.warm('task')
+
+  assert processor.events == [
+    ('setup_task', 'task'),
+    ('setup_task', 'other-task'),
+    ('teardown_task', 'task'),
+    ('teardown_task', 'other-task'),
+  ]
+
+  # errors of teardown_task are reported instead of printed
+  assert [str(e) for e in errors] == ['task', 'other-task']
+  assert task_states.stats.get('task_states.teardown_errors') == 2
+
+class FlakyEmitApi(FakeApi):
+
+  ''' Fails the first emit. '''
+
+  def emit_item(self, query, item):
+
+    if not self.unconsumed:
+      raise Exception('emit failed')
+
+    super().emit_item(query, item)
+
+def test_idempotency_redelivery():
+
+  api = FlakyEmitApi(['a'])
+
+  stream = InputStream(api, {}, polling_time=-1, idempotency=IdempotencyCache())  # type: ignore
+
+  processed : list[str] = []
+
+  stream.on('error', lambda e: None)
+
+  stream.on_data(lambda inp: processed.append(inp.ref.bundle_id) or { 'out': { 'data': [1], 'done': True } })
+
+  # the output is cached, emitting it fails and the bundle is unconsumed
+  stream.poll()
+
+  assert api.unconsumed == ['a']
+  assert api.emitted == []
+
+  # the redelivered bundle is not processed again, the cached output is emitted instead
+  stream.poll()
+
+  assert processed == ['a']
+  assert [item['data'] for item in api.emitted] == [[1]]
+  assert stream.stats.get('idempotency.hits') == 1
+
+  stream.close()
+
+class TypedApi(FakeApi):
+
+  def get_registered_worker(self, worker_id):
+
+    return { '_id': 'worker', 'inputs': { 'in': { 'type': 'string' } }, 'outputs': { 'out': { 'type': 'number' } } }
+
+def test_validation():
+
+  api = TypedApi(['a', 'b'])
+
+  # bundle 'b' carries a number on its string channel
+  api.bundles[1]['items'][0]['data'] = [1]
+
+  stream = InputStream(api, {}, polling_time=-1, validation=Validation('full'))  # type: ignore
+
+  errors : list[Exception] = []
+
+  stream.on('error', errors.append)
+
+  stream.on_data(lambda inp: { 'out': { 'data': [len(inp.inputs['in']['data'][0])] } })
+
+  stream.poll()
+
+  # the invalid input is unconsumed without being processed
+  assert api.unconsumed == ['b']
+  assert [item['data'] for item in api.emitted] == [[1]]
+  assert stream.stats.get('validation.invalid_inputs') == 1
+
+  stream.close()
+
+  api = TypedApi(['c'])
+
+  stream = InputStream(api, {}, polling_time=-1, validation=Validation('full'))  # type: ignore
+
+  stream.on('error', errors.append)
+
+  # invalid outputs fail the bundle before anything is emitted
+  stream.on_data(lambda inp: { 'out': { 'data': ['not a number'] } })
+
+  stream.poll()
+
+  assert api.emitted == []
+  assert api.unconsumed == ['c']
+  assert stream.stats.get('validation.invalid_outputs') == 1
+  assert 'expected number' in str(errors[-1])
+
+class GatedProcessor:
+
+  '''
+  Processes each bundle once its gate is opened, fails the bundles in fail.
+  '''
+
+  def __init__(self, bundle_ids : list[str], fail : list[str] = []):
+
+    self.gates : dict[str, threading.Event] = { bundle_id: threading.Event() for bundle_id in bundle_ids }
+    self.fail : list[str] = fail
+
+  def __call__(self, inp):
+
+    bundle_id : str = inp.ref.bundle_id
+
+    self.gates[bundle_id].wait(5)
+
+    if bundle_id in self.fail:
+      raise Exception(f'{bundle_id} failed')
+
+    return { 'out': { 'data': [bundle_id] } }
+
+  def open(self, *bundle_ids : str):
+
+    for bundle_id in bundle_ids:
+
+      self.gates[bundle_id].set()
+
+      # let the bundle complete before opening the next gate
+      time.sleep(0.05)
+
+def run_gated(ordering, bundle_ids, order, fail = [], **stream_args):
+
+  api = FakeApi(bundle_ids)
+
+  processor = GatedProcessor(bundle_ids, fail)
+
+  executor = concurrent.futures.ThreadPoolExecutor(len(bundle_ids))
+
+  stream = InputStream(
+    api,  # type: ignore
+    {},
+    polling_time=-1,
+    max_concurrency=len(bundle_ids),
+    executor=executor,
+    ordering=ordering,
+    **stream_args
+  )
+
+  stream.on('error', lambda e: None)
+
+  stream.on_data(processor)
+
+  stream.poll()
+
+  processor.open(*order)
+
+  executor.shutdown(wait=True)
+
+  return stream, api, [item['data'][0] for item in api.emitted]
+
+@pytest.mark.parametrize(
+  'ordering, emitted',
+  [
+    ('unordered', ['c', 'b', 'a']),
+    ('task', ['a', 'b', 'c']),
+  ]
+)
+def test_ordering(ordering, emitted):
+
+  stream, _, result = run_gated(ordering, ['a', 'b', 'c'], ['c', 'b', 'a'])
+
+  assert result == emitted
+
+  if ordering == 'task':
+
+    # b and c were held back until a completed
+    assert stream.stats.snapshot()['reorder.hold.count'] == 2
+    assert stream.reorder is not None and len(stream.reorder) == 0 and stream.reorder.held == 0
+
+  else:
+
+    assert stream.reorder is None
+
+def test_ordering_failure():
+
+  # a fails after b completed, b does not wait for the redelivery of a
+  stream, api, result = run_gated('task', ['a', 'b'], ['b', 'a'], fail=['a'])
+
+  assert result == ['b']
+  assert api.unconsumed == ['a']
+
+def test_ordering_traces():
+
+  traces : list[typing.Any] = []
+
+  # traces are recorded as exported, spans added after the export would be lost
+  exporter : typing.Any = types.SimpleNamespace(export=lambda trace: traces.append(trace.as_dict()))
+
+  # b is held back until a completed, its trace is finished when its output is emitted
+  run_gated('task', ['a', 'b'], ['b', 'a'], tracer=Tracer(exporter, sample_rate=1))
+
+  assert sorted(trace['bundleId'] for trace in traces) == ['a', 'b']
+
+  for trace in traces:
+
+    assert trace['status'] == 'ok'
+    assert 'emit_item' in [s['name'] for s in trace['spans']]
+
+def test_ordering_consumer_keys():
+
+  api = FakeApi(['a'])
+  api.add(['b'], 'other-task')
+
+  processor = GatedProcessor(['a', 'b'])
+
+  executor = concurrent.futures.ThreadPoolExecutor(2)
+
+  stream = InputStream(api, {}, polling_time=-1, max_concurrency=2, executor=executor)  # type: ignore
+
+  # only the added query is ordered, per consumer: bundles of different tasks do not wait for each other
+  stream.queries = []
+  stream.add_query({}, ordering='consumer')
+
+  stream.on_data(processor)
+
+  stream.poll()
+
+  processor.open('b', 'a')
+
+  executor.shutdown(wait=True)
+
+  assert [item['data'][0] for item in api.emitted] == ['b', 'a']
+
+def test_ordering_bounded():
+
+  api = FakeApi(['a', 'b'])
+
+  processor = GatedProcessor(['a', 'b', 'c'])
+
+  executor = concurrent.futures.ThreadPoolExecutor(2)
+
+  stream = InputStream(
+    api,  # type: ignore
+    {},
+    polling_time=-1,
+    max_concurrency=2,
+    executor=executor,
+    ordering='task',
+    max_held_outputs=1,
+  )
+
+  stream.on_data(processor)
+
+  stream.poll()
+
+  processor.open('b')
+
+  # b is held back behind a, the stream does not consume more while the buffer is full
+  api.add(['c'])
+
+  stream.poll()
+
+  assert stream.stats.get('polls.reorder_full') == 1
+  assert api.polls == 1
+
+  processor.open('a')
+
+  stream.poll()
+
+  processor.open('c')
+
+  executor.shutdown(wait=True)
+
+  assert [item['data'][0] for item in api.emitted] == ['a', 'b', 'c']
+
+class FlakyApi(FakeApi):
+
+  ''' Fails to emit and to unconsume the bundles in flaky. '''
+
+  def __init__(self, bundle_ids : list[str], flaky : list[str]):
+
+    FakeApi.__init__(self, bundle_ids)
+
+    self.flaky : list[str] = flaky
+
+  def emit_item(self, query, item):
+
+    if item['data'][0] in self.flaky:
+      raise Exception('emit failed')
+
+    FakeApi.emit_item(self, query, item)
+
+  def unconsume(self, task_id, bundle_id, consumption_id):
+
+    if bundle_id in self.flaky:
+      raise Exception('unconsume failed')
+
+    FakeApi.unconsume(self, task_id, bundle_id, consumption_id)
+
+def test_ordering_emit_and_unconsume_failure():
+
+  bundle_ids = ['a', 'b', 'c', 'd']
+
+  api = FlakyApi(bundle_ids, ['b'])
+
+  processor = GatedProcessor(bundle_ids)
+
+  executor = concurrent.futures.ThreadPoolExecutor(len(bundle_ids))
+
+  stream = InputStream(
+    api,  # type: ignore
+    {},
+    polling_time=-1,
+    max_concurrency=len(bundle_ids),
+    executor=executor,
+    ordering='task',
+  )
+
+  errors : list[Exception] = []
+
+  stream.on('error', errors.append)
+
+  stream.on_data(processor)
+
+  stream.poll()
+
+  # b is held behind a and released by a's batch, its emit and its unconsume fail
+  processor.open('b', 'a', 'c', 'd')
+
+  executor.shutdown(wait=True)
+
+  assert [item['data'][0] for item in api.emitted] == ['a', 'c', 'd']
+  assert [str(e) for e in errors] == ['emit failed', 'unconsume failed']
+  assert stream.reorder is not None and stream.reorder.held == 0 and len(stream.reorder) == 0
@@ -0,0 +1,84 @@
+
+import json
+
+import pytest
+
+from pplns_python.json_stream import \
+  JsonArrayReader, \
+  iter_json_encode
+
+def chunked(document : str, size : int) -> list[bytes]:
+
+  encoded = document.encode()
+
+  return [encoded[i:i + size] for i in range(0, len(encoded), size)]
+
+def test_json_array_reader():
+
+  results = [
+    { '_id': 'a', 'data': [1, 2.5, 'ü', None, True] },
+    12345,
+    'text with "quotes" and , ] }',
+    [],
+  ]
+
+  document = json.dumps({ 'count': 4, 'results': results, 'next': { 'offset': 4 } })
+
+  # every chunk size, including splits inside numbers and multi-byte characters
+  for size in (1, 2, 3, 7, 64, len(document)):
+    assert list(JsonArrayReader(chunked(document, size))) == results
+
+def test_json_array_reader_empty():
+
+  assert list(JsonArrayReader(chunked('{ "results": [] }', 1))) == []
+  assert list(JsonArrayReader(chunked('{}', 1))) == []
+  assert list(JsonArrayReader(chunked('{"other": [1, 2]}', 1))) == []
+
+def test_json_array_reader_large_element():
+
+  bundle = { '_id': 'large', 'items': [{ 'data': ['x' * 1000] * 6000 }] }
+
+  document = json.dumps({ 'results': [bundle, 1] })
+
+  reader = JsonArrayReader(chunked(document, 1 << 16))
+
+  decoder = json.JSONDecoder()
+
+  attempts : list[int] = []
+
+  def raw_decode(buffer, pos):
+
+    attempts.append(len(buffer) - pos)
+
+    return decoder.raw_decode(buffer, pos)
+
+  reader._JsonArrayReader__json.raw_decode = raw_decode  # type: ignore
+
+  assert list(reader) == [bundle, 1]
+
+  # the 6 MB element spans ~90 chunks but is only decoded again each time its buffered part has doubled
+  assert len(attempts) < 20
+
+def test_json_array_reader_truncated():
+
+  with pytest.raises(Exception):
+    list(JsonArrayReader(chunked('{ "results": [1, 2', 1)))
+
+def test_iter_json_encode():
+
+  item = { 'outputChannel': 'out', 'done': True, 'data': ({ 'i': i, 's': 'ü' * i } for i in range(100)) }
+
+  chunks = list(iter_json_encode(item, chunk_size=64))
+
+  # the generator is encoded incrementally, in roughly chunk_size pieces
+  assert len(chunks) > 10
+  assert json.loads(b''.join(chunks)) == {
+    'outputChannel': 'out',
+    'done': True,
+    'data': [{ 'i': i, 's': 'ü' * i } for i in range(100)],
+  }
+
+  assert json.loads(b''.join(iter_json_encode({ 'data': iter([]) }))) == { 'data': [] }
+
+  # round trip through the incremental reader
+  assert list(JsonArrayReader(iter_json_encode({ 'results': range(1000) }, 'results', 16))) == list(range(1000))
@@ -0,0 +1,172 @@
+
+import http.server
+import queue
+import threading
+import time
+import typing
+
+import pytest
+
+from pplns_python.notifications import NotificationListener
+
+from pplns_python.stream import InputStream
+
+class NotificationServer:
+
+  '''
+  Local stand-in for the notification endpoint. Each connection streams the events put into events,
+  None closes the connection.
+  '''
+
+  def __init__(self) -> None:
+
+    self.events : queue.Queue[str | None] = queue.Queue()
+    self.connections : int = 0
+
+    server = self
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+      def do_GET(self) -> None:
+
+        server.connections += 1
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+
+        while True:
+
+          event = server.events.get()
+
+          if event is None:
+            return
+
+          self.wfile.write(event.encode())
+          self.wfile.flush()
+
+      def log_message(self, *args : typing.Any) -> None:
+        pass
+
+    self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    self.httpd.daemon_threads = True
+
+    threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    self.url : str = f'http://127.0.0.1:{self.httpd.server_port}/bundles/events'
+
+  def close(self) -> None:
+
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+@pytest.fixture
+def server():
+
+  server = NotificationServer()
+
+  yield server
+
+  server.events.put(None)
+  server.close()
+
+def wait_for(predicate : typing.Callable[[], bool], timeout : float = 2.0) -> None:
+
+  deadline : float = time.monotonic() + timeout
+
+  while not predicate():
+
+    assert time.monotonic() < deadline
+
+    time.sleep(0.01)
+
+def test_notification_listener(server):
+
+  events : list[tuple[str, str]] = []
+
+  listener = NotificationListener(server.url, reconnect_delay=0.05)
+
+  listener.start(lambda event, data: events.append((event, data)))
+
+  wait_for(lambda: listener.connected)
+
+  server.events.put(': keep-alive\n\n')
+  server.events.put('event: bundles\ndata: {"taskId": "a"}\n\n')
+  server.events.put('data: first line\ndata: second line\n\n')
+
+  wait_for(lambda: len(events) == 3)
+
+  assert events == [
+    ('connected', ''),
+    ('bundles', '{"taskId": "a"}'),
+    ('message', 'first line\nsecond line'),
+  ]
+
+  # the listener reconnects after the server drops the connection
+  server.events.put(None)
+
+  wait_for(lambda: server.connections == 2 and listener.connected)
+
+  assert events[3:] == [('disconnected', ''), ('connected', '')]
+
+  listener.close()
+
+def test_listener_errors(capsys):
+
+  listener = NotificationListener('http://127.0.0.1:1/bundles/events', reconnect_delay=0.01)
+
+  listener.start(lambda event, data: None)
+
+  # connection errors are counted instead of printed
+  wait_for(lambda: listener.stats.get('notifications.errors') >= 2)
+
+  listener.close()
+
+  assert isinstance(listener.last_error, OSError)
+  assert capsys.readouterr().out == ''
+
+class CountingApi:
+
+  def __init__(self) -> None:
+
+    self.polls : int = 0
+
+  def consume(self, query):
+
+    self.polls += 1
+
+    return []
+
+def test_input_stream_notifications(server):
+
+  api = CountingApi()
+
+  listener = NotificationListener(server.url)
+
+  # without notifications, the next poll would only happen after 10s
+  stream = InputStream(api, {}, polling_time=10, max_polling_time=10, notifications=listener)  # type: ignore
+
+  stream.start()
+
+  wait_for(lambda: listener.connected)
+
+  polls : int = api.polls
+
+  server.events.put('event: bundles\ndata: {}\n\n')
+
+  wait_for(lambda: api.polls > polls)
+
+  assert stream.stats.get('notifications.bundles') == 1
+
+  stream.close()
+
+def test_adaptive_polling_time():
+
+  listener = NotificationListener('http://127.0.0.1:1/events')
+
+  stream = InputStream(CountingApi(), {}, polling_time=0.5, max_polling_time=4, notifications=listener)  # type: ignore
+
+  # disconnected: back off while polls are empty, reset once there are bundles
+  assert stream.next_polling_time(0.5, 0) == 1.0
+  assert stream.next_polling_time(4, 0) == 4
+  assert stream.next_polling_time(4, 3) == 0.5
@@ -0,0 +1,74 @@
+
+from pplns_python.partitioning import \
+  Partitioner, \
+  PartitionedQueries
+
+tasks : list[str] = [f'task-{i}' for i in range(1000)]
+
+def test_partitioner_assignment():
+
+  partitioners = [Partitioner(i, 4) for i in range(4)]
+
+  # every task is owned by exactly one replica
+  for task in tasks:
+    assert sum(p.owns(task) for p in partitioners) == 1
+
+  # and the load is spread reasonably evenly
+  for p in partitioners:
+    assert 150 < sum(p.owns(task) for task in tasks) < 350
+
+def test_partitioner_rebalance():
+
+  partitioner = Partitioner(0, 4)
+
+  before = { task: partitioner.owner(task) for task in tasks }
+
+  partitioner.rebalance(0, 5)
+
+  moved = [task for task in tasks if not partitioner.owner(task) == before[task]]
+
+  # consistent hashing only moves the tasks taken over by the new replica
+  assert all(partitioner.owner(task) == 4 for task in moved)
+  assert len(moved) < 350
+
+def test_partitioned_queries():
+
+  now = [0.0]
+  discoveries = []
+
+  def discover(query):
+
+    discoveries.append(query)
+
+    return tasks[:20]
+
+  partition = PartitionedQueries(Partitioner(0, 2), discover, refresh=5.0, clock=lambda: now[0])
+
+  def polled():
+    return [q['taskId'] for q in partition.queries({ 'consumerId': 'consumer' })]
+
+  queries = partition.queries({ 'consumerId': 'consumer' })
+
+  owned = [q['taskId'] for q in queries]
+
+  assert owned
+  assert all(q['consumerId'] == 'consumer' for q in queries)
+  assert all(partition.partitioner.owns(task) for task in owned)
+
+  # tasks that were drained are not polled until the next discovery, busy tasks are polled again
+  for task in owned[1:]:
+    partition.report(task, 1)
+
+  partition.report(owned[0], 5)
+
+  assert polled() == owned[:1]
+
+  partition.report(owned[0], 0)
+
+  assert polled() == []
+  assert len(discoveries) == 1
+
+  now[0] = 5.0
+
+  assert polled() == owned
+  assert len(discoveries) == 2
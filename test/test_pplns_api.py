@@ -1,11 +1,24 @@
 
-from urllib.parse import ParseResult, urlparse
+import json
+import time
+import typing
+
+import pytest
+
+from urllib.parse import ParseResult, urlparse, urlsplit, parse_qs
 
 from pplns_python.testing_utils import \
   TestPipelineApi as PipelineApi
 
 from pplns_python.example_worker import example_worker
 
+from pplns_python.worker_cache import WorkerCache
+
+from pplns_python.rate_limit import \
+  RateLimiter, \
+  TokenBucket, \
+  parse_retry_after
+
 from pplns_types import \
   DataItemWrite  
 
@@ -92,3 +105,277 @@ def test_emit_item_consume_item():
 
 
 
+
+def test_worker_cache(tmp_path) -> None:
+
+  cache = WorkerCache(str(tmp_path))
+
+  worker : typing.Any = { **example_worker, 'createdAt': 'now' }
+
+  assert cache.get('http://example.com/api', example_worker) is None
+
+  cache.put('http://example.com/api', example_worker, worker)
+
+  assert cache.get('http://example.com/api', example_worker) == worker
+
+  # a changed definition or a different API must not hit the cache
+  assert cache.get('http://example.com/api', { **example_worker, 'title': 'changed' }) is None
+  assert cache.get('http://other.com/api', example_worker) is None
+
+  cache.clear()
+
+  assert cache.get('http://example.com/api', example_worker) is None
+
+class ThrottlingClient:
+
+  '''
+  Answers the first request with 429 and Retry-After, all following requests with an empty bundle list.
+  '''
+
+  class Response:
+
+    def __init__(self, status_code : int, headers : dict[str, str]):
+
+      self.status_code = status_code
+      self.headers = { 'Content-Type': 'application/json', **headers }
+
+    def json(self):
+
+      return { 'results': [] }
+
+  def __init__(self):
+
+    self.calls = 0
+
+  def get(self, **params):
+
+    self.calls += 1
+
+    if self.calls == 1:
+      return ThrottlingClient.Response(429, { 'Retry-After': '0.05' })
+
+    return ThrottlingClient.Response(200, {})
+
+def test_retry_after() -> None:
+
+  api = PipelineApi('http://example.com/api')
+
+  client = ThrottlingClient()
+
+  api.client = client
+
+  start = time.monotonic()
+
+  assert api.consume({}) == []
+
+  assert client.calls == 2
+  assert time.monotonic() - start >= 0.05
+  assert api.stats.get('throttled.consume') == 1
+
+def test_get_bundles_response_size() -> None:
+
+  class Client(ThrottlingClient):
+
+    def get(self, **params):
+
+      response = ThrottlingClient.Response(200, {})
+      response.content = json.dumps(response.json()).encode()
+
+      return response
+
+  api = PipelineApi('http://example.com/api')
+
+  api.client = Client()
+
+  assert api.get_bundles({}).nbytes == len('{"results": []}')
+
+  # clients that do not expose the body leave the size unknown
+  api.client = ThrottlingClient()
+
+  api.client.calls = 1
+
+  assert api.get_bundles({}).nbytes is None
+
+def test_token_bucket() -> None:
+
+  bucket = TokenBucket(rate=100, burst=2)
+
+  # the burst is available right away, after that requests are spaced by 1/rate
+  assert bucket.acquire() == 0
+  assert bucket.acquire() == 0
+  assert bucket.acquire() > 0
+
+  limiter = RateLimiter({ 'outputs': (1000, 1) })
+
+  assert limiter.acquire('consume') == 0
+  assert limiter.acquire('outputs') == 0
+
+  limiter.block_for('outputs', 0.05)
+
+  assert limiter.acquire('outputs') >= 0.04
+
+  assert parse_retry_after('2') == 2.0
+  assert parse_retry_after(None) is None
+
+def test_streamed_emit_is_not_retried() -> None:
+
+  class Client(ThrottlingClient):
+
+    def post(self, **params):
+
+      self.data = b''.join(params['data'])
+
+      return self.get(**params)
+
+  api = PipelineApi('http://example.com/api')
+
+  client = Client()
+
+  api.client = client
+
+  assert api.should_stream({ 'outputChannel': 'out', 'done': True, 'data': [1] }) == False
+  assert api.should_stream({ 'outputChannel': 'out', 'done': True, 'data': iter([1]) }) == True
+
+  # the generator is consumed by the first attempt, so the 429 is not retried
+  with pytest.raises(Exception):
+    api.emit_item({}, { 'outputChannel': 'out', 'done': True, 'data': (i for i in range(3)) })
+
+  assert client.calls == 1
+  assert json.loads(client.data)['data'] == [0, 1, 2]
+
+def test_request_timeouts() -> None:
+
+  class Client(ThrottlingClient):
+
+    def get(self, **params):
+
+      self.timeout = params['timeout']
+
+      if params['timeout'] == 0.01:
+        raise TimeoutError()
+
+      return ThrottlingClient.Response(200, {})
+
+  api = PipelineApi('http://example.com/api')
+
+  api.timeouts = { 'consume': (1.0, 2.0) }
+
+  client = Client()
+
+  api.client = client
+
+  api.consume({})
+
+  assert client.timeout == (1.0, 2.0)
+
+  # listing bundles is not budgeted like consuming them
+  api.get_bundles({})
+
+  assert client.timeout == api.timeout
+
+  api.get('workers', **api.build_request('/workers'))
+
+  assert client.timeout == api.timeout
+
+  api.timeouts['consume'] = 0.01
+
+  with pytest.raises(TimeoutError):
+    api.consume({})
+
+  assert api.stats.get('timeouts.consume') == 1
+
+class PagingClient(ThrottlingClient):
+
+  '''
+  Serves bundles by limit and offset, consume=true hands out (and removes) the first bundles.
+  '''
+
+  class StreamedResponse(ThrottlingClient.Response):
+
+    def __init__(self, body : bytes):
+
+      super().__init__(200, {})
+
+      self.body = body
+
+    def iter_content(self, chunk_size):
+
+      for i in range(0, len(self.body), chunk_size):
+        yield self.body[i:i + chunk_size]
+
+    def close(self):
+
+      pass
+
+  def __init__(self, count : int):
+
+    super().__init__()
+
+    self.bundles = [
+      { '_id': f'b{i}', 'taskId': 'task', 'consumptionId': f'c{i}' } for i in range(count)
+    ]
+
+    self.unconsumed : list[str] = []
+    self.timeouts : list[typing.Any] = []
+
+  def get(self, **params):
+
+    self.calls += 1
+    self.timeouts.append(params['timeout'])
+
+    query = parse_qs(urlsplit(params['url']).query)
+
+    limit, offset = int(query['limit'][0]), int(query['offset'][0])
+
+    page = self.bundles[offset:offset + limit]
+
+    if query.get('consume') == ['true']:
+      del self.bundles[offset:offset + limit]
+
+    return PagingClient.StreamedResponse(json.dumps({ 'results': page }).encode())
+
+  def put(self, **params):
+
+    self.unconsumed.append(params['url'].rsplit('/', 1)[-1])
+
+    return ThrottlingClient.Response(200, {})
+
+def test_iter_bundles_paging() -> None:
+
+  api = PipelineApi('http://example.com/api')
+
+  api.timeouts = { 'consume': 1.0, 'bundles': 2.0 }
+
+  client = PagingClient(5)
+
+  api.client = client
+
+  # pages of 2 bundles: offsets 0, 2 and 4, the last page is not full
+  assert [bundle['_id'] for bundle in api.iter_bundles({}, page_size=2, chunk_size=8)] == ['b0', 'b1', 'b2', 'b3', 'b4']
+
+  assert client.calls == 3
+  assert len(client.bundles) == 5
+
+  # listing is budgeted separately from consuming
+  assert client.timeouts == [2.0] * 3
+
+def test_iter_bundles_consume() -> None:
+
+  api = PipelineApi('http://example.com/api')
+
+  client = PagingClient(5)
+
+  api.client = client
+
+  bundles = api.iter_bundles({ 'consume': True }, page_size=2)  # type: ignore
+
+  # consumed bundles drop out of the results, every page starts at offset 0
+  assert [next(bundles)['_id'] for _ in range(3)] == ['b0', 'b1', 'b2']
+
+  # the second page is consumed as a whole
+  assert [bundle['_id'] for bundle in client.bundles] == ['b4']
+
+  # stopping early puts back the consumed bundles of the page that have not been yielded
+  bundles.close()
+
+  assert client.unconsumed == ['b3']
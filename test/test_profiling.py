@@ -0,0 +1,43 @@
+
+import time
+
+from pplns_python.profiling import StackSampler
+
+def busy_work(seconds : float):
+
+  end = time.monotonic() + seconds
+
+  while time.monotonic() < end:
+    time.sleep(0.001)
+
+def test_stack_sampler(tmp_path):
+
+  sampler = StackSampler(str(tmp_path), interval=0.001)
+
+  # stages are not recorded while disabled
+  with sampler.stage('processor'):
+    busy_work(0.01)
+
+  assert sampler.samples() == {}
+
+  sampler.enable()
+
+  with sampler.stage('processor'):
+    busy_work(0.1)
+
+  path = sampler.disable()
+
+  assert path is not None
+
+  with open(path) as f:
+    lines = f.read().splitlines()
+
+  assert len(lines) > 0
+
+  for line in lines:
+
+    stack, count = line.rsplit(' ', 1)
+
+    assert stack.startswith('stage:processor;')
+    assert 'busy_work' in stack
+    assert int(count) > 0
@@ -0,0 +1,146 @@
+
+import json
+import typing
+
+from pplns_python.api import PipelineApi
+
+from pplns_python.capture import \
+  CapturingClient, \
+  read_capture, \
+  route_of
+
+from pplns_python.replay import replay
+
+worker : typing.Any = { '_id': 'replay-worker', 'inputs': { 'in': {} }, 'outputs': { 'out': {} } }
+
+class Response:
+
+  def __init__(self, body : typing.Any):
+
+    self.status_code = 200
+    self.headers = { 'Content-Type': 'application/json' }
+    self.body = body
+
+  def json(self):
+
+    return self.body
+
+class ProductionClient:
+
+  '''
+  Stands in for the production API while capturing: hands out count bundles and echoes written items.
+  '''
+
+  def __init__(self, count : int):
+
+    self.bundles : list[typing.Any] = [
+      {
+        '_id': f'bundle-{i}',
+        'taskId': 'task',
+        'consumerId': 'node',
+        'workerId': worker['_id'],
+        'consumptionId': f'consumption-{i}',
+        'inputItems': [{ 'position': 0, 'inputChannel': 'in', 'itemId': f'item-{i}' }],
+        'items': [{ '_id': f'item-{i}', 'data': [i] }],
+      }
+      for i in range(count)
+    ]
+
+  def get(self, **params):
+
+    bundles, self.bundles = self.bundles, []
+
+    return Response({ 'results': bundles })
+
+  def post(self, **params):
+
+    data = params['data']
+
+    # streamed bodies are sent chunk by chunk
+    body = json.loads(data if isinstance(data, (str, bytes)) else b''.join(data))
+
+    return Response({ **body, '_id': 'item' })
+
+  def put(self, **params):
+
+    return Response({ **json.loads(params['data']), '_id': worker['_id'] })
+
+def capture(path : str, count : int, **api_args) -> None:
+
+  api = PipelineApi('http://example.com/api', 'secret-key', **api_args)
+
+  client = CapturingClient(ProductionClient(count), path)
+
+  api.client = client
+
+  api.register_worker(worker)
+
+  for bundle in api.consume({ 'workerId': worker['_id'] }):
+
+    api.emit_item(
+      { 'nodeId': bundle['consumerId'], 'taskId': bundle['taskId'] },
+      { 'outputChannel': 'out', 'done': True, 'data': [2 * bundle['items'][0]['data'][0]], 'consumptionId': bundle['consumptionId'] }
+    )
+
+  client.close()
+
+def test_capture(tmp_path):
+
+  path = str(tmp_path / 'capture.jsonl')
+
+  capture(path, 3)
+
+  records = read_capture(path)
+
+  assert [r['route'] for r in records] == ['workers', 'consume', 'outputs', 'outputs', 'outputs']
+  assert records[0]['t'] == 0
+  assert len(records[1]['response']['results']) == 3
+  assert records[2]['body']['data'] == [0]
+
+  # headers, and with them the API key, are not recorded
+  assert not 'secret-key' in open(path).read()
+
+  assert route_of('put', 'http://x/api/tasks/t/bundles/b') == 'unconsume'
+  assert route_of('get', 'http://x/api/bundles?consume=true') == 'consume'
+  assert route_of('get', 'http://x/api/bundles?taskId=t') == 'bundles'
+  assert route_of('get', 'http://x/api/tasks/t') == 'tasks'
+
+def test_replay(tmp_path):
+
+  path = str(tmp_path / 'capture.jsonl')
+
+  capture(path, 20)
+
+  report = replay(read_capture(path), speed=0, timeout=10, polling_time=0.01)
+
+  assert report['bundles'] == 20
+  assert report['emitted'] == 20
+  assert report['requests']['outputs'] == 20
+  assert report['latency']['p50'] is not None
+  assert report['throughput'] > 0
+
+def test_capture_streamed(tmp_path):
+
+  path = str(tmp_path / 'capture.jsonl')
+
+  # every emit is sent as a streamed (chunked) body
+  capture(path, 2, stream_threshold=0)
+
+  records = read_capture(path)
+
+  assert [r['body']['data'] for r in records if r['route'] == 'outputs'] == [[0], [2]]
+
+def test_replay_streamed_outputs(tmp_path):
+
+  path = str(tmp_path / 'capture.jsonl')
+
+  capture(path, 5)
+
+  # generator data is always emitted as a chunked body
+  processor = lambda inp: { 'out': { 'data': (x for x in [1, 2]), 'done': True } }
+
+  report = replay(read_capture(path), processor, speed=0, timeout=10, polling_time=0.01)
+
+  assert report['emitted'] == 5
+  assert report['requests']['outputs'] == 5
+  assert not 'unconsume' in report['requests']
@@ -0,0 +1,193 @@
+
+import argparse
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from pplns_python.supervisor import \
+  Supervisor, \
+  load_object, \
+  parse_args, \
+  poll_until_stopped
+
+from pplns_python.stats import Stats
+
+from pplns_python.example_worker import example_worker
+
+def test_load_object():
+
+  assert load_object('pplns_python.example_worker:example_worker') is example_worker
+  assert load_object('os.path:join.__name__') == 'join'
+
+def test_parse_args():
+
+  args = parse_args(
+    [
+      'my_module:processor',
+      '--worker', 'pplns_python.example_worker:example_worker',
+      '--api', 'http://localhost:1337',
+      '--processes', '3',
+    ]
+  )
+
+  assert args.processor == 'my_module:processor'
+  assert args.processes == 3
+  assert args.query is None
+
+def test_parse_args_replicas():
+
+  argv = [
+    'my_module:processor',
+    '--worker', 'pplns_python.example_worker:example_worker',
+    '--api', 'http://localhost:1337',
+  ]
+
+  assert parse_args(argv).replica_count is None
+
+  args = parse_args(argv + ['--replica-count', '4', '--replica-index', '3'])
+
+  assert args.replica_count == 4
+  assert args.replica_index == 3
+
+  with pytest.raises(SystemExit):
+    parse_args(argv + ['--replica-count', '4', '--replica-index', '4'])
+
+class FakeStream:
+
+  '''
+  Records the calls poll_until_stopped makes, poll raises the given errors in turn (None for a successful poll).
+  '''
+
+  def __init__(self, errors=(), on_poll=None):
+
+    self.errors = list(errors)
+    self.on_poll = on_poll
+    self.polls = 0
+    self.calls = []
+    self.stats = Stats()
+
+  def poll(self):
+
+    self.polls += 1
+
+    if self.on_poll:
+      self.on_poll(self)
+
+    error = self.errors.pop(0) if self.errors else None
+
+    if error:
+      raise error
+
+  def drain(self, timeout):
+
+    self.calls.append('drain')
+
+    return True
+
+  def close(self):
+
+    self.calls.append('close')
+
+def worker_args(**overrides):
+
+  return argparse.Namespace(
+    **{ 'polling_time': 0, 'metrics_interval': 0, 'max_poll_errors': 3, 'drain_timeout': 1.0, **overrides }
+  )
+
+def test_sigterm_drains_stream():
+
+  stop = threading.Event()
+
+  previous = signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+  def on_poll(stream):
+
+    if stream.polls == 3:
+      os.kill(os.getpid(), signal.SIGTERM)
+
+  try:
+
+    stream = FakeStream(on_poll=on_poll)
+
+    reports = []
+
+    poll_until_stopped(stream, stop, worker_args(), 0, lambda: reports.append(stream.polls))  # type: ignore
+
+  finally:
+
+    signal.signal(signal.SIGTERM, previous)
+
+  assert stream.polls == 3
+  assert stream.calls == ['drain', 'close']
+  assert reports
+
+def test_poll_errors_drain_stream():
+
+  # a transient error is retried
+  stop = threading.Event()
+
+  stream = FakeStream([TimeoutError(), None, TimeoutError()], on_poll=lambda stream: stream.polls == 4 and stop.set())
+
+  poll_until_stopped(stream, stop, worker_args(), 0, lambda: None)  # type: ignore
+
+  assert stream.stats.get('poll_errors') == 2
+  assert stream.calls == ['drain', 'close']
+
+  # persistent errors end the process, but only after draining and closing the stream
+  stream = FakeStream([TimeoutError('down')] * 5)
+
+  with pytest.raises(TimeoutError):
+    poll_until_stopped(stream, threading.Event(), worker_args(), 0, lambda: None)  # type: ignore
+
+  assert stream.polls == 3
+  assert stream.calls == ['drain', 'close']
+
+def test_restart_backoff(monkeypatch):
+
+  class FakeProcess:
+
+    exitcode = 1
+
+    def is_alive(self):
+      return False
+
+  supervisor = Supervisor(worker_args(processes=1), max_restart_delay=4.0)
+
+  spawned = []
+
+  def spawn(index):
+
+    spawned.append(index)
+
+    supervisor.children[index] = FakeProcess()  # type: ignore
+    supervisor.started_at[index] = time.monotonic()
+
+  monkeypatch.setattr(supervisor, 'spawn', spawn)
+
+  spawn(0)
+
+  delays = []
+
+  for _ in range(5):
+
+    supervisor.check_children()
+
+    delays.append(supervisor.restart_at[0] - time.monotonic())
+
+    # the restart is due
+    supervisor.restart_at[0] = 0
+
+    supervisor.check_children()
+
+  assert spawned == [0] * 6
+  assert [round(delay) for delay in delays] == [0, 1, 3, 4, 4]
+
+  # no restarts while stopping
+  supervisor.stopping = True
+
+  supervisor.check_children()
+
+  assert supervisor.children == {}
@@ -0,0 +1,55 @@
+
+import json
+import typing
+
+from pplns_python.tracing import \
+  JsonlExporter, \
+  Tracer, \
+  span
+
+bundle : typing.Any = { '_id': 'bundle', 'taskId': 'task' }
+
+def test_tracer_sampling(tmp_path):
+
+  exporter = JsonlExporter(str(tmp_path / 'traces.jsonl'))
+
+  assert Tracer(exporter, sample_rate=0).start(bundle, 0, 1) is None
+
+  # span on an unsampled bundle is a no-op
+  with span(None, 'processor'):
+    pass
+
+  exporter.close()
+
+def test_jsonl_exporter(tmp_path):
+
+  path = str(tmp_path / 'traces.jsonl')
+
+  exporter = JsonlExporter(path)
+  tracer = Tracer(exporter, sample_rate=1)
+
+  trace = tracer.start(bundle, 1.0, 2.0)
+
+  assert trace is not None
+
+  trace.mark('queue')
+  trace.end_mark('queue')
+
+  with span(trace, 'processor'):
+    pass
+
+  tracer.finish(trace, 'ok')
+
+  exporter.close()
+
+  with open(path) as f:
+    records = [json.loads(line) for line in f]
+
+  assert len(records) == 1
+
+  record = records[0]
+
+  assert record['bundleId'] == 'bundle'
+  assert record['status'] == 'ok'
+  assert [s['name'] for s in record['spans']] == ['consume', 'queue', 'processor']
+  assert record['spans'][0]['duration'] == 1.0
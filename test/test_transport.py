@@ -0,0 +1,148 @@
+
+import http.server
+import json
+import os
+import socketserver
+import tempfile
+import threading
+import typing
+
+from urllib.parse import quote
+
+import pytest
+
+from pplns_python.api import PipelineApi
+
+from pplns_python.transport import \
+  UnixSocketTransport, \
+  default_transport
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+  '''
+  Answers consume with two bundles and echoes written bodies, closes the connection when asked to by the path.
+  '''
+
+  protocol_version = 'HTTP/1.1'
+
+  server : typing.Any
+
+  def setup(self) -> None:
+
+    super().setup()
+
+    self.server.connections += 1
+
+  def read_body(self) -> bytes:
+
+    if self.headers.get('Transfer-Encoding') == 'chunked':
+
+      body : bytes = b''
+
+      while True:
+
+        size : int = int(self.rfile.readline().strip(), 16)
+
+        chunk : bytes = self.rfile.read(size + 2)[:size]
+
+        if size == 0:
+          return body
+
+        body += chunk
+
+    return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+  def respond(self, body : typing.Any) -> None:
+
+    encoded : bytes = json.dumps(body).encode()
+
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(encoded)))
+
+    if self.path.endswith('/close'):
+      self.send_header('Connection', 'close')
+
+    self.end_headers()
+    self.wfile.write(encoded)
+
+  def do_GET(self) -> None:
+
+    self.server.paths.append(self.path)
+
+    if self.path.startswith('/bundles'):
+      self.respond({ 'results': [{ '_id': 'a' }, { '_id': 'b' }] })
+    else:
+      self.respond({ '_id': self.path.rsplit('/', 1)[-1], 'params': {} })
+
+  def do_POST(self) -> None:
+
+    self.server.paths.append(self.path)
+
+    self.respond({ **json.loads(self.read_body()), '_id': 'item' })
+
+  def log_message(self, *args : typing.Any) -> None:
+    pass
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+  daemon_threads = True
+
+  connections : int = 0
+
+@pytest.fixture
+def server():
+
+  socket_path = os.path.join(tempfile.mkdtemp(), 'pplns.sock')
+
+  server = UnixServer(socket_path, Handler)
+  server.paths = []  # type: ignore
+
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+
+  yield server
+
+  server.shutdown()
+  server.server_close()
+
+  os.unlink(socket_path)
+
+def unix_url(server) -> str:
+
+  return f'http+unix://{quote(server.server_address, safe="")}/api'
+
+def test_unix_socket_transport(server):
+
+  api = PipelineApi(unix_url(server), 'key', stream_threshold=2)
+
+  assert isinstance(api.client, UnixSocketTransport)
+  assert default_transport('http://localhost/api') is None
+
+  assert api.get_task('t1')['_id'] == 't1'
+
+  assert [bundle['_id'] for bundle in api.consume({ 'workerId': 'w' })] == ['a', 'b']
+
+  # streamed response
+  assert [bundle['_id'] for bundle in api.iter_bundles({ 'workerId': 'w' }, page_size=10)] == ['a', 'b']
+
+  # streamed (chunked) request body
+  item = api.emit_item({ 'nodeId': 'n', 'taskId': 't' }, { 'outputChannel': 'out', 'done': True, 'data': [1, 2, 3] })  # type: ignore
+
+  assert item['data'] == [1, 2, 3]
+
+  assert server.paths[1] == '/bundles?consume=true&workerId=w'
+
+  # all requests of this thread went over one connection
+  assert server.connections == 1
+
+def test_unix_socket_reconnect(server):
+
+  api = PipelineApi(unix_url(server), 'key')
+
+  api.get_task('close')
+
+  # the server closed the connection, the next request opens a new one
+  api.get_task('t1')
+  api.get_task('t2')
+
+  assert server.connections == 2
@@ -0,0 +1,87 @@
+
+import pytest
+
+from pplns_python.example_worker import example_worker
+
+from pplns_python.processor import \
+  BundleRef, \
+  PreparedInput
+
+from pplns_python.validation import \
+  Validation, \
+  ValidationError, \
+  WorkerValidator, \
+  compile_schema
+
+def test_compile_schema():
+
+  check = compile_schema(
+    {
+      'type': 'object',
+      'required': ['label'],
+      'properties': {
+        'label': { 'type': 'string', 'minLength': 1 },
+        'score': { 'type': 'number', 'minimum': 0, 'maximum': 1 },
+        'tags': { 'type': 'array', 'items': { 'enum': ['a', 'b'] } },
+      },
+      'additionalProperties': False,
+    }
+  )
+
+  assert check({ 'label': 'cat', 'score': 0.5, 'tags': ['a'] }) is None
+
+  assert check('cat') == 'expected object, got str'
+  assert check({ 'score': 0.5 }) == 'missing property label'
+  assert check({ 'label': '' }) == 'label: length 0 violates minLength 1'
+  assert check({ 'label': 'cat', 'score': 2 }) == 'score: 2 violates maximum 1'
+  assert check({ 'label': 'cat', 'tags': ['c'] }) == "tags: [0]: 'c' is not one of ['a', 'b']"
+  assert check({ 'label': 'cat', 'other': 1 }) == 'unexpected property other'
+
+  # booleans are not numbers, unknown keywords are ignored
+  assert compile_schema({ 'type': 'integer' })(True) is not None
+  assert compile_schema({ 'type': ['integer', 'null'], 'format': 'x' })(None) is None
+  assert compile_schema({})(object()) is None
+
+def test_worker_validator():
+
+  validator = WorkerValidator({ **example_worker, 'outputs': { 'out': { 'type': 'number' } } })
+
+  inp = PreparedInput(BundleRef('b', 't', 'n'), { 'in0': { 'data': ['a', 'b'] } }, {})  # type: ignore
+
+  validator.check_input(inp)
+
+  with pytest.raises(ValidationError) as e:
+    validator.check_input(PreparedInput(BundleRef('b', 't', 'n'), { 'in0': { 'data': ['a', 1] } }, {}))  # type: ignore
+
+  assert e.value.channel == 'in0'
+  assert 'data[1]: expected string' in str(e.value)
+
+  validator.check_output('out', { 'data': [1, 2.5] })
+
+  with pytest.raises(ValidationError):
+    validator.check_output('out', { 'data': ['1'] })
+
+  with pytest.raises(ValidationError):
+    validator.check_output('unknown', { 'data': [] })
+
+  # generators (streamed uploads) are not consumed
+  data = (x for x in ['1'])
+
+  validator.check_output('out', { 'data': data })
+
+  assert next(data) == '1'
+
+def test_validation_sampling():
+
+  assert all(Validation('full').sample() for _ in range(10))
+  assert not any(Validation('off').sample() for _ in range(10))
+  assert not any(Validation('sampled', 0.0).sample() for _ in range(10))
+
+  validation = Validation()
+
+  worker = { **example_worker }
+
+  assert validation.validator(worker) is validation.validator(worker)
+
+  # a changed definition under the same _id is compiled again
+  assert not validation.validator(worker) is validation.validator({ **worker })